@@ -1,6 +1,7 @@
 DUMPER_VERSION = '0.0.19'
 
 from pukiWikiDumper.exceptions import VersionOutdatedError
+from pukiWikiDumper.utils.util import print_with_lock as print
 
 
 def get_latest_version():
@@ -0,0 +1,35 @@
+import argparse
+import sys
+
+from pukiWikiDumper.dump.content.history import load_history
+from pukiWikiDumper.dump.content.storage import unpack
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert packed page sources (wikipack/) to the wiki/ layout, '
+                                     'or print a page revision from history/.')
+    parser.add_argument('command', choices=['unpack', 'history'])
+    parser.add_argument('dump_dir', help='Path to the wiki dump directory.')
+    parser.add_argument('title', nargs='?', help='history: page title')
+    parser.add_argument('--age', type=int, help='history: print the source of this backup age [default: list ages]')
+    args = parser.parse_args()
+
+    if args.command == 'unpack':
+        unpack(args.dump_dir.rstrip('/'))
+    elif args.command == 'history':
+        if not args.title:
+            parser.error('history: title is required')
+        revisions = load_history(args.dump_dir.rstrip('/'), args.title)
+        if args.age is None:
+            for rev in revisions:
+                print(rev['age'], rev['time'])
+            return
+        for rev in revisions:
+            if rev['age'] == args.age:
+                sys.stdout.write(rev['text'])
+                return
+        parser.error('history: no age %d for %s' % (args.age, args.title))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,116 +1,184 @@
-import json
 import os
-import time
-import threading
-from typing import Dict
+from typing import Dict, Optional
 
 from requests import Session
 
 from pukiWikiDumper.exceptions import ActionEditDisabled, ActionEditTextareaNotFound
 
-from .revisions import get_source_diff, get_source_edit, get_source_source
-from .titles import get_pages
-from pukiWikiDumper.utils.util import load_pages, smkdirs, uopen
+from .revisions import SOURCE_ACTIONS, build_action_url
+from .incremental import incremental_pages, record_enumeration_start
+from .storage import DirPageStore
+from .strategy import SourceStrategy
+from .titles import get_pages, iter_pages
+from pukiWikiDumper.utils.async_engine import AsyncEngine
+from pukiWikiDumper.utils.journal import DONE, FAILED, SKIPPED, Journal
+from pukiWikiDumper.utils.log import log
+from pukiWikiDumper.utils.scheduler import Scheduler
+from pukiWikiDumper.utils.steps import Steps, drive, drive_async
+from pukiWikiDumper.utils.util import count_lines, iter_saved_pages, save_pages_as_we_go
 from pukiWikiDumper.utils.util import print_with_lock as print
 
 
-sub_thread_error = None
-
-
 def dump_content(puki_url: str = '', dumpDir: str = '', session: Session = None,
                 threads: int = 1, ignore_errors: bool = False, ignore_action_disabled_edit: bool = False,
-                current_only: bool = False):
+                current_only: bool = False, engine: Optional[AsyncEngine] = None, store=None,
+                since_dump: str = '', retry_failed: bool = False):
+    """ `store`: where to save page sources, see `storage.open_page_store()` [default: `wiki/` files]
+    `since_dump`: a previous dump of the same wiki, only new or changed pages are fetched
+    `retry_failed`: only re-run the pages the progress journal has as failed """
     if not dumpDir:
         raise ValueError('dumpDir must be set')
-
-    pages = load_pages(pagesFilePath=dumpDir + '/dumpMeta/pages.jsonl')
-    if pages is None:
-        pages = get_pages(url=puki_url, session=session)
-        with uopen(dumpDir + '/dumpMeta/pages.jsonl', 'w') as f:
-            for page in pages:
-                f.write(json.dumps(page, ensure_ascii=False) + '\n')
-
-    if not len(pages):
-        print('Empty wiki')
-        return False
-
-    def try_dump_page(*args, **kwargs):
-        try:
-            dump_page(*args, **kwargs)
-        except Exception as e:
-            if isinstance(e, ActionEditDisabled) and ignore_action_disabled_edit:
-                print('[',args[2],'] action disabled: edit. ignored')
-            elif isinstance(e, ActionEditTextareaNotFound) and ignore_action_disabled_edit:
-                print('[',args[2],'] action edit: textarea not found. ignored')
-            elif not ignore_errors:
-                global sub_thread_error
-                sub_thread_error = e
-                raise e
+    store = DirPageStore(dumpDir) if store is None else store
+
+    pagesFilePath = dumpDir + '/dumpMeta/pages.jsonl'
+    total: Optional[int] = None # unknown while enumerating
+    if os.path.exists(pagesFilePath):
+        total = count_lines(pagesFilePath)
+        pages = iter_saved_pages(pagesFilePath)
+    elif since_dump:
+        record_enumeration_start(dumpDir)
+        # needs the whole list to tell what changed
+        pages = get_pages(url=puki_url, session=session, with_passage=True)
+        incremental_pages(since_dump, puki_url, pages, store, session, history=not current_only)
+        for page in pages:
+            page.pop('passage', None)
+        # written after the carry-over, so an interrupted carry-over is redone on resume
+        pages = list(save_pages_as_we_go(pagesFilePath, pages))
+        total = len(pages)
+    else:
+        record_enumeration_start(dumpDir)
+        # fetching starts as soon as the first title is decoded
+        pages = save_pages_as_we_go(pagesFilePath, iter_pages(url=puki_url, session=session))
+
+    def handle_action_disabled(page: Dict[str, str], e: Exception) -> bool:
+        """ print and return `True` if `e` is ignored """
+        if isinstance(e, ActionEditDisabled) and ignore_action_disabled_edit:
+            print('[',page,'] action disabled: edit. ignored')
+        elif isinstance(e, ActionEditTextareaNotFound) and ignore_action_disabled_edit:
+            print('[',page,'] action edit: textarea not found. ignored')
+        else:
+            return False
+        return True
+
+    strategy = SourceStrategy(dumpDir)
+
+    with Journal(dumpDir, 'content') as journal:
+        counts = {'pages': 0, 'finished': 0}
+        if total is not None and not retry_failed:
+            log.progress_total('Content', total)
+
+        def progress(pages):
+            """ pages to (re-)fetch, `pages` is only read as far as the workers got """
+            for index, page in enumerate(pages):
+                counts['pages'] += 1
+                if retry_failed:
+                    if journal.status(page['title']) != FAILED:
+                        continue
+                elif journal.is_finished(page['title']):
+                    counts['finished'] += 1
+                    log.progress('Content', done=0, skipped=1)
+                    continue
+                log.debug('Content: (%d/%s): [[%s]] ...' % (index + 1, total or '?', page))
+                yield page
+            if total is None and not retry_failed: # all titles enumerated
+                log.progress_total('Content', counts['pages'])
+
+        def record(page: Dict[str, str], e: Optional[Exception]):
+            log.progress('Content')
+            if e is None:
+                journal.record(page['title'], DONE)
+            elif isinstance(e, (ActionEditDisabled, ActionEditTextareaNotFound)) and handle_action_disabled(page, e):
+                journal.record(page['title'], SKIPPED, e)
             else:
-                print('[',args[2],']Error in sub thread: (', e, ') ignored')
-    ts = pages.copy()
-    while ts:
-        page = ts.pop(0)
-        while threading.active_count() > threads:
-            time.sleep(0.05)
-        if sub_thread_error:
-            raise sub_thread_error
-        getSource = [get_source_source, get_source_edit, get_source_diff]
-        t = threading.Thread(target=try_dump_page, args=(dumpDir,
-                                                     getSource,
-                                                     page,
-                                                     puki_url,
-                                                     session,
-                                                     current_only,
-                                                     ))
-        print('Content: (%d/%d): [[%s]] ...' % (len(pages) - len(ts), len(pages), page))
-        t.daemon = True
-        t.start()
-
-    while threading.active_count() > 1:
-        time.sleep(2)
-        print('Waiting for %d threads to finish' %
-              (threading.active_count() - 1), end='\r')
-
-
-def dump_page(dumpDir: str,
-              getSource,
-              page: Dict[str, str],
-              puki_url: str,
-              session: Session,
-              current_only: bool,):
+                journal.record(page['title'], FAILED, e)
+                raise e
+
+        if engine is not None:
+            async def try_dump_page_async(engine: AsyncEngine, page: Dict[str, str]):
+                try:
+                    await dump_page_async(engine, store, strategy, page, puki_url, current_only)
+                except Exception as e:
+                    record(page, e)
+                else:
+                    record(page, None)
+
+            errors = engine.run(try_dump_page_async, progress(pages), ignore_errors=ignore_errors)
+        else:
+            def try_dump_page(page: Dict[str, str]):
+                try:
+                    dump_page(store, strategy, page, puki_url, session, current_only)
+                except Exception as e:
+                    record(page, e)
+                else:
+                    record(page, None)
+
+            with Scheduler(workers=threads, ignore_errors=ignore_errors, name='content') as scheduler:
+                for page in progress(pages):
+                    scheduler.submit(try_dump_page, page)
+            errors = scheduler.errors
+
+        log.progress_end('Content')
+        if not counts['pages']:
+            print('Empty wiki')
+            return False
+        if counts['finished']:
+            print('Content: %d pages were already finished (progress journal)' % counts['finished'])
+        print('Content: source actions (success, failure):', strategy.stats)
+        print('Content: progress journal:', journal.counts())
+    if errors:
+        print('Content: %d pages failed (ignored), use --retry-failed to try them again' % len(errors))
+
+
+def dump_page_steps(store: DirPageStore,
+                    strategy: SourceStrategy,
+                    page: Dict[str, str],
+                    puki_url: str,
+                    current_only: bool,
+                    where: str = 'sub thread') -> Steps[None]:
+    """ `dump_page()` for either engine, see `utils.steps` """
     msg_header = page["title"] + ': '
-    filename = (page['title'].encode('utf-8').hex().upper()) + '.txt'
-    if len(filename) > 255: # filename too long
-        subdir_A = filename[:255]
-        subfilename_B = filename[255:]
-        smkdirs(dumpDir, '/wiki/' + subdir_A)
-        filepath = dumpDir + '/wiki/' + subdir_A + '/' + subfilename_B
-    else:
-        filepath = dumpDir + '/wiki/' + filename
-    if os.path.exists(filepath):
-        print(msg_header, '    [[%s]] exists. skip' % (page['title']))
+    if store.exists(page['title']):
+        log.debug(msg_header, '    [[%s]] exists. skip' % (page['title']))
         return
 
     srouce = None
     err = None
-    for action in getSource:
+    for cmd in strategy.actions():
         try:
-            srouce = action(puki_url, page, session=session)
+            r = yield build_action_url(puki_url, page, cmd)
+            srouce = SOURCE_ACTIONS[cmd](r, page)
+            strategy.record(cmd, success=True)
             break
         except Exception as e:
-            print(msg_header, str(action), '    Error in sub thread: (', e, ') ignored')
+            if isinstance(e, (ActionEditDisabled, ActionEditTextareaNotFound)):
+                strategy.record(cmd, success=False)
+            print(msg_header, cmd, '    Error in %s: (' % where, e, ') ignored')
             err = e
             continue
     if srouce is None:
         raise err
 
-
-    smkdirs(dumpDir, '/wiki/')
-
-    with uopen(filepath, 'w') as f:
-        f.write(srouce)
+    store.save(page['title'], srouce)
 
     if current_only:
-        print(msg_header, '    [[%s]] saved.' % (page['title']))
+        log.debug(msg_header, '    [[%s]] saved.' % (page['title']))
         return
+
+
+def dump_page(store: DirPageStore,
+              strategy: SourceStrategy,
+              page: Dict[str, str],
+              puki_url: str,
+              session: Session,
+              current_only: bool,):
+    drive(dump_page_steps(store, strategy, page, puki_url, current_only), session.get)
+
+
+async def dump_page_async(engine: AsyncEngine,
+                          store: DirPageStore,
+                          strategy: SourceStrategy,
+                          page: Dict[str, str],
+                          puki_url: str,
+                          current_only: bool,):
+    """ `dump_page()` for `--engine async` """
+    await drive_async(dump_page_steps(store, strategy, page, puki_url, current_only, where='coroutine'), engine.get)
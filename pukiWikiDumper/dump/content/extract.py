@@ -0,0 +1,106 @@
+import codecs
+import html
+import re
+from typing import Optional
+
+from pukiWikiDumper.utils.encoding import sniff_encoding, widen_euc_jp
+
+# How PukiWiki renders the page source:
+#   cmd=source: <pre id="source">...</pre>
+#   cmd=edit:   <textarea name="msg" ...>...</textarea>
+#   cmd=diff:   <pre><span class="diff_removed">-...</span><span class="diff_added">+...</span> ...</pre>
+#   cmd=backup&age=N&action=source: <pre>...</pre>
+# The extractors below work on the raw response bytes and return `None` whenever
+# they are unsure, so the caller can fall back to BeautifulSoup.
+
+_RE_PRE_SOURCE = re.compile(rb'<pre\s(?:[^>]*\s)?id\s*=\s*["\']?source["\']?(?:\s[^>]*)?>(.*?)</pre\s*>', re.I | re.S)
+_RE_TEXTAREA_MSG = re.compile(rb'<textarea\s(?:[^>]*\s)?name\s*=\s*["\']?msg["\']?(?:\s[^>]*)?>(.*?)</textarea\s*>', re.I | re.S)
+_RE_PRE = re.compile(rb'<pre(?:\s[^>]*)?>(.*?)</pre\s*>', re.I | re.S)
+
+_RE_DIFF_REMOVED = re.compile(rb'<span\s+class\s*=\s*["\']diff_removed["\']\s*>[^<]*</span\s*>', re.I)
+_RE_SPAN_TAG = re.compile(rb'</?span(?:\s[^>]*)?>', re.I)
+
+def resolve_encoding(content: bytes, header_encoding: Optional[str] = None) -> Optional[str]:
+    """ The encoding to decode `content` with, or `None` if the declarations disagree
+    or the encoding is not ASCII-compatible. EUC-JP is widened to `euc_jisx0213`. """
+    declared = sniff_encoding(content)
+    header = header_encoding.lower() if header_encoding else None
+    if header == 'iso-8859-1': # requests' default for text/* without charset
+        header = None
+
+    try:
+        candidates = {codecs.lookup(widen_euc_jp(e)).name for e in (declared, header) if e}
+    except LookupError:
+        return None
+    if len(candidates) > 1:
+        return None
+    encoding = candidates.pop() if candidates else 'utf-8'
+
+    encoding = widen_euc_jp(encoding)
+    # multi-byte encodings like UTF-16 would break the bytes-level matching
+    if 'a<'.encode(encoding) != b'a<':
+        return None
+    return encoding
+
+
+def _in_comment_or_script(content: bytes, pos: int) -> bool:
+    start = content.rfind(b'<!--', 0, pos)
+    if start != -1 and content.find(b'-->', start, pos) == -1:
+        return True
+    start = content.rfind(b'<script', 0, pos)
+    if start != -1 and content.find(b'</script', start, pos) == -1:
+        return True
+    return False
+
+
+def _only_match(regex, content: bytes) -> Optional[re.Match]:
+    m = regex.search(content)
+    if m is None or _in_comment_or_script(content, m.start()):
+        return None
+    if regex.search(content, m.end()) is not None: # ambiguous
+        return None
+    return m
+
+
+def _decode(inner: bytes, encoding: str) -> Optional[str]:
+    if b'<' in inner: # markup inside, let BeautifulSoup handle it
+        return None
+    try:
+        text = inner.decode(encoding, errors='strict')
+    except UnicodeDecodeError:
+        return None
+    text = html.unescape(text).strip()
+    return text if text else None
+
+
+def extract_source(content: bytes, cmd: str, header_encoding: Optional[str] = None) -> Optional[str]:
+    """ Extract the page source of a `cmd=source|edit|diff|backup` response, or `None` if unsure. """
+    encoding = resolve_encoding(content, header_encoding)
+    if encoding is None:
+        return None
+
+    if cmd == 'source':
+        m = _only_match(_RE_PRE_SOURCE, content)
+        return _decode(m.group(1), encoding) if m else None
+
+    if cmd == 'edit':
+        m = _only_match(_RE_TEXTAREA_MSG, content)
+        return _decode(m.group(1), encoding) if m else None
+
+    if cmd == 'diff':
+        # BeautifulSoup: soup.find('pre'), the first one
+        m = _RE_PRE.search(content)
+        if m is None or _in_comment_or_script(content, m.start()):
+            return None
+        inner = _RE_DIFF_REMOVED.sub(b'', m.group(1))
+        if b'diff_removed' in inner:
+            return None
+        return _decode(_RE_SPAN_TAG.sub(b'', inner), encoding)
+
+    if cmd == 'backup':
+        m = _RE_PRE.search(content)
+        if m is None or _in_comment_or_script(content, m.start()):
+            return None
+        return _decode(m.group(1), encoding)
+
+    raise ValueError('Unknown cmd: %s' % cmd)
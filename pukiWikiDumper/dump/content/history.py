@@ -0,0 +1,246 @@
+import difflib
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Union
+import urllib.parse as urlparse
+
+import requests
+
+from pukiWikiDumper.exceptions import BackupSourceNotFound
+from pukiWikiDumper.utils.async_engine import AsyncEngine
+from pukiWikiDumper.utils.journal import DONE, FAILED, Journal
+from pukiWikiDumper.utils.log import log
+from pukiWikiDumper.utils.scheduler import Scheduler
+from pukiWikiDumper.utils.steps import Steps, drive, drive_async
+from pukiWikiDumper.utils.util import count_lines, iter_saved_pages, smkdirs, uopen
+from pukiWikiDumper.utils.util import print_with_lock as print
+
+from .extract import extract_source
+from .revisions import _soup
+from .storage import page_filepath
+
+HISTORY_DIR = 'history'
+
+# <li><a href="./?cmd=backup&amp;page=FrontPage&amp;age=1">1 2005-06-11 (土) 14:12:34</a>
+#   [ <a href="./?cmd=backup&amp;page=FrontPage&amp;age=1&amp;action=diff">差分</a> | ... ]
+BACKUP_TIME_RE = re.compile(r'(\d{4}-\d{2}-\d{2} \(.+?\) \d{2}:\d{2}:\d{2})')
+
+# A delta turns the next (newer) revision into this one, line by line:
+#   n > 0: copy n lines, n < 0: drop -n lines, [str, ...]: insert these lines
+Delta = List[Union[int, List[str]]]
+
+
+def history_filepath(dumpDir: str, title: str) -> str:
+    """ `dumpDir/history/<HEX(title)>.jsonl` """
+    return page_filepath(dumpDir, title, subdir=HISTORY_DIR, suffix='.jsonl')
+
+
+def make_delta(base: str, text: str) -> Delta:
+    """ Delta that turns `base` into `text` """
+    base_lines = base.splitlines(keepends=True)
+    text_lines = text.splitlines(keepends=True)
+    delta: Delta = []
+    matcher = difflib.SequenceMatcher(None, base_lines, text_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            delta.append(i2 - i1)
+            continue
+        if i2 > i1: # replace, delete
+            delta.append(i1 - i2)
+        if j2 > j1: # replace, insert
+            delta.append(text_lines[j1:j2])
+    return delta
+
+
+def apply_delta(base: str, delta: Delta) -> str:
+    base_lines = base.splitlines(keepends=True)
+    lines = []
+    pos = 0
+    for op in delta:
+        if isinstance(op, list):
+            lines.extend(op)
+        elif op > 0:
+            lines.extend(base_lines[pos:pos + op])
+            pos += op
+        else:
+            pos -= op
+    if pos != len(base_lines):
+        raise ValueError('Delta does not match its base revision')
+    return ''.join(lines)
+
+
+def save_history(dumpDir: str, title: str, revisions: List[Dict]):
+    """ Save `[{'age': 1, 'time': ..., 'text': ...}, ...]` (any order).
+
+    The newest backup is stored in full, each older one as a delta against
+    the next newer one (reverse deltas), one JSON line per revision.
+    """
+    revisions = sorted(revisions, key=lambda rev: rev['age'], reverse=True)
+    smkdirs(dumpDir, '/' + HISTORY_DIR)
+    filepath = history_filepath(dumpDir, title)
+    with uopen(filepath + '.tmp', 'w') as f:
+        newer = None
+        for rev in revisions:
+            line = {'age': rev['age'], 'time': rev['time']}
+            if newer is None:
+                line['text'] = rev['text']
+            else:
+                line['delta'] = make_delta(newer['text'], rev['text'])
+            f.write(json.dumps(line, ensure_ascii=False) + '\n')
+            newer = rev
+    os.replace(filepath + '.tmp', filepath)
+
+
+def load_history(dumpDir: str, title: str) -> List[Dict]:
+    """ `[{'age': N, 'time': ..., 'text': ...}, ...]`, newest first """
+    revisions = []
+    with uopen(history_filepath(dumpDir, title), 'r', newline='') as f:
+        for line in f:
+            rev = json.loads(line)
+            if 'delta' in rev:
+                rev['text'] = apply_delta(revisions[-1]['text'], rev.pop('delta'))
+            revisions.append(rev)
+    return revisions
+
+
+def build_backup_url(url, page, age: Optional[int] = None) -> str:
+    """ `?cmd=backup&page=<title>[&age=<age>&action=source]` """
+    params = {'cmd': 'backup', 'page': page['title']}
+    if age is not None:
+        params['age'] = age
+        params['action'] = 'source'
+    return url + '?' + urlparse.urlencode(params, encoding=page['url_encoding'], errors='strict')
+
+
+def parse_backup_list(r: requests.Response, page) -> List[Dict]:
+    """ `[{'age': 1, 'time': '2005-06-11 (土) 14:12:34'}, ...]` from a `cmd=backup` page """
+    soup = _soup(r)
+    backups: Dict[int, Dict] = {}
+    for a in soup.find_all('a', href=True):
+        query = urlparse.parse_qs(urlparse.urlparse(a['href']).query)
+        if query.get('cmd') != ['backup'] or 'age' not in query or 'action' in query:
+            continue
+        try:
+            age = int(query['age'][0])
+        except ValueError:
+            continue
+        m = BACKUP_TIME_RE.search(a.parent.get_text() if a.parent else a.get_text())
+        backups[age] = {'age': age, 'time': m.group(1) if m else None}
+    return [backups[age] for age in sorted(backups)]
+
+
+def parse_backup_source(r: requests.Response, page, age: int) -> str:
+    source = extract_source(r.content, 'backup', r.encoding) # fast path
+    if source is not None:
+        return source
+
+    pre = _soup(r).find('pre')
+    if pre is None:
+        raise BackupSourceNotFound(page['title'], age)
+    return pre.text.strip()
+
+
+def dump_history(puki_url: str = '', dumpDir: str = '', session: requests.Session = None,
+                 threads: int = 1, ignore_errors: bool = False, engine: Optional[AsyncEngine] = None,
+                 retry_failed: bool = False):
+    """ Dump the backups (`cmd=backup`) of every page in `dumpMeta/pages.jsonl` to `history/` """
+    if not dumpDir:
+        raise ValueError('dumpDir must be set')
+
+    pagesFilePath = dumpDir + '/dumpMeta/pages.jsonl'
+    if not os.path.exists(pagesFilePath):
+        print('History: no pages, dump content first')
+        return False
+    total = count_lines(pagesFilePath)
+
+    with Journal(dumpDir, 'history') as journal:
+        if not retry_failed:
+            log.progress_total('History', total)
+
+        def progress(pages):
+            for index, page in enumerate(pages):
+                if retry_failed:
+                    if journal.status(page['title']) != FAILED:
+                        continue
+                elif journal.is_finished(page['title']):
+                    log.progress('History', done=0, skipped=1)
+                    continue
+                log.debug('History: (%d/%d): [[%s]] ...' % (index + 1, total, page))
+                yield page
+
+        def record(page: Dict[str, str], e: Optional[Exception]):
+            log.progress('History')
+            if e is None:
+                journal.record(page['title'], DONE)
+            else:
+                journal.record(page['title'], FAILED, e)
+                raise e
+
+        if engine is not None:
+            async def try_dump_page_history_async(engine: AsyncEngine, page: Dict[str, str]):
+                try:
+                    await dump_page_history_async(engine, page, puki_url, dumpDir)
+                except Exception as e:
+                    record(page, e)
+                else:
+                    record(page, None)
+
+            errors = engine.run(try_dump_page_history_async, progress(iter_saved_pages(pagesFilePath)), ignore_errors=ignore_errors)
+        else:
+            # page workers list the backups, generations are fetched on a shared pool;
+            # `slots` keeps the requests in flight at `threads`
+            slots = threading.BoundedSemaphore(threads)
+            with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='history-age') as executor:
+                def try_dump_page_history(page: Dict[str, str]):
+                    try:
+                        dump_page_history(page, puki_url, dumpDir, session, executor, slots)
+                    except Exception as e:
+                        record(page, e)
+                    else:
+                        record(page, None)
+
+                with Scheduler(workers=threads, ignore_errors=ignore_errors, name='history') as scheduler:
+                    for page in progress(iter_saved_pages(pagesFilePath)):
+                        scheduler.submit(try_dump_page_history, page)
+            errors = scheduler.errors
+
+        log.progress_end('History')
+        print('History: progress journal:', journal.counts())
+    if errors:
+        print('History: %d pages failed (ignored), use --retry-failed to try them again' % len(errors))
+
+
+def page_history_steps(page: Dict[str, str], puki_url: str, dumpDir: str) -> Steps[None]:
+    """ `dump_page_history()` for either engine, see `utils.steps`. The generations are fetched together. """
+    msg_header = page["title"] + ': '
+    if os.path.exists(history_filepath(dumpDir, page['title'])):
+        log.debug(msg_header, '    history exists. skip')
+        return
+
+    backups = parse_backup_list((yield build_backup_url(puki_url, page)), page)
+    if not backups:
+        log.debug(msg_header, '    no backups')
+        return
+
+    responses = yield [build_backup_url(puki_url, page, backup['age']) for backup in backups]
+    revisions = [{**backup, 'text': parse_backup_source(r, page, backup['age'])}
+                 for backup, r in zip(backups, responses)]
+    save_history(dumpDir, page['title'], revisions)
+    log.debug(msg_header, '    %d backups saved.' % len(revisions))
+
+
+def dump_page_history(page: Dict[str, str], puki_url: str, dumpDir: str, session: requests.Session,
+                      executor: ThreadPoolExecutor, slots: threading.BoundedSemaphore):
+    def get(url: str) -> requests.Response:
+        with slots:
+            return session.get(url)
+
+    drive(page_history_steps(page, puki_url, dumpDir), get, lambda urls: list(executor.map(get, urls)))
+
+
+async def dump_page_history_async(engine: AsyncEngine, page: Dict[str, str], puki_url: str, dumpDir: str):
+    """ `dump_page_history()` for `--engine async`, the engine's slots bound the generations in flight """
+    await drive_async(page_history_steps(page, puki_url, dumpDir), engine.get)
@@ -0,0 +1,170 @@
+import calendar
+import os
+import re
+import shutil
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import requests
+
+from pukiWikiDumper.utils.config import get_config, update_config
+from pukiWikiDumper.utils.util import load_pages
+from pukiWikiDumper.utils.util import print_with_lock as print
+
+from .history import history_filepath
+from .revisions import SOURCE_ACTIONS, build_action_url
+from .storage import CONFIG_CONTENT_STORAGE, DirPageStore, open_page_store, page_filepath
+from .titles import get_pages
+
+RECENT_CHANGES = 'RecentChanges'
+# -2023-03-15 (Wed) 01:42:12 - [[FrontPage]]
+RECENT_CHANGES_RE = re.compile(r'^-(\d{4}-\d{2}-\d{2}) \(\w+\) (\d{2}:\d{2}:\d{2}) - \[\[(.+?)\]\]', re.M)
+# RecentChanges is in the server's local time, which we don't know.
+TIMEZONE_MARGIN = 24 * 60 * 60
+# clock skew between the wiki and us
+CLOCK_MARGIN = 60 * 60
+# when the dump started enumerating its pages (epoch seconds), edits after that may be missing from it
+CONFIG_PAGES_ENUMERATED_AT = 'pages_enumerated_at'
+
+
+def record_enumeration_start(dumpDir: str):
+    """ Call before enumerating the pages: `pages.jsonl` is only complete (and its mtime set)
+    once the workers consumed it, hours later on a large wiki """
+    update_config(dumpDir, {CONFIG_PAGES_ENUMERATED_AT: time.time()})
+
+
+def previous_dump_time(prev_dumpDir: str) -> float:
+    """ When the previous dump started enumerating its pages. Edits after that may be missing from it.
+    Dumps from before `CONFIG_PAGES_ENUMERATED_AT` fall back to the mtime of their `pages.jsonl`. """
+    enumerated_at = get_config(prev_dumpDir).get(CONFIG_PAGES_ENUMERATED_AT)
+    if enumerated_at is not None:
+        return float(enumerated_at)
+    return os.path.getmtime(os.path.join(prev_dumpDir, 'dumpMeta', 'pages.jsonl'))
+
+
+def get_recent_changes(puki_url: str, session: requests.Session) -> Optional[List[Tuple[str, int]]]:
+    """ `(title, timestamp)` from the RecentChanges page, newest first. `None` if unavailable. """
+    page = {'title': RECENT_CHANGES, 'url_encoding': 'utf-8'}
+    for cmd, parse in SOURCE_ACTIONS.items():
+        try:
+            source = parse(session.get(build_action_url(puki_url, page, cmd)), page)
+            break
+        except Exception as e:
+            print('RecentChanges: cmd=%s failed: (' % cmd, e, ')')
+    else:
+        return None
+
+    changes = []
+    for date, clock, title in RECENT_CHANGES_RE.findall(source):
+        timestamp = calendar.timegm(time.strptime(date + ' ' + clock, '%Y-%m-%d %H:%M:%S'))
+        changes.append((title, timestamp))
+    return changes if changes else None
+
+
+def find_changed_pages(pages: List[Dict], prev_titles: Set[str], since: float,
+                       recent_changes: Optional[List[Tuple[str, int]]] = None) -> Optional[Set[str]]:
+    """ Titles that are new or may have changed after `since`.
+
+    Uses the `passage` from `cmd=list` (see `get_pages(with_passage=True)`) when the
+    wiki shows it, otherwise RecentChanges. Returns `None` if neither can tell.
+    """
+    elapsed = time.time() - since + CLOCK_MARGIN
+    changed = {page['title'] for page in pages if page['title'] not in prev_titles}
+
+    if all(page.get('passage') is not None for page in pages):
+        # passage is rounded down, so `passage >= elapsed` means untouched since `since`
+        changed |= {page['title'] for page in pages if page['passage'] < elapsed}
+        return changed
+
+    if recent_changes:
+        cutoff = since - CLOCK_MARGIN - TIMEZONE_MARGIN
+        if min(timestamp for _, timestamp in recent_changes) > cutoff:
+            print('RecentChanges does not go back to the previous dump.')
+            return None
+        changed |= {title for title, timestamp in recent_changes if timestamp >= cutoff}
+        return changed
+
+    return None
+
+
+def link_or_copy(src: str, dst: str):
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError: # e.g. cross-device
+        shutil.copy2(src, dst)
+
+
+def carry_over(prev_dumpDir: str, store, pages: List[Dict], changed: Set[str]) -> int:
+    """ Copy unchanged pages from the previous dump into `store` (hardlinks if possible) """
+    prev_packed = get_config(prev_dumpDir).get(CONFIG_CONTENT_STORAGE) == 'packed'
+    count = 0
+    with open_page_store(prev_dumpDir, packed=prev_packed) as prev_store:
+        for page in pages:
+            title = page['title']
+            if title in changed or store.exists(title) or not prev_store.exists(title):
+                continue
+            if isinstance(store, DirPageStore) and isinstance(prev_store, DirPageStore):
+                link_or_copy(page_filepath(prev_dumpDir, title), page_filepath(store.dumpDir, title))
+            else:
+                store.save(title, prev_store.read(title))
+            count += 1
+    return count
+
+
+def carry_over_history(prev_dumpDir: str, dumpDir: str, pages: List[Dict], changed: Set[str]) -> int:
+    """ Copy the `history/` of unchanged pages from the previous dump (hardlinks if possible).
+    A page's backups only change when the page is edited. """
+    count = 0
+    for page in pages:
+        title = page['title']
+        if title in changed:
+            continue
+        src = history_filepath(prev_dumpDir, title)
+        dst = history_filepath(dumpDir, title)
+        if os.path.exists(dst) or not os.path.exists(src):
+            continue
+        link_or_copy(src, dst)
+        count += 1
+    return count
+
+
+def incremental_pages(prev_dumpDir: str, puki_url: str, pages: List[Dict], store,
+                      session: requests.Session, history: bool = False) -> int:
+    """ Carry over the pages that didn't change since the dump in `prev_dumpDir`.
+
+    `pages` must come from `get_pages(with_passage=True)`. Returns the number of pages carried over.
+    `history`: also carry over their `history/`, for the history phase to skip them
+    """
+    prev_pages = load_pages(pagesFilePath=os.path.join(prev_dumpDir, 'dumpMeta', 'pages.jsonl'))
+    if prev_pages is None:
+        print('Previous dump has no dumpMeta/pages.jsonl, fetching all pages.')
+        return 0
+    since = previous_dump_time(prev_dumpDir)
+    print('Previous dump: %s (%d pages, %s)' % (prev_dumpDir, len(prev_pages),
+                                                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(since))))
+
+    recent_changes = None
+    if not all(page.get('passage') is not None for page in pages):
+        print('cmd=list does not show page ages, trying cmd=filelist...')
+        try:
+            passages = {page['title']: page['passage']
+                        for page in get_pages(url=puki_url, session=session, with_passage=True, cmd='filelist')}
+        except Exception as e:
+            print('cmd=filelist failed: (', e, ')')
+            passages = {}
+        for page in pages:
+            page['passage'] = passages.get(page['title'])
+    if not all(page.get('passage') is not None for page in pages):
+        print('cmd=filelist does not show page ages either, trying RecentChanges...')
+        recent_changes = get_recent_changes(puki_url, session)
+    changed = find_changed_pages(pages, {page['title'] for page in prev_pages}, since, recent_changes)
+    if changed is None:
+        print('Cannot tell which pages changed since the previous dump, fetching all pages.')
+        return 0
+
+    count = carry_over(prev_dumpDir, store, pages, changed)
+    print('Incremental: %d new or changed pages, %d carried over from the previous dump' % (len(changed), count))
+    if history:
+        print('Incremental: %d page histories carried over' % carry_over_history(prev_dumpDir, store.dumpDir, pages, changed))
+    return count
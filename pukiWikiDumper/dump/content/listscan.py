@@ -0,0 +1,152 @@
+import html
+import re
+from typing import List, Optional, Tuple
+
+from bs4.dammit import UnicodeDammit
+
+# A single regex pass over the decoded `cmd=list` page that rebuilds just enough of
+# the tag tree (open/close nesting, the way BeautifulSoup's html.parser tree builder
+# does it) to answer `get_pages()`'s queries without building a soup.
+# `scan_list()` returns `None` whenever it meets markup it doesn't model exactly,
+# so the caller can fall back to BeautifulSoup.
+
+_ATTRS = r'''(?:\s+[^\s/>"'=]+(?:\s*=\s*(?:"[^"]*"|'[^']*'|[^\s"'=<>`]+))?)*\s*/?'''
+_RE_TOKEN = re.compile(
+    r'<!--.*?--\s*>' # comment
+    r'|<(script|style)(?=[\s/>])' + _ATTRS + r'>.*?</\1(?=[\s/>])' # raw text
+    r'|<(/?)([a-zA-Z][^\s/>\x00]*)(' + _ATTRS + r')>' # tag
+    r'|(<!--|<[a-zA-Z]|</[a-zA-Z])', # anything else that looks like markup: unsure
+    re.I | re.S)
+_RE_ATTR = re.compile(r'''([^\s/>"'=]+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s"'=<>`]+))?''')
+_RE_TAG = re.compile(r'<[^>]*>')
+
+# BeautifulSoup closes these right away
+VOID_ELEMENTS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem', 'meta',
+    'param', 'source', 'track', 'wbr', 'basefont', 'bgsound', 'command', 'frame', 'image', 'isindex',
+    'nextid', 'spacer',
+}
+
+NAME, ATTRS, TEXT_START, TEXT_END, STOP = range(5)
+
+# `(href, a.text, li.get_text() or None)` for every `<li>` with an `<a>`
+ListEntry = Tuple[str, str, Optional[str]]
+
+
+def _attrs(node) -> dict:
+    attrs = {}
+    for m in _RE_ATTR.finditer(node[ATTRS]):
+        value = m.group(2) or ''
+        if value[:1] in ('"', "'"):
+            value = value[1:-1]
+        attrs[m.group(1).lower()] = html.unescape(value)
+    return attrs
+
+
+def _has_class(node, cls: str) -> bool:
+    value = _attrs(node).get('class')
+    return value is not None and (value == cls or cls in value.split())
+
+
+def _text(text: str, node) -> Optional[str]:
+    inner = text[node[TEXT_START]:node[TEXT_END]]
+    if '<!--' in inner or '<script' in inner.lower() or '<style' in inner.lower():
+        return None # comments and scripts are not part of get_text()
+    return html.unescape(_RE_TAG.sub('', inner))
+
+
+def _build(text: str) -> Optional[list]:
+    """ `[name, attrs, text_start, text_end, stop]` per element in document order.
+    The descendants of `nodes[i]` are `nodes[i+1:nodes[i][STOP]]`. """
+    nodes = []
+    stack: List[int] = []
+    for m in _RE_TOKEN.finditer(text):
+        if m.group(5): # unsure
+            return None
+        if m.group(2) is None: # comment or raw text
+            continue
+        closing, name, attrs = m.group(2), m.group(3).lower(), m.group(4)
+        self_closing = m.group(0).endswith('/>') # like html.parser, even for `<a href=x/>`
+        if name in ('script', 'style'): # unterminated raw text
+            return None
+        if closing:
+            for depth in range(len(stack) - 1, -1, -1):
+                if nodes[stack[depth]][NAME] == name:
+                    for i in stack[depth:]:
+                        nodes[i][TEXT_END] = m.start()
+                        nodes[i][STOP] = len(nodes)
+                    del stack[depth:]
+                    break
+            continue
+        if self_closing and name == 'a':
+            return None # `<a href=x/>`: the href is ambiguous
+        nodes.append([name, attrs, m.end(), m.end(), len(nodes) + 1])
+        if not self_closing and name not in VOID_ELEMENTS:
+            stack.append(len(nodes) - 1)
+    for i in stack:
+        nodes[i][TEXT_END] = len(text)
+        nodes[i][STOP] = len(nodes)
+    return nodes
+
+
+def _find(nodes, lo: int, hi: int, name: str, pred=None) -> Optional[int]:
+    for i in range(lo, hi):
+        if nodes[i][NAME] == name and (pred is None or pred(nodes[i])):
+            return i
+    return None
+
+
+def scan_list(content: bytes, from_encoding: Optional[str] = None, exclude_encodings=None,
+              with_li_text: bool = False) -> Optional[Tuple[str, List[ListEntry]]]:
+    """ `(original_encoding, entries)` of a `cmd=list` page, or `None` if unsure.
+
+    Same decoding and the same element lookups as `titles.get_pages()` does with
+    BeautifulSoup(html.parser).
+    """
+    dammit = UnicodeDammit(content, [from_encoding] if from_encoding else [],
+                           is_html=True, exclude_encodings=exclude_encodings or [])
+    text = dammit.unicode_markup
+    if text is None:
+        return None
+    nodes = _build(text)
+    if nodes is None:
+        return None
+    n = len(nodes)
+
+    body = _find(nodes, 0, n, 'div', lambda node: _attrs(node).get('id') == 'body')
+    if body is None:
+        body = _find(nodes, 0, n, 'div', lambda node: _has_class(node, 'body'))
+    if body is None:
+        body = _find(nodes, 0, n, 'div', lambda node: _has_class(node, 'content'))
+    if body is None:
+        body = _find(nodes, 0, n, 'div', lambda node: _attrs(node).get('id') == 'contents')
+    if body is None:
+        body = _find(nodes, 0, n, 'body')
+    if body is None:
+        return None
+    content_div = _find(nodes, body + 1, nodes[body][STOP], 'div', lambda node: _attrs(node).get('id') == 'content')
+    if content_div is not None:
+        body = content_div
+    ul = _find(nodes, body + 1, nodes[body][STOP], 'ul')
+    if ul is None:
+        return None
+
+    entries: List[ListEntry] = []
+    for li in range(ul + 1, nodes[ul][STOP]):
+        if nodes[li][NAME] != 'li':
+            continue
+        a = _find(nodes, li + 1, nodes[li][STOP], 'a')
+        if a is None:
+            continue
+        href = _attrs(nodes[a]).get('href')
+        if href is None:
+            return None
+        if href.startswith('#'):
+            continue
+        title = _text(text, nodes[a])
+        li_text = _text(text, nodes[li]) if with_li_text else None
+        if title is None or (with_li_text and li_text is None):
+            return None
+        entries.append((href, title, li_text))
+
+    return dammit.original_encoding, entries
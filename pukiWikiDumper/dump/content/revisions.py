@@ -5,19 +5,31 @@ from bs4 import BeautifulSoup
 
 from pukiWikiDumper.exceptions import ActionEditDisabled, ActionEditTextareaNotFound
 from pukiWikiDumper.utils.config import running_config
+from pukiWikiDumper.utils.encoding import is_euc_jp
 
+from .extract import extract_source
 
-# args must be same as getSourceEdit(), even if not used
-def get_source_diff(url, page, rev='', session: requests.Session = None,):
-    """Export the raw source of a page (at a given revision)"""
 
-    params={'cmd': 'diff', 'page': page['title']}
+def build_action_url(url, page, cmd: str) -> str:
+    """ `?cmd=<cmd>&page=<title>`, encoded the same way the wiki encoded the title """
+    params={'cmd': cmd, 'page': page['title']}
     query = urlparse.urlencode(params, encoding=page['url_encoding'], errors='strict')
-    r = session.get(url + '?' + query)
+    return url + '?' + query
+
+
+def _soup(r: requests.Response):
     from_encoding = None
-    if str(r.encoding).lower() == 'euc-jp' or str(r.apparent_encoding).lower() == 'euc-jp':
+    if is_euc_jp(r):
         from_encoding = 'euc_jisx0213'
-    soup = BeautifulSoup(r.content, running_config.html_parser, from_encoding=from_encoding, exclude_encodings=['ISO-8859-1'])
+    return BeautifulSoup(r.content, running_config.html_parser, from_encoding=from_encoding, exclude_encodings=['ISO-8859-1'])
+
+
+def parse_source_diff(r: requests.Response, page) -> str:
+    source = extract_source(r.content, 'diff', r.encoding) # fast path
+    if source is not None:
+        return source
+
+    soup = _soup(r)
     source = None
 
     pre = soup.find('pre')
@@ -31,17 +43,13 @@ def get_source_diff(url, page, rev='', session: requests.Session = None,):
 
     return source
 
-# args must be same as getSourceEdit(), even if not used
-def get_source_source(url, page, rev='', session: requests.Session = None,):
-    """Export the raw source of a page (at a given revision)"""
 
-    params={'cmd': 'source', 'page': page['title']}
-    query = urlparse.urlencode(params, encoding=page['url_encoding'], errors='strict')
-    r = session.get(url + '?' + query)
-    from_encoding = None
-    if str(r.encoding).lower() == 'euc-jp' or str(r.apparent_encoding).lower() == 'euc-jp':
-        from_encoding = 'euc_jisx0213'
-    soup = BeautifulSoup(r.content, running_config.html_parser, from_encoding=from_encoding, exclude_encodings=['ISO-8859-1'])
+def parse_source_source(r: requests.Response, page) -> str:
+    source = extract_source(r.content, 'source', r.encoding) # fast path
+    if source is not None:
+        return source
+
+    soup = _soup(r)
     source = None
 
     # #source
@@ -53,25 +61,51 @@ def get_source_source(url, page, rev='', session: requests.Session = None,):
 
     return source
 
-# args must be same as getSourceExport(), even if not used
-def get_source_edit(url, page, rev='', session: requests.Session = None,):
-    """Export the raw source of a page by scraping the edit box content. Yuck."""
 
-    params={'cmd': 'edit', 'page': page['title']}
-    query = urlparse.urlencode(params, encoding=page['url_encoding'], errors='strict')
-    r = session.get(url + '?' + query)
-    from_encoding = None
-    if str(r.encoding).lower() == 'euc-jp' or str(r.apparent_encoding).lower() == 'euc-jp':
-        from_encoding = 'euc_jisx0213'
-    soup = BeautifulSoup(r.content, running_config.html_parser, from_encoding=from_encoding, exclude_encodings=['ISO-8859-1'])
+def parse_source_edit(r: requests.Response, page) -> str:
+    source = extract_source(r.content, 'edit', r.encoding) # fast path
+    if source is not None:
+        return source
+
+    soup = _soup(r)
     source = None
     try:
         source = ''.join(soup.find('textarea', {'name': 'msg'}).text).strip()
     except AttributeError as e:
         if 'Action disabled: source' in r.text:
             raise ActionEditDisabled(page['title'])
-    
+
     if not source:
         raise ActionEditTextareaNotFound(page['title'])
 
     return source
+
+
+# args must be same as getSourceEdit(), even if not used
+def get_source_diff(url, page, rev='', session: requests.Session = None,):
+    """Export the raw source of a page (at a given revision)"""
+
+    r = session.get(build_action_url(url, page, 'diff'))
+    return parse_source_diff(r, page)
+
+# args must be same as getSourceEdit(), even if not used
+def get_source_source(url, page, rev='', session: requests.Session = None,):
+    """Export the raw source of a page (at a given revision)"""
+
+    r = session.get(build_action_url(url, page, 'source'))
+    return parse_source_source(r, page)
+
+# args must be same as getSourceExport(), even if not used
+def get_source_edit(url, page, rev='', session: requests.Session = None,):
+    """Export the raw source of a page by scraping the edit box content. Yuck."""
+
+    r = session.get(build_action_url(url, page, 'edit'))
+    return parse_source_edit(r, page)
+
+
+# cmd -> parser, in the order they are tried
+SOURCE_ACTIONS = {
+    'source': parse_source_source,
+    'edit': parse_source_edit,
+    'diff': parse_source_diff,
+}
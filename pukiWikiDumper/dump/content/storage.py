@@ -0,0 +1,158 @@
+import hashlib
+import os
+import threading
+from typing import Dict, Iterator, Tuple
+
+from pukiWikiDumper.utils.jsonl import append_jsonl, iter_jsonl, open_jsonl
+from pukiWikiDumper.utils.util import smkdirs, uopen
+from pukiWikiDumper.utils.util import print_with_lock as print
+
+PACK_DIR = 'wikipack'
+PACK_INDEX = 'index.jsonl'
+SEGMENT_SIZE = 64 * 1024 * 1024 # roll over to a new segment after this many bytes
+
+CONFIG_CONTENT_STORAGE = 'content_storage' # 'files' or 'packed'
+
+
+def page_filepath(dumpDir: str, title: str, subdir: str = 'wiki', suffix: str = '.txt') -> str:
+    """ `dumpDir/wiki/<HEX(title)>.txt`, split into a subdir if the filename is too long """
+    filename = (title.encode('utf-8').hex().upper()) + suffix
+    if len(filename) > 255: # filename too long
+        subdir_A = filename[:255]
+        subfilename_B = filename[255:]
+        smkdirs(dumpDir, '/' + subdir + '/' + subdir_A)
+        return dumpDir + '/' + subdir + '/' + subdir_A + '/' + subfilename_B
+
+    return dumpDir + '/' + subdir + '/' + filename
+
+
+class DirPageStore:
+    """ One `wiki/<HEX(title)>.txt` per page. """
+
+    def __init__(self, dumpDir: str):
+        self.dumpDir = dumpDir
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def exists(self, title: str) -> bool:
+        return os.path.exists(page_filepath(self.dumpDir, title))
+
+    def save(self, title: str, source: str):
+        filepath = page_filepath(self.dumpDir, title)
+        smkdirs(self.dumpDir, '/wiki/')
+
+        with uopen(filepath, 'w') as f:
+            f.write(source)
+
+    def read(self, title: str) -> str:
+        with uopen(page_filepath(self.dumpDir, title), 'r', newline='') as f:
+            return f.read()
+
+    def close(self):
+        pass
+
+
+class PackedPageStore:
+    """ Appends page sources to rolling `wikipack/segment-NNNNNN.bin` files.
+
+    `wikipack/index.jsonl` maps each title to its bytes:
+    `{"title": ..., "segment": 0, "offset": 0, "length": 123, "sha1": ...}`.
+    Data is written before its index line, so a crash leaves at most some
+    unreferenced bytes at the end of a segment. The last entry of a title wins.
+    """
+
+    def __init__(self, dumpDir: str, segment_size: int = SEGMENT_SIZE):
+        self.dumpDir = dumpDir
+        self.pack_dir = os.path.join(dumpDir, PACK_DIR)
+        self.segment_size = segment_size
+        self.index: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._segment = 0
+        self._segment_f = None
+        self._index_f = None
+
+        smkdirs(dumpDir, PACK_DIR)
+        self._load_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def segment_path(self, segment: int) -> str:
+        return os.path.join(self.pack_dir, 'segment-%06d.bin' % segment)
+
+    def _load_index(self):
+        for entry in iter_jsonl(os.path.join(self.pack_dir, PACK_INDEX)):
+            self.index[entry['title']] = entry
+            self._segment = max(self._segment, entry['segment'])
+
+    def _open(self):
+        if self._index_f is None:
+            self._index_f = open_jsonl(os.path.join(self.pack_dir, PACK_INDEX))
+        if self._segment_f is None:
+            self._segment_f = open(self.segment_path(self._segment), 'ab')
+        if self._segment_f.tell() >= self.segment_size:
+            self._segment_f.close()
+            self._segment += 1
+            self._segment_f = open(self.segment_path(self._segment), 'ab')
+
+    def exists(self, title: str) -> bool:
+        return title in self.index
+
+    def save(self, title: str, source: str):
+        data = source.encode('utf-8')
+        with self._lock:
+            self._open()
+            entry = {
+                'title': title,
+                'segment': self._segment,
+                'offset': self._segment_f.tell(),
+                'length': len(data),
+                'sha1': hashlib.sha1(data).hexdigest(),
+            }
+            self._segment_f.write(data)
+            self._segment_f.flush()
+            append_jsonl(self._index_f, entry)
+            self.index[title] = entry
+
+    def read(self, title: str) -> str:
+        entry = self.index[title]
+        with open(self.segment_path(entry['segment']), 'rb') as f:
+            f.seek(entry['offset'])
+            data = f.read(entry['length'])
+        if hashlib.sha1(data).hexdigest() != entry['sha1']:
+            raise ValueError('Packed page [[%s]] is corrupted (sha1 mismatch)' % title)
+        return data.decode('utf-8')
+
+    def items(self) -> Iterator[Tuple[str, str]]:
+        for title in self.index:
+            yield title, self.read(title)
+
+    def close(self):
+        with self._lock:
+            for f in (self._segment_f, self._index_f):
+                if f is not None:
+                    f.close()
+            self._segment_f = self._index_f = None
+
+
+def open_page_store(dumpDir: str, packed: bool = False):
+    return PackedPageStore(dumpDir) if packed else DirPageStore(dumpDir)
+
+
+def unpack(dumpDir: str) -> int:
+    """ Recreate the `wiki/<HEX(title)>.txt` layout from `wikipack/` """
+    count = 0
+    with PackedPageStore(dumpDir) as packed, DirPageStore(dumpDir) as files:
+        for title, source in packed.items():
+            files.save(title, source)
+            count += 1
+    print('Unpacked %d pages to %s' % (count, os.path.join(dumpDir, 'wiki')))
+    return count
+
@@ -0,0 +1,86 @@
+import threading
+from typing import Dict, List, Optional
+
+from pukiWikiDumper.utils.config import get_config, update_config
+from pukiWikiDumper.utils.util import print_with_lock as print
+
+from .revisions import SOURCE_ACTIONS
+
+CONFIG_SOURCE_ACTION = 'source_action'
+
+# an action that failed this many times without a single success is skipped
+DEAD_ACTION_FAILURES = 20
+# every N-th page tries all actions again (skipped ones included)
+REPROBE_INTERVAL = 200
+
+
+class SourceStrategy:
+    """ Learns which of `cmd=source`, `cmd=edit` and `cmd=diff` works on this site.
+
+    Actions are tried in order of their (smoothed) success rate. Actions that never
+    succeeded after `DEAD_ACTION_FAILURES` tries are skipped, except on every
+    `REPROBE_INTERVAL`-th page. The best action is saved to `dumpMeta/config.json`,
+    so resumed runs start with it.
+
+    Only "action doesn't work" errors should be `record()`-ed, not network errors.
+    """
+
+    def __init__(self, dumpDir: str = '', actions: Optional[List[str]] = None):
+        self.dumpDir = dumpDir
+        self.stats: Dict[str, List[int]] = {cmd: [0, 0] for cmd in (actions or SOURCE_ACTIONS)} # cmd: [success, failure]
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock() # config.json is written outside `_lock`
+
+        self.best_action: Optional[str] = None
+        if dumpDir:
+            self.best_action = get_config(dumpDir).get(CONFIG_SOURCE_ACTION)
+            if self.best_action not in self.stats:
+                self.best_action = None
+        if self.best_action:
+            print('Content: starting with cmd=%s (from previous run)' % self.best_action)
+
+    def _rate(self, cmd: str) -> float:
+        success, failure = self.stats[cmd]
+        return (success + 1) / (success + failure + 2)
+
+    def _dead(self, cmd: str) -> bool:
+        success, failure = self.stats[cmd]
+        return success == 0 and failure >= DEAD_ACTION_FAILURES
+
+    def actions(self) -> List[str]:
+        """ Actions to try for the next page, best first """
+        with self._lock:
+            self.calls += 1
+            reprobe = self.calls % REPROBE_INTERVAL == 0
+            order = sorted(self.stats, key=lambda cmd: (cmd != self.best_action, -self._rate(cmd)))
+            if reprobe:
+                return order
+            alive = [cmd for cmd in order if not self._dead(cmd)]
+            return alive if alive else order
+
+    def record(self, cmd: str, success: bool):
+        with self._lock:
+            self.stats[cmd][0 if success else 1] += 1
+            dead = self._dead(cmd) and self.stats[cmd][1] == DEAD_ACTION_FAILURES
+            changed = self._update_best_action()
+        if dead:
+            print('Content: cmd=%s failed %d times, skipping it from now on' % (cmd, DEAD_ACTION_FAILURES))
+        if changed:
+            print('Content: cmd=%s works best, trying it first' % changed)
+            if self.dumpDir:
+                with self._save_lock: # whoever saves last saves the current best action
+                    update_config(self.dumpDir, {CONFIG_SOURCE_ACTION: self.best_action}, verbose=False)
+
+    def _update_best_action(self) -> Optional[str]:
+        """ The new best action if it changed, `None` otherwise. Call with `_lock` held. """
+        candidates = [c for c in self.stats if self.stats[c][0] > 0]
+        if not candidates:
+            return None
+        best = max(candidates, key=self._rate)
+        if self.best_action in candidates and self._rate(self.best_action) >= self._rate(best):
+            return None
+        if best == self.best_action:
+            return None
+        self.best_action = best
+        return best
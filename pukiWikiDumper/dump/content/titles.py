@@ -1,4 +1,5 @@
-from typing import Optional
+import re
+from typing import Dict, Iterator, List, Optional, Tuple
 import urllib.parse as urlparse
 
 from bs4 import BeautifulSoup
@@ -7,24 +8,92 @@ import requests
 from pukiWikiDumper.exceptions import CmdListDisabled
 from pukiWikiDumper.utils.util import print_with_lock as print
 from pukiWikiDumper.utils.config import running_config
+from pukiWikiDumper.utils.encoding import is_euc_jp
 
-def get_pages(url: str, debug_content: Optional[bytes] = None, session: requests.Session=None, useOldMethod=None):
-    """Get titles given a doku.php URL and an (optional) namespace
+from .listscan import ListEntry, scan_list
 
-    :param `useOldMethod`: `bool|None`. `None` will auto-detect if ajax api is enabled"""
+# <li><a href="./?FrontPage">FrontPage</a> <small>(3602d)</small></li>
+PASSAGE_RE = re.compile(r'\((\d+)([mhd])\)\s*$')
+PASSAGE_UNITS = {'m': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
 
+# urlsplit() strips these, don't take a shortcut
+_RE_URL_UNSAFE = re.compile(r'[\x00-\x20\x7f]')
+_RE_PATH_SEGMENT = re.compile(r'[^/?#;]+')
 
-    pages = []
-    params = {'cmd': 'list'}
-    if debug_content:
-        soup = BeautifulSoup(debug_content, running_config.html_parser, exclude_encodings=['ibm866'])
-        r = None
-    else:
-        r = session.get(url, params=params)
-        from_encoding = None
-        if str(r.encoding).lower() == 'euc-jp' or str(r.apparent_encoding).lower() == 'euc-jp':
-            from_encoding = 'euc_jisx0213'
-        soup = BeautifulSoup(r.content, running_config.html_parser, from_encoding=from_encoding, exclude_encodings=['iso-8859-1'])
+
+def parse_passage(text: str) -> Optional[int]:
+    """ PukiWiki's `(29m)`/`(5h)`/`(3602d)` age, in seconds (rounded down, as PukiWiki does) """
+    m = PASSAGE_RE.search(text)
+    if m is None:
+        return None
+    return int(m.group(1)) * PASSAGE_UNITS[m.group(2)]
+
+
+class TitleDecoder:
+    """ `href` -> `{'title': ..., 'url_encoding': ...}` for the links of one `cmd=list` page.
+
+    The candidate encodings and the list URL are resolved once per page. Most
+    titles decode with the page's own encoding on the first try, only the
+    outliers go through the other candidates.
+    """
+
+    def __init__(self, list_url: str, original_encoding: Optional[str]):
+        self.list_url = list_url
+        self.wikipath = urlparse.urlparse(list_url).path
+        self.encodings = [original_encoding] + ['euc-jp', 'euc_jisx0213', 'utf-8', 'shift_jis']
+        self._dirs: Dict[str, urlparse.ParseResult] = {} # href prefix -> parsed urljoin(list_url, prefix)
+
+    def _query(self, href: str) -> str:
+        # the query of `urljoin(list_url, href)` is the one in `href`,
+        # unless `href` has none or has characters urlsplit() strips.
+        if _RE_URL_UNSAFE.search(href) is None:
+            if '?' in href:
+                query = href.partition('#')[0].partition('?')[2]
+                if query:
+                    return query
+            else:
+                # `dir/page.html`: resolve each `dir/` once, then append the last segment
+                prefix, _, name = href.rpartition('/')
+                if prefix and _RE_PATH_SEGMENT.fullmatch(name) and name not in ('.', '..'):
+                    if prefix not in self._dirs:
+                        self._dirs[prefix] = urlparse.urlparse(urlparse.urljoin(self.list_url, prefix + '/'))
+                    parsed = self._dirs[prefix]
+                    if not parsed.query and not parsed.fragment: # so no '?' in the full URL either
+                        return self._pagepath(parsed.path + name, no_query=True)
+        full_url = urlparse.urljoin(self.list_url, href)
+        parsed = urlparse.urlparse(full_url)
+        if parsed.query:
+            return parsed.query
+        return self._pagepath(parsed.path, "?" not in full_url)
+
+    def _pagepath(self, path: str, no_query: bool) -> str:
+        # workround for https://wikiwiki.jp/ wikis
+        pagepath = path.replace(self.wikipath, '')
+        if no_query and pagepath.endswith('.html'): # workround for http://penguin.tantin.jp/mori/?cmd=list
+            pagepath = pagepath[:-5]
+        return pagepath
+
+    def page(self, href: str, title: str) -> Dict[str, str]:
+        title_to_parse = self._query(href).replace("+", " ")
+        url_encoding = None
+        for encoding in self.encodings:
+            try:
+                parsed_title = urlparse.unquote(title_to_parse, errors='strict', encoding=encoding)
+                url_encoding = encoding
+                break
+            except (UnicodeEncodeError, UnicodeDecodeError):
+                pass
+        assert url_encoding, f'Failed to parse query string: {title_to_parse}'
+        return {
+            'title': parsed_title if parsed_title else title,
+            'url_encoding': url_encoding,
+        }
+
+
+def soup_list(content: bytes, from_encoding: Optional[str], exclude_encodings: List[str],
+              with_li_text: bool = False) -> Tuple[Optional[str], List[ListEntry]]:
+    """ `scan_list()`, the BeautifulSoup way """
+    soup = BeautifulSoup(content, running_config.html_parser, from_encoding=from_encoding, exclude_encodings=exclude_encodings)
     body = soup.find('div', {'id': 'body'})
     body = soup.find('div', {'class': 'body'}) if body is None else body # https://www.wikihouse.com/pukiwiki/index.php?cmd=list
     body = soup.find('div', {'class': 'content'}) if body is None else body # http://penguin.tantin.jp/mori/?cmd=list
@@ -37,7 +106,8 @@ def get_pages(url: str, debug_content: Optional[bytes] = None, session: requests
     ul = body.find('ul')
     if ul is None:
         raise CmdListDisabled('Action index is disabled')
-    
+
+    entries: List[ListEntry] = []
     for li in ul.find_all('li'):
         a = li.find('a')
         if a is None:
@@ -45,33 +115,48 @@ def get_pages(url: str, debug_content: Optional[bytes] = None, session: requests
         href = a.get('href')
         if href and href.startswith('#'):
             continue
-        title = a.text
+        entries.append((a['href'], a.text, li.get_text() if with_li_text else None))
+    return soup.original_encoding, entries
 
-        full_url = urlparse.urljoin(r.url if r else url, a['href'])
-        parsed = urlparse.urlparse(full_url)
-        if not parsed.query: # workround for https://wikiwiki.jp/ wikis
-            wikipath = urlparse.urlparse(r.url if r else url).path
-            page_fullpath = urlparse.urlparse(full_url).path
-            pagepath = page_fullpath.replace(wikipath, '')
 
-            if "?" not in full_url and pagepath.endswith('.html'): # workround for http://penguin.tantin.jp/mori/?cmd=list
-                pagepath = pagepath[:-5]
+def get_pages(url: str, debug_content: Optional[bytes] = None, session: requests.Session=None, useOldMethod=None,
+              with_passage: bool = False, cmd: str = 'list') -> List[Dict]:
+    """Get titles given a doku.php URL and an (optional) namespace
 
-        encodings = [soup.original_encoding] + ['euc-jp', 'euc_jisx0213', 'utf-8', 'shift_jis']
-        url_encoding = None
-        title_to_parse = parsed.query if parsed.query else pagepath
-        for encoding in encodings:
-            try:
-                parsed_title = urlparse.unquote(title_to_parse.replace("+", " "), errors='strict', encoding=encoding)
-                url_encoding = encoding
-                break
-            except (UnicodeEncodeError, UnicodeDecodeError):
-                pass
-        assert url_encoding, f'Failed to parse query string: {title_to_parse}'
-        page = {
-            'title': parsed_title if parsed_title else title,
-            'url_encoding': url_encoding,
-        }
-        pages.append(page)
+    :param `useOldMethod`: `bool|None`. `None` will auto-detect if ajax api is enabled
+    :param `with_passage`: add `passage` (seconds since last modified, `None` if not shown) to each page
+    :param `cmd`: `list` or `filelist` (same layout, admin only)"""
+
+    return list(iter_pages(url, debug_content=debug_content, session=session, useOldMethod=useOldMethod,
+                           with_passage=with_passage, cmd=cmd))
+
+
+def iter_pages(url: str, debug_content: Optional[bytes] = None, session: requests.Session=None, useOldMethod=None,
+               with_passage: bool = False, cmd: str = 'list') -> Iterator[Dict]:
+    """ `get_pages()`, yielding each page as soon as its title is decoded """
+    params = {'cmd': cmd}
+    if debug_content:
+        content, list_url = debug_content, url
+        from_encoding, exclude_encodings = None, ['ibm866']
+    else:
+        r = session.get(url, params=params)
+        content, list_url = r.content, r.url
+        from_encoding = None
+        if is_euc_jp(r):
+            from_encoding = 'euc_jisx0213'
+        exclude_encodings = ['iso-8859-1']
+
+    scanned = None
+    if running_config.html_parser == 'html.parser': # the fast path mimics this parser
+        scanned = scan_list(content, from_encoding, exclude_encodings, with_li_text=with_passage)
+    if scanned is None:
+        scanned = soup_list(content, from_encoding, exclude_encodings, with_li_text=with_passage)
+    original_encoding, entries = scanned
+    del content, scanned
 
-    return pages
+    decoder = TitleDecoder(list_url, original_encoding)
+    for href, title, li_text in entries:
+        page = decoder.page(href, title)
+        if with_passage:
+            page['passage'] = parse_passage(li_text)
+        yield page
@@ -11,12 +11,25 @@ from pukiWikiDumper.utils.util import print_with_lock as print
 
 from pukiWikiDumper.__version__ import DUMPER_VERSION, pukiWikiDumper_outdated_check
 from pukiWikiDumper.dump.content.content import dump_content
+from pukiWikiDumper.dump.content.history import dump_history
+from pukiWikiDumper.dump.content.storage import CONFIG_CONTENT_STORAGE, open_page_store
 from pukiWikiDumper.dump.info import update_info
 from pukiWikiDumper.dump.media import dump_attachs
-from pukiWikiDumper.utils.config import update_config, running_config
+from pukiWikiDumper.dump.media.blobs import CONFIG_ATTACH_STORAGE
+from pukiWikiDumper.dump.media.media import MEDIA_ORDERS, get_attachs
+from pukiWikiDumper.utils.adaptive import AdaptiveConcurrency
+from pukiWikiDumper.utils.async_engine import AsyncEngine, aiohttp_available
+from pukiWikiDumper.utils.config import get_config, update_config, running_config
+from pukiWikiDumper.utils.encoding import CONFIG_SITE_ENCODING, detect_site_encoding
+from pukiWikiDumper.utils.host_limits import HostLimit, HostLimits, parse_host_limit
+from pukiWikiDumper.utils.log import DEBUG, LEVELS, PROGRESS_INTERVAL, log
 from pukiWikiDumper.utils.patch import SessionMonkeyPatch
-from pukiWikiDumper.utils.session import createSession, load_cookies
-from pukiWikiDumper.utils.util import avoidSites, buildBaseUrl, getPukiUrl, smkdirs, standardizeUrl, url2prefix
+from pukiWikiDumper.utils.rate_limit import TokenBucket
+from pukiWikiDumper.utils.response_cache import ResponseCache
+from pukiWikiDumper.utils.scheduler import PhaseThread
+from pukiWikiDumper.utils.session import createSession, load_cookies, print_connection_stats, set_pool_size
+from pukiWikiDumper.utils.util import (avoidSites, buildBaseUrl, getPukiUrl, php_warning_log, smkdirs, standardizeUrl,
+                                       url2prefix)
 
 DEFAULT_THREADS = -1 # magic number, -1 means use 1 thread.
 
@@ -30,14 +43,49 @@ def getArgumentParser():
     group_download.add_argument('--media', action='store_true', help='Dump media')
     # group_download.add_argument('--html', action='store_true', help='Dump HTML')
 
+    parser.add_argument('--packed', action='store_true',
+                        help='Append page sources to packed segment files (wikipack/) instead of one file per page. '
+                        'Use "python -m pukiWikiDumper.dump.content unpack <dump_dir>" to get the wiki/ layout back. '
+                        '(only works with --content) [default: False]')
+    parser.add_argument('--attach-blobs', dest='attach_blobs', action='store_true',
+                        help='Store each distinct attachment once (attachblobs/<sha1>) and hardlink it into attach/, '
+                        'files with the same size and Last-Modified as a stored one are not downloaded again. '
+                        'Use "python -m pukiWikiDumper.dump.media relink <dump_dir>" to rebuild attach/ from attachblobs/. '
+                        '(only works with --media) [default: False]')
+    parser.add_argument('--parallel-phases', dest='parallel_phases', action='store_true',
+                        help='Dump media while content and history are being dumped. Requests to the wiki still '
+                        'share one --threads/--rate budget (see --host-limit). attach_dumped.mark is only written '
+                        'once every phase is done. (only works with --content and --media, --engine threads) [default: False]')
+    parser.add_argument('--media-order', dest='media_order', choices=MEDIA_ORDERS, default='list',
+                        help='Download order of attachments, by the sizes on the attach list: "largest" first keeps '
+                        'big files from straggling at the end, "smallest" first finishes many files quickly. '
+                        '(only works with --media) [default: list]')
+    parser.add_argument('--since-dump', dest='since_dump', type=str, default='',
+                        help='Path to a previous dump of the same wiki. Only new or changed pages are fetched, '
+                        'unchanged ones are hardlinked (or copied) from it. (only works with --content)')
+    parser.add_argument('--retry-failed', dest='retry_failed', action='store_true',
+                        help='Resume a finished dump, only re-running the pages/files that failed '
+                        '(see dumpMeta/progress-<phase>.jsonl) [default: False]')
     parser.add_argument('--current-only', dest='current_only', action='store_true',
-                        help='Dump latest revision, no history [default: false]')
+                        help='Dump latest revision, no history (cmd=backup) [default: false]')
     parser.add_argument(
         '--path', help='Specify dump directory [default: <site>-<date>]', type=str, default='')
     parser.add_argument(
         '--no-resume', help='Do not resume a previous dump [default: resume]', action='store_true')
     parser.add_argument(
         '--threads', help='Number of sub threads to use [default: 1], not recommended to set > 5', type=int, default=DEFAULT_THREADS)
+    parser.add_argument('--adaptive', action='store_true',
+                        help='Adapt the number of requests in flight to the server: start at --threads, grow by one '
+                        'while latency stays flat, halve on 429/503, Retry-After, errors or rising latency. '
+                        'Decisions are printed as "Concurrency: N -> M (...)". [default: False]')
+    parser.add_argument('--min-threads', dest='min_threads', type=int, default=1,
+                        help='Floor of --adaptive [default: 1]')
+    parser.add_argument('--max-threads', dest='max_threads', type=int, default=16,
+                        help='Ceiling of --adaptive [default: 16]')
+    parser.add_argument('--engine', choices=['threads', 'async'], default='threads',
+                        help='HTTP engine for the content and media phases. '
+                        '"async" keeps up to --threads requests in flight on one asyncio event loop '
+                        '(requires aiohttp: pip install "pukiWikiDumper[async]") [default: threads]')
     parser.add_argument(
         '--i-love-retro',  action='store_true', dest='user_love_retro',
         help='Do not check the latest version of pukiWikiDumper (from pypi.org) before running [default: False]')
@@ -54,14 +102,39 @@ def getArgumentParser():
     parser.add_argument('--trim-php-warnings', action='store_true', dest='trim_php_warnings',
                         help='Trim PHP warnings from requests.Response.text')
 
-    parser.add_argument('--delay', help='Delay between requests [default: 0.0]', type=float, default=0.0)
+    parser.add_argument('--delay', type=float, default=0.0,
+                        help='Seconds each thread waits before each of its requests, so N threads still send '
+                        'up to N requests per delay. Use --rate for a limit shared by all threads [default: 0.0]')
+    parser.add_argument('--rate', type=float, default=0.0,
+                        help='Maximum requests per second to all hosts together, shared by all threads and phases '
+                        '(0: unlimited) [default: 0]')
+    parser.add_argument('--burst', type=int, default=1,
+                        help='Number of requests --rate lets through at once after an idle period [default: 1]')
+    parser.add_argument('--host-limit', dest='host_limits', action='append', default=[], metavar='HOST=CONCURRENCY[:DELAY]',
+                        help='Concurrency and delay for requests to HOST, e.g. "cdn.wikiwiki.jp=16:0". '
+                        'Other hosts use --threads and --delay. Known CDNs (cdn.wikiwiki.jp) have built-in defaults. '
+                        'Can be given multiple times.')
+    parser.add_argument('--response-cache', dest='response_cache', type=str, default='', metavar='DIR',
+                        help='Keep the raw HTTP responses (except attachment downloads) in DIR, '
+                        'so the dump can be redone offline with --replay. The same DIR can be shared by several runs.')
+    parser.add_argument('--replay', action='store_true',
+                        help='Send no requests, answer them from --response-cache DIR instead '
+                        '(e.g. to reprocess a dump with another --parser or --trim-php-warnings). '
+                        'Requests that are not in the cache fail. [default: False]')
     parser.add_argument('--retry', help='Maximum number of retries [default: 5]', type=int, default=5)
     parser.add_argument('--hard-retry', type=int, default=3, dest='hard_retry',
                         help='Maximum number of retries for hard errors [default: 3]')
 
     parser.add_argument('--parser', help='HTML parser [default: html.parser]', type=str, default='html.parser')
 
-    parser.add_argument('--verbose', action='store_true', help='Verbose output')
+    parser.add_argument('--verbose', action='store_true',
+                        help='Verbose output: every page, file and response (same as --log-level debug)')
+    parser.add_argument('--log-level', dest='log_level', choices=list(LEVELS), default='info',
+                        help='Console output level, "debug" shows every page, file and response [default: info]')
+    parser.add_argument('--event-log', dest='event_log', type=str, default='', metavar='FILE',
+                        help='Append a JSONL log of every line (whatever --log-level) and request to FILE')
+    parser.add_argument('--progress-interval', dest='progress_interval', type=float, default=PROGRESS_INTERVAL,
+                        metavar='SECONDS', help='Seconds between two progress lines [default: %(default)s]')
     parser.add_argument('--cookies', help='cookies file')
     parser.add_argument('--auto', action='store_true', 
                         help='dump: content+media, threads=2, current-only. (threads is overridable)')
@@ -79,9 +152,6 @@ def getArgumentParser():
 
 
 def checkArgs(args):
-    if args.content and not args.current_only:
-        print("PukiWikiDumper does not support history dump yet (WIP). For now, you have to pass --current-only with --content :(")
-        return False
     if not args.content and not args.media:
         print('Nothing to do. Use --content and/or --media to specify what to dump.')
         return False
@@ -91,7 +161,13 @@ def checkArgs(args):
     if args.threads < 1:
         print('Number of threads must be >= 1.')
         return False
-    if args.threads > 5:
+    if args.progress_interval <= 0:
+        print('--progress-interval must be > 0.')
+        return False
+    if args.adaptive and not 1 <= args.min_threads <= args.max_threads:
+        print('--min-threads and --max-threads must satisfy 1 <= --min-threads <= --max-threads.')
+        return False
+    if args.threads > 5 and not args.adaptive:
         print('Warning: threads > 5 , will bring a lot of pressure to the server.')
         print('Original site may deny your request, even ban our UA.')
         # time.sleep(3)
@@ -100,6 +176,35 @@ def checkArgs(args):
         print('Warning: You have chosen to ignore errors in the sub threads. This may cause incomplete dumps.')
         # time.sleep(3)
         # input('Press Enter to continue...')
+    if args.packed and not args.content:
+        print('Warning: You have specified --packed, but you have not specified --content.')
+        return False
+    for value in args.host_limits:
+        try:
+            parse_host_limit(value)
+        except ValueError as e:
+            print('--host-limit:', e)
+            return False
+    if args.parallel_phases and not (args.content and args.media):
+        print('Warning: You have specified --parallel-phases, but not both --content and --media.')
+        return False
+    if args.parallel_phases and args.engine == 'async':
+        # one AsyncEngine (event loop) per phase would not share the per-host budget
+        print('--parallel-phases only works with --engine threads.')
+        return False
+    if args.attach_blobs and not args.media:
+        print('Warning: You have specified --attach-blobs, but you have not specified --media.')
+        return False
+    if args.since_dump:
+        if not args.content:
+            print('Warning: You have specified --since-dump, but you have not specified --content.')
+            return False
+        if not os.path.exists(os.path.join(args.since_dump, 'dumpMeta', 'pages.jsonl')):
+            print(f'--since-dump: {args.since_dump} is not a finished dump (dumpMeta/pages.jsonl not found).')
+            return False
+    if args.retry_failed and args.no_resume:
+        print('Warning: --retry-failed resumes a previous dump, it cannot be used with --no-resume.')
+        return False
     if args.ignore_action_disabled_edit and not args.content:
         print('Warning: You have specified --ignore-action-disabled-edit, but you have not specified --content.')
         return False
@@ -108,12 +213,22 @@ def checkArgs(args):
         return False
     if args.delay > 0.0 and args.threads > 1:
         print(f"Warning: You have specified a delay and more than one thread ({args.threads}).")
-        print("!!! Delay will be applied to each thread separately !!!")
-        # time.sleep(3)
-        # input('Press Enter to continue...')
+        print("!!! Delay will be applied to each thread separately, use --rate to limit them together !!!")
+    if args.rate < 0:
+        print('Rate must be >= 0.')
+        return False
+    if args.burst < 1:
+        print('Burst must be >= 1.')
+        return False
     if args.retry < 0:
         print('Retry must be >= 0.')
         return False
+    if args.replay and not os.path.isdir(args.response_cache):
+        print('--replay needs the --response-cache DIR of a previous run.')
+        return False
+    if args.engine == 'async' and not aiohttp_available():
+        print('--engine async requires aiohttp. Please install it first: pip install "pukiWikiDumper[async]"')
+        return False
     if args.upload and not args.auto:
         print('Warning: You have specified --upload, but you have not specified --auto.')
         return False
@@ -132,6 +247,8 @@ def checkArgs(args):
 def getParameters():
     parser = getArgumentParser()
     args = parser.parse_args()
+    log.configure(level=DEBUG if args.verbose else LEVELS[args.log_level],
+                  event_log=args.event_log or None, interval=args.progress_interval)
 
     if args.auto:
         args.content = True
@@ -144,6 +261,7 @@ def getParameters():
         args.threads = args.threads if args.threads >= 1 else 1
     print('Threads:', args.threads)
     if not checkArgs(args):
+        log.flush() # the warnings above go before the help text
         parser.print_help()
         sys.exit(1)
 
@@ -151,6 +269,7 @@ def getParameters():
 
 
 def dump():
+    log.install_excepthook()
     args = getParameters()
     if not args.user_love_retro:
         pukiWikiDumper_outdated_check()
@@ -158,35 +277,43 @@ def dump():
 
     session = createSession(retries=args.retry, user_agent=args.user_agent)
 
-    if args.verbose:
-        def print_request(r: requests.Response, *args, **kwargs):
-            # TODO: use logging
-            # print("H:", r.request.headers)
-            for _r in r.history:
-                print("Resp (history): ", _r.request.method, _r.status_code, _r.reason, _r.url)
-            print(f"Resp: {r.request.method} {r.status_code} {r.reason} {r.url}")
-            if r.raw._connection.sock:
-                print(f"Conn: {r.raw._connection.sock.getsockname()} -> {r.raw._connection.sock.getpeername()[0]}")
-        session.hooks['response'].append(print_request)
-
     if args.insecure:
         session.verify = False
         requests.packages.urllib3.disable_warnings()
         print("Warning: SSL certificate verification disabled.")
+    adaptive = None
+    if args.adaptive:
+        adaptive = AdaptiveConcurrency(floor=args.min_threads, ceiling=args.max_threads, initial=args.threads)
+        print('Adaptive concurrency: %d (%d..%d)' % (adaptive.limit, adaptive.floor, adaptive.ceiling))
+        # size the worker pools for the ceiling, the controller decides how many of them send requests
+        args.threads = args.max_threads
+    host_limits = HostLimits(HostLimit(concurrency=args.threads, delay=args.delay),
+                             dict(parse_host_limit(value) for value in args.host_limits))
+    rate_limit = TokenBucket(args.rate, args.burst) if args.rate > 0 else None
+    response_cache = ResponseCache(args.response_cache) if args.response_cache else None
+    if args.replay:
+        print('Replay: %d responses in %s, no requests will be sent' % (len(response_cache.index), args.response_cache))
     session_monkey = SessionMonkeyPatch(session=session, delay=args.delay, msg='',
                                         hard_retries=args.hard_retry,
-                                        trim_PHP_warnings=args.trim_php_warnings)
+                                        trim_PHP_warnings=args.trim_php_warnings,
+                                        host_limits=host_limits, rate_limit=rate_limit, adaptive=adaptive,
+                                        cache=response_cache, replay=args.replay)
     session_monkey.hijack()
 
     std_url = standardizeUrl(url_input)
     puki_url = getPukiUrl(std_url, session=session)
+    host_limits.use_profile(puki_url)
+    # one kept-alive connection per request in flight to a host (e.g. --parallel-phases sharing the origin)
+    set_pool_size(session, host_limits.max_concurrency())
 
-    avoidSites(puki_url, session=session)
+    if not args.replay: # both go to the network without the session
+        avoidSites(puki_url, session=session)
 
-    if not args.force:
+    if not args.force and not args.replay:
         print("Searching for recent dumps on IA...")
         if any_recent_ia_item_exists(ori_url=puki_url, days=365):
             print("A dump of this wiki was uploaded to IA in the last 365 days. Aborting.")
+            log.flush()
             sys.exit(88)
 
     if args.cookies:
@@ -202,6 +329,17 @@ def dump():
                 'Dump directory already exists. (You can use --path to specify a different directory.)')
             return 1
 
+    if args.since_dump:
+        prev_puki_url = get_config(args.since_dump).get('puki_url')
+        if prev_puki_url != puki_url:
+            print(f'--since-dump: {args.since_dump} is a dump of {prev_puki_url}, not {puki_url}.')
+            log.flush()
+            sys.exit(1)
+        if os.path.abspath(args.since_dump) == os.path.abspath(dumpDir):
+            print('--since-dump: cannot be the dump directory itself. (Use --path to specify a new one.)')
+            log.flush()
+            sys.exit(1)
+
     smkdirs(dumpDir, '/dumpMeta')
     print('Dumping to ', dumpDir,
           '\nBase URL: ', base_url,
@@ -214,44 +352,104 @@ def dump():
                'pukiWikiDumper_version': DUMPER_VERSION,
                }
     update_config(dumpDir=dumpDir, config=_config)
+    # resolved once (header, <meta charset>, chardet), responses without a charset are decoded with it
+    site_encoding = get_config(dumpDir).get(CONFIG_SITE_ENCODING)
+    if site_encoding is None:
+        site_encoding = detect_site_encoding(session.get(puki_url))
+        update_config(dumpDir=dumpDir, config={CONFIG_SITE_ENCODING: site_encoding})
+    running_config.site_encoding = site_encoding
+    print('Site encoding:', site_encoding)
     update_info(dumpDir, puki_url=puki_url, session=session)
 
+    engine = None
+    if args.engine == 'async':
+        engine = AsyncEngine(session=session, concurrency=args.threads, retries=args.retry,
+                             hard_retries=args.hard_retry, delay=args.delay, host_limits=host_limits,
+                             rate_limit=rate_limit, adaptive=adaptive, cache=response_cache, replay=args.replay)
+
     with DumpLock(dumpDir):
-        if args.content:
-            if os.path.exists(os.path.join(dumpDir, 'content_dumped.mark')):
-                print('Content already dumped.')
-            else:
-                print('\nDumping content...\n')
-                dump_content(puki_url=puki_url, dumpDir=dumpDir,
-                            session=session, threads=args.threads,
-                            ignore_errors=args.ignore_errors,
-                            ignore_action_disabled_edit=args.ignore_action_disabled_edit,
-                            current_only=args.current_only)
-                with open(os.path.join(dumpDir, 'content_dumped.mark'), 'w') as f:
-                    f.write('done')
-        # if args.html:
-        #     if os.path.exists(os.path.join(dumpDir, 'html_dumped.mark')):
-        #         print('HTML already dumped.')
-        #     else:
-        #         print('\nDumping HTML...\n')
-        #         dump_HTML(puki_url=puki_url, dumpDir=dumpDir,
-        #                 session=session, threads=args.threads,
-        #                 ignore_errors=args.ignore_errors, current_only=args.current_only)
-        #         with open(os.path.join(dumpDir, 'html_dumped.mark'), 'w') as f:
-        #             f.write('done')
-        if args.media: # last, so that we can know the dump is complete.
-            if os.path.exists(os.path.join(dumpDir, 'attach_dumped.mark')):
+        # resolved here, not in the phases: with --parallel-phases they run at the same time
+        config = get_config(dumpDir)
+        packed = args.packed or config.get(CONFIG_CONTENT_STORAGE) == 'packed'
+        blobs = args.attach_blobs or config.get(CONFIG_ATTACH_STORAGE) == 'blobs'
+
+        def dump_content_phases():
+            if args.content:
+                if os.path.exists(os.path.join(dumpDir, 'content_dumped.mark')) and not args.retry_failed:
+                    print('Content already dumped.')
+                else:
+                    print('\nDumping content...\n')
+                    update_config(dumpDir=dumpDir, config={CONFIG_CONTENT_STORAGE: 'packed' if packed else 'files'})
+                    with open_page_store(dumpDir, packed=packed) as store:
+                        dump_content(puki_url=puki_url, dumpDir=dumpDir,
+                                    session=session, threads=args.threads,
+                                    ignore_errors=args.ignore_errors,
+                                    ignore_action_disabled_edit=args.ignore_action_disabled_edit,
+                                    current_only=args.current_only, engine=engine, store=store,
+                                    since_dump=args.since_dump.rstrip('/'), retry_failed=args.retry_failed)
+                    with open(os.path.join(dumpDir, 'content_dumped.mark'), 'w') as f:
+                        f.write('done')
+            if args.content and not args.current_only:
+                if os.path.exists(os.path.join(dumpDir, 'history_dumped.mark')) and not args.retry_failed:
+                    print('History already dumped.')
+                else:
+                    print('\nDumping history...\n')
+                    dump_history(puki_url=puki_url, dumpDir=dumpDir,
+                                 session=session, threads=args.threads,
+                                 ignore_errors=args.ignore_errors, engine=engine, retry_failed=args.retry_failed)
+                    with open(os.path.join(dumpDir, 'history_dumped.mark'), 'w') as f:
+                        f.write('done')
+            # if args.html:
+            #     if os.path.exists(os.path.join(dumpDir, 'html_dumped.mark')):
+            #         print('HTML already dumped.')
+            #     else:
+            #         print('\nDumping HTML...\n')
+            #         dump_HTML(puki_url=puki_url, dumpDir=dumpDir,
+            #                 session=session, threads=args.threads,
+            #                 ignore_errors=args.ignore_errors, current_only=args.current_only)
+            #         with open(os.path.join(dumpDir, 'html_dumped.mark'), 'w') as f:
+            #             f.write('done')
+
+        def dump_media_phase() -> bool:
+            """ True if media was dumped (and attach_dumped.mark is to be written) """
+            if os.path.exists(os.path.join(dumpDir, 'attach_dumped.mark')) and not args.retry_failed:
                 print('Media already dumped.')
-            else:
-                print('\nDumping media...\n')
-                dump_attachs(base_url=base_url, dumpDir=dumpDir,
-                        session=session, threads=args.threads,
-                        ignore_errors=args.ignore_errors)
-                with open(os.path.join(dumpDir, 'attach_dumped.mark'), 'w') as f:
-                    f.write('done')
+                return False
+            print('\nDumping media...\n')
+            if args.replay:
+                # the files themselves are not in the response cache, only the attach lists
+                attaches = get_attachs(base_url, dumpDir=dumpDir, session=session, threads=args.threads)
+                print('Replay: %d files listed (dumpMeta/attachs.jsonl), not downloaded' % len(attaches))
+                return False
+            update_config(dumpDir=dumpDir, config={CONFIG_ATTACH_STORAGE: 'blobs' if blobs else 'files'})
+            dump_attachs(base_url=base_url, dumpDir=dumpDir,
+                    session=session, threads=args.threads,
+                    ignore_errors=args.ignore_errors, engine=engine, retry_failed=args.retry_failed,
+                    blobs=blobs, host_limits=host_limits, order=args.media_order)
+            return True
+
+        if args.media and args.content and args.parallel_phases:
+            # Both phases share the per-host limits (and so the origin's --threads budget).
+            # A daemon thread, so that a failed content phase or Ctrl-C doesn't wait for the media phase.
+            media_phase = PhaseThread(dump_media_phase, name='media-phase')
+            media_phase.start()
+            dump_content_phases()
+            media_dumped = media_phase.result()
+        else:
+            dump_content_phases()
+            media_dumped = dump_media_phase() if args.media else False
+        if media_dumped: # last, so that we can know the dump is complete.
+            with open(os.path.join(dumpDir, 'attach_dumped.mark'), 'w') as f:
+                f.write('done')
 
     session_monkey.release()
+    if response_cache is not None:
+        response_cache.close()
+    print_connection_stats(session)
+    if args.trim_php_warnings:
+        print(php_warning_log.summary())
     print('\n\n--Done--')
+    log.flush()
 
     if args.upload and args.auto:
         print('Uploading to Internet Archive...')
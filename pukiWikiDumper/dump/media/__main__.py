@@ -0,0 +1,17 @@
+import argparse
+
+from pukiWikiDumper.dump.media.blobs import relink
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recreate attach/ from the attachment blob store (attachblobs/).')
+    parser.add_argument('command', choices=['relink'])
+    parser.add_argument('dump_dir', help='Path to the wiki dump directory.')
+    args = parser.parse_args()
+
+    if args.command == 'relink':
+        relink(args.dump_dir.rstrip('/'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+import os
+import shutil
+import threading
+from typing import Dict, Optional, Tuple
+
+from pukiWikiDumper.utils.jsonl import append_jsonl, iter_jsonl, open_jsonl
+from pukiWikiDumper.utils.util import smkdirs
+from pukiWikiDumper.utils.util import print_with_lock as print
+
+BLOB_DIR = 'attachblobs'
+BLOB_INDEX = 'index.jsonl'
+
+CONFIG_ATTACH_STORAGE = 'attach_storage' # 'files' or 'blobs'
+
+
+def link_or_copy(src: str, dst: str):
+    try:
+        os.link(src, dst)
+    except OSError: # e.g. no hardlinks on this filesystem
+        shutil.copy2(src, dst)
+
+
+class BlobStore:
+    """ Stores each distinct attachment once, as `attachblobs/<sha1[:2]>/<sha1>`,
+    and hardlinks it to its `attach/` path(s).
+
+    `attachblobs/index.jsonl` maps each `attach/` path to its blob:
+    `{"path": "attach/...", "sha1": ..., "size": 123, "last_modified": ...}`.
+    The blob is in place before its index line, and the index line is written
+    before the `attach/` link. The last entry of a path wins.
+    `Last-Modified` is only kept in the index, not as the mtime of the shared blob.
+    """
+
+    def __init__(self, dumpDir: str):
+        self.dumpDir = dumpDir
+        self.blob_dir = os.path.join(dumpDir, BLOB_DIR)
+        self.index: Dict[str, dict] = {}
+        self._by_header: Dict[Tuple[int, str], str] = {} # (size, Last-Modified): sha1
+        self._lock = threading.Lock()
+        self._index_f = None
+
+        smkdirs(dumpDir, BLOB_DIR)
+        self._load_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def blob_path(self, sha1: str) -> str:
+        return os.path.join(self.blob_dir, sha1[:2], sha1)
+
+    def _load_index(self):
+        for entry in iter_jsonl(os.path.join(self.blob_dir, BLOB_INDEX)):
+            self._add_entry(entry)
+
+    def _add_entry(self, entry: dict):
+        self.index[entry['path']] = entry
+        if entry.get('last_modified'):
+            self._by_header[(entry['size'], entry['last_modified'])] = entry['sha1']
+
+    def _open(self):
+        if self._index_f is None:
+            self._index_f = open_jsonl(os.path.join(self.blob_dir, BLOB_INDEX))
+        return self._index_f
+
+    def find(self, size: Optional[int], last_modified: Optional[str]) -> Optional[str]:
+        """ sha1 of a blob we already have with this size and `Last-Modified`, if any """
+        if size is None or not last_modified:
+            return None
+        with self._lock:
+            sha1 = self._by_header.get((size, last_modified))
+        if sha1 is not None and os.path.exists(self.blob_path(sha1)):
+            return sha1
+        return None
+
+    def _record(self, file: str, sha1: str, size: int, last_modified: Optional[str]):
+        entry = {
+            'path': os.path.relpath(file, self.dumpDir).replace(os.sep, '/'),
+            'sha1': sha1,
+            'size': size,
+            'last_modified': last_modified,
+        }
+        append_jsonl(self._open(), entry)
+        self._add_entry(entry)
+
+    def add(self, part: str, file: str, sha1: str, last_modified: Optional[str]) -> bool:
+        """ Move the downloaded `part` into the store (or drop it if we have that blob already)
+        and link it to `file`. Returns `False` if it was a duplicate. """
+        blob = self.blob_path(sha1)
+        with self._lock:
+            new = not os.path.exists(blob)
+            size = os.path.getsize(part)
+            if new:
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                os.replace(part, blob)
+            else:
+                os.remove(part)
+            self._record(file, sha1, size, last_modified)
+            link_or_copy(blob, file)
+        return new
+
+    def link(self, sha1: str, file: str, last_modified: Optional[str]):
+        """ Link an existing blob to `file` """
+        blob = self.blob_path(sha1)
+        with self._lock:
+            self._record(file, sha1, os.path.getsize(blob), last_modified)
+            link_or_copy(blob, file)
+
+    def close(self):
+        with self._lock:
+            if self._index_f is not None:
+                self._index_f.close()
+            self._index_f = None
+
+
+def relink(dumpDir: str):
+    """ Recreate `attach/` from `attachblobs/` (e.g. after extracting an uploaded dump) """
+    store = BlobStore(dumpDir)
+    count = 0
+    for path, entry in store.index.items():
+        file = os.path.join(dumpDir, path)
+        if os.path.exists(file):
+            continue
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        link_or_copy(store.blob_path(entry['sha1']), file)
+        count += 1
+    store.close()
+    print('Relinked %d files (%d paths, %d blobs)' % (count, len(store.index),
+                                                       len({entry['sha1'] for entry in store.index.values()})))
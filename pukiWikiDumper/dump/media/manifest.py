@@ -0,0 +1,111 @@
+import hashlib
+import os
+import threading
+from typing import Dict, Optional
+
+from pukiWikiDumper.utils.jsonl import append_jsonl, iter_jsonl, open_jsonl
+from pukiWikiDumper.utils.util import smkdirs
+
+MANIFEST_FILEPATH = 'dumpMeta/attachs.manifest.jsonl'
+CHUNK_SIZE = 1024 * 1024 # download and hashing chunk size
+
+
+class StreamHasher:
+    """ SHA-1, SHA-256 and byte count of a file, fed chunk by chunk while it is written """
+
+    def __init__(self):
+        self._sha1 = hashlib.sha1()
+        self._sha256 = hashlib.sha256()
+        self.size = 0
+
+    def update(self, chunk):
+        self._sha1.update(chunk)
+        self._sha256.update(chunk)
+        self.size += len(chunk)
+
+    def update_from_file(self, path: str):
+        """ Feed an existing file (e.g. the bytes of a resumed `.part`) through one reused buffer """
+        buffer = bytearray(CHUNK_SIZE)
+        view = memoryview(buffer)
+        with open(path, 'rb') as f:
+            while True:
+                n = f.readinto(buffer)
+                if not n:
+                    break
+                self.update(view[:n])
+
+    @property
+    def sha1(self) -> str:
+        return self._sha1.hexdigest()
+
+    @property
+    def sha256(self) -> str:
+        return self._sha256.hexdigest()
+
+
+def hash_file(path: str) -> StreamHasher:
+    hasher = StreamHasher()
+    hasher.update_from_file(path)
+    return hasher
+
+
+class AttachManifest:
+    """ Size and digests of every downloaded attachment, computed while it streamed.
+
+    `dumpMeta/attachs.manifest.jsonl` gets one line per file once it is in place:
+    `{"key": "FrontPage/a.png", "path": "attach/...", "size": 123, "sha1": ..., "sha256": ..., "last_modified": ...}`.
+    The last line of a key wins.
+    """
+
+    def __init__(self, dumpDir: str):
+        self.dumpDir = dumpDir
+        self.path = os.path.join(dumpDir, MANIFEST_FILEPATH)
+        self.entries: Dict[str, dict] = {}
+        self._by_sha1: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._f = None
+
+        self._load()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _load(self):
+        for entry in iter_jsonl(self.path):
+            self._add_entry(entry)
+
+    def _add_entry(self, entry: dict):
+        self.entries[entry['key']] = entry
+        self._by_sha1[entry['sha1']] = entry
+
+    def _open(self):
+        if self._f is None:
+            smkdirs(self.dumpDir, '/dumpMeta')
+            self._f = open_jsonl(self.path)
+        return self._f
+
+    def by_sha1(self, sha1: str) -> Optional[dict]:
+        with self._lock:
+            return self._by_sha1.get(sha1)
+
+    def record(self, key: str, file: str, size: int, sha1: str, sha256: str, last_modified: Optional[str]):
+        entry = {
+            'key': key,
+            'path': os.path.relpath(file, self.dumpDir).replace(os.sep, '/'),
+            'size': size,
+            'sha1': sha1,
+            'sha256': sha256,
+            'last_modified': last_modified,
+        }
+        with self._lock:
+            append_jsonl(self._open(), entry)
+            self._add_entry(entry)
+
+    def close(self):
+        with self._lock:
+            if self._f is not None:
+                self._f.close()
+            self._f = None
@@ -1,34 +1,81 @@
+import collections
+import contextlib
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
 import json
 import os
+import re
+import shutil
 import threading
 import time
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 import urllib.parse as urlparse
 
 from bs4 import BeautifulSoup
 import requests
-from tqdm import tqdm
 
 from pukiWikiDumper.dump.content.titles import get_pages
-from pukiWikiDumper.utils.util import load_pages, smkdirs, uopen
+from pukiWikiDumper.exceptions import IncompleteDownload
+from pukiWikiDumper.utils.async_engine import AsyncEngine
+from pukiWikiDumper.utils.encoding import is_euc_jp
+from pukiWikiDumper.utils.host_limits import HostLimits, url_host
+from pukiWikiDumper.utils.journal import DONE, FAILED, Journal
+from pukiWikiDumper.utils.jsonl import append_jsonl, iter_jsonl, open_jsonl
+from pukiWikiDumper.utils.log import format_bytes, format_duration, log
+from pukiWikiDumper.utils.scheduler import Scheduler
+from pukiWikiDumper.utils.util import iter_saved_pages, load_pages, save_pages_as_we_go, smkdirs, uopen
 from pukiWikiDumper.utils.util import print_with_lock as print
 from pukiWikiDumper.utils.config import running_config
 
+from .blobs import BlobStore
+from .manifest import CHUNK_SIZE, AttachManifest, StreamHasher, hash_file
 
 
-sub_thread_error = None
 
+ATTACH_NAMESPACES_CHECKPOINT = 'dumpMeta/attachs.namespaces.jsonl'
 
-def get_attachs(base_url: str, ns: str = '', ns_encoding: str = 'utf-8', dumpDir: str = '', session: requests.Session=None) -> List[Dict[str, str]]:
-    """ Return a list of media filenames of a wiki """
+# title of the pcmd=open link: "2002/07/23 17:39:29 13.0KB"
+ATTACH_TITLE_RE = re.compile(r'(\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2})\s+([\d.]+)\s*([KMGT]?B)', re.I)
+SIZE_UNITS = {'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4}
 
-    if dumpDir and os.path.exists(dumpDir + '/dumpMeta/attachs.jsonl'):
-        with uopen(dumpDir + '/dumpMeta/attachs.jsonl', 'r') as f:
-            attaches = [json.loads(line) for line in f]
-            return attaches
+MEDIA_ORDERS = ('list', 'largest', 'smallest')
 
-    attaches: List[Dict] = []
 
+def _parse_query(href: str, base_url: str, soup: BeautifulSoup):
+    """ `(query, url_encoding)` of a link on an attach list page """
+    full_url: str = urlparse.urljoin(base_url, href)
+    parsed = urlparse.urlparse(full_url)
+
+    encodings = [soup.original_encoding] + ['euc-jp', 'euc_jisx0213', 'utf-8', 'shift_jis']
+    query = None
+    url_encoding: Optional[str] = None
+    for encoding in encodings:
+        try:
+            query = urlparse.parse_qs(parsed.query, errors='strict', encoding=encoding)
+            url_encoding = encoding
+            break
+        except UnicodeDecodeError:
+            pass
+    assert query, f'Failed to parse query string: {parsed.query}'
+    return query, url_encoding
+
+
+def parse_attach_title(title: Optional[str]) -> Tuple[Optional[str], Optional[int]]:
+    """ `(time, approximate size in bytes)` from `"2002/07/23 17:39:29 13.0KB"` """
+    m = ATTACH_TITLE_RE.search(title or '')
+    if m is None:
+        return None, None
+    return m.group(1), int(float(m.group(2)) * SIZE_UNITS[m.group(3).upper()])
+
+
+def list_attachs(base_url: str, ns: str = '', ns_encoding: str = 'utf-8', session: requests.Session=None
+                 ) -> Optional[Tuple[List[Dict], List[Tuple[str, str]]]]:
+    """ `(attaches, namespaces)` on the `plugin=attach&pcmd=list` page of `ns`.
+
+    `namespaces` are the `(refer, url_encoding)` of per-page lists linked from it
+    (https://wikiwiki.jp/genshinwiki/?cmd=attach&pcmd=list).
+    `None` if PHP ran out of memory building the list.
+    """
     params={'plugin': 'attach', 'pcmd': 'list'}
     if ns:
         params['refer'] = ns
@@ -39,7 +86,7 @@ def get_attachs(base_url: str, ns: str = '', ns_encoding: str = 'utf-8', dumpDir
     r = session.get(url, headers={'Referer': url})
 
     from_encoding = None
-    if str(r.encoding).lower() == 'euc-jp' or str(r.apparent_encoding).lower() == 'euc-jp':
+    if is_euc_jp(r):
         from_encoding = 'euc_jisx0213'
 
     attach_list_soup = BeautifulSoup(r.content, running_config.html_parser,from_encoding=from_encoding, exclude_encodings=['iso-8859-1', 'windows-1252'])
@@ -51,205 +98,629 @@ def get_attachs(base_url: str, ns: str = '', ns_encoding: str = 'utf-8', dumpDir
     if body is None and 'Fatal error: Allowed memory size of' in r.text:
         # http://deco.gamedb.info/wiki/?plugin=attach&pcmd=list
         print('Fatal error: Allowed memory size of... (OOM), ns:', ns)
-        if ns:
-            # avoid infinite loop
-            return []
-        pages = load_pages(pagesFilePath=dumpDir + '/dumpMeta/pages.jsonl')
-        if pages is None:
-            pages = get_pages(url=base_url, session=session)
-        for page in tqdm(pages):
-            for attach in get_attachs(base_url=base_url, ns=page['title'], ns_encoding=page['url_encoding'], session=session):
-                if attach not in attaches:
-                    attaches.append(attach)
-        print('Found %d files in all namespaces' % len(attaches))
-        if dumpDir:
-            save_attachs(dumpDir, attaches)
-        return attaches
-    
+        return None
+
     assert body, f'Failed to find body in {r.url}'
+    attaches: List[Dict] = []
+    namespaces: List[Tuple[str, str]] = []
     hrefs = body.find_all('a', href=True) # type: ignore
     for a in hrefs:
         if "pcmd=info" in a['href']:
-            full_url: str = urlparse.urljoin(base_url, a['href'])
-            parsed = urlparse.urlparse(full_url)
-
-            encodings = [attach_list_soup.original_encoding] + ['euc-jp', 'euc_jisx0213', 'utf-8', 'shift_jis']
-            query = None
-            url_encoding: str = None
-            for encoding in encodings:
-                try:
-                    query = urlparse.parse_qs(parsed.query, errors='strict', encoding=encoding)
-                    url_encoding = encoding
-                    break
-                except UnicodeDecodeError:
-                    pass
-            assert query, f'Failed to parse query string: {parsed.query}'
-
+            query, url_encoding = _parse_query(a['href'], base_url, attach_list_soup)
             file = query['file'][0]
             refer = query['refer'][0]
             age = int(query['age'][0]) if 'age' in query else None
+            li = a.find_parent('li')
+            open_a = li.find('a', href=lambda href: 'pcmd=open' in href, title=True) if li else None
+            time_, size = parse_attach_title(open_a['title'] if open_a else None)
             attaches.append({
                 'refer': refer,
                 'file': file,
                 'age': age,
                 'url_encoding': url_encoding,
+                'time': time_,
+                'size': size,
             })
-        # https://wikiwiki.jp/genshinwiki/?cmd=attach&pcmd=list
         elif "pcmd=list" in a['href']:
-            full_url: str = urlparse.urljoin(base_url, a['href'])
-            parsed = urlparse.urlparse(full_url)
-
-            encodings = [attach_list_soup.original_encoding] + ['euc-jp', 'euc_jisx0213', 'utf-8', 'shift_jis']
-            query = None
-            url_encoding: Optional[str] = None
-            for encoding in encodings:
-                try:
-                    query = urlparse.parse_qs(parsed.query, errors='strict', encoding=encoding)
-                    url_encoding = encoding
-                    break
-                except UnicodeDecodeError:
-                    pass
-            assert query, f'Failed to parse query string: {parsed.query}'
-
-            ns = query['refer'][0]
-            assert ns, f'Failed to parse refer: {parsed.query}'
-            print(f'Looking for attachs in namespace {ns}')
-            ns_saved = 0
-            for attach in get_attachs(base_url, ns=ns, ns_encoding=url_encoding or 'utf-8', session=session):
-                if attach not in attaches:
-                    attaches.append(attach)
-                    ns_saved += 1
-                else:
-                    # print(f'Found duplicate attach: {attach}')
-                    pass
-            print(f'Found {ns_saved} new attachs in namespace {ns}')
-        else:
-            continue
+            query, url_encoding = _parse_query(a['href'], base_url, attach_list_soup)
+            refer = query.get('refer', [''])[0]
+            if refer and refer != ns: # not the list of all pages or this one
+                namespaces.append((refer, url_encoding or 'utf-8'))
 # <li><a href="./?plugin=attach&amp;pcmd=open&amp;file=sample1.png&amp;refer=BugTrack%2F100" title="2002/07/23 17:39:29 13.0KB">sample1.png</a> <span class="small">[<a href="./?plugin=attach&amp;pcmd=info&amp;file=sample1.png&amp;refer=BugTrack%2F100" title="添付ファイルの情報">詳細</a>]</span></li>
-    print('Found %d files in namespace %s' % (len(attaches), ns or '(all)'))
-    if dumpDir:
-        save_attachs(dumpDir, attaches)
+    return attaches, namespaces
+
+
+def iter_namespaces(base_url: str, namespaces: List[Tuple[str, str]], dumpDir: str = '',
+                    session: requests.Session=None, threads: int = 1) -> Iterator[Tuple[str, List[Dict]]]:
+    """ `(ns, attaches)` of every namespace (and the ones they link to) as soon as it is listed,
+    `threads` at a time.
+
+    Finished namespaces are appended to `dumpMeta/attachs.namespaces.jsonl`,
+    so an interrupted enumeration only lists the rest again (those are yielded first).
+    """
+    checkpoint_path = os.path.join(dumpDir, ATTACH_NAMESPACES_CHECKPOINT) if dumpDir else None
+    done: Dict[str, Dict] = {} # ns: {'ns': ..., 'attachs': [...], 'namespaces': [...]}
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        for entry in iter_jsonl(checkpoint_path):
+            done[entry['ns']] = entry
+        print('Attach list: %d namespaces already listed (checkpoint)' % len(done))
+
+    order: List[str] = []
+    visited = set()
+    todo = collections.deque()
+
+    def discover(namespaces: List[Tuple[str, str]]):
+        for ns, ns_encoding in namespaces:
+            if ns in visited:
+                continue
+            visited.add(ns)
+            order.append(ns)
+            if ns in done:
+                discover(done[ns]['namespaces'])
+            else:
+                todo.append((ns, ns_encoding))
+
+    discover(namespaces)
+    for ns in list(order):
+        if ns in done:
+            yield ns, done[ns]['attachs']
+
+    checkpoint = None
+    if checkpoint_path:
+        smkdirs(dumpDir, '/dumpMeta')
+        checkpoint = open_jsonl(checkpoint_path)
+    try:
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='attach-list') as executor:
+            running = {}
+            while todo or running:
+                while todo and len(running) < threads:
+                    ns, ns_encoding = todo.popleft()
+                    running[executor.submit(list_attachs, base_url, ns, ns_encoding, session)] = ns
+                finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    ns = running.pop(future)
+                    listed = future.result() or ([], []) # OOM: nothing more we can do for this namespace
+                    entry = {'ns': ns, 'attachs': listed[0], 'namespaces': listed[1]}
+                    done[ns] = entry
+                    if checkpoint:
+                        append_jsonl(checkpoint, entry)
+                    print(f'Found {len(entry["attachs"])} attachs in namespace {ns} ({len(done)}/{len(visited)})')
+                    discover(entry['namespaces'])
+                    yield ns, entry['attachs']
+    finally:
+        if checkpoint:
+            checkpoint.close()
+
+
+def iter_attachs(base_url: str, ns: str = '', ns_encoding: str = 'utf-8', dumpDir: str = '',
+                 session: requests.Session=None, threads: int = 1) -> Iterator[Dict]:
+    """ Every attachment of the wiki (no duplicates), as soon as its namespace is listed.
+
+    With `dumpDir`, they are written to `dumpMeta/attachs.jsonl` as we go (complete once exhausted),
+    or read from there if it exists.
+    """
+    attachsFilePath = dumpDir + '/dumpMeta/attachs.jsonl'
+    if dumpDir and os.path.exists(attachsFilePath):
+        yield from iter_saved_pages(attachsFilePath)
+        return
+
+    def enumerate_attachs():
+        listed = list_attachs(base_url, ns=ns, ns_encoding=ns_encoding, session=session)
+        if listed is None:
+            if ns:
+                # avoid infinite loop
+                return
+            # list every page on its own instead
+            pages = load_pages(pagesFilePath=dumpDir + '/dumpMeta/pages.jsonl')
+            if pages is None:
+                pages = get_pages(url=base_url, session=session)
+            listed = ([], [(page['title'], page['url_encoding']) for page in pages])
+
+        attaches, namespaces = listed
+        yield from attaches
+        if namespaces:
+            for _, attaches in iter_namespaces(base_url, namespaces, dumpDir=dumpDir, session=session, threads=threads):
+                yield from attaches
+
+    def unique(attaches: Iterable[Dict]):
+        seen = set()
+        for attach in attaches:
+            key = attach_key(attach)
+            if key not in seen:
+                seen.add(key)
+                yield attach
+        print('Found %d files in namespace %s' % (len(seen), ns or '(all)'))
 
-    return attaches
+    if not dumpDir:
+        yield from unique(enumerate_attachs())
+        return
+    smkdirs(dumpDir + '/dumpMeta')
+    yield from save_pages_as_we_go(attachsFilePath, unique(enumerate_attachs()))
+    if os.path.exists(os.path.join(dumpDir, ATTACH_NAMESPACES_CHECKPOINT)):
+        os.remove(os.path.join(dumpDir, ATTACH_NAMESPACES_CHECKPOINT))
 
 
-def save_attachs(dumpDir: str, attaches: List[Dict]):
-    smkdirs(dumpDir + '/dumpMeta')
-    with uopen(dumpDir + '/dumpMeta/attachs.jsonl', 'w') as f:
-        for attach in attaches:
-            f.write(json.dumps(attach, ensure_ascii=False)+'\n')
+def get_attachs(base_url: str, ns: str = '', ns_encoding: str = 'utf-8', dumpDir: str = '', session: requests.Session=None,
+                threads: int = 1) -> List[Dict[str, str]]:
+    """ Return a list of media filenames of a wiki """
+    return list(iter_attachs(base_url, ns=ns, ns_encoding=ns_encoding, dumpDir=dumpDir, session=session, threads=threads))
 
 
-def dump_attachs(base_url: str = '', dumpDir: str = '', session=None, threads: int = 1, ignore_errors: bool = False):
+def sort_attachs(attaches: List[Dict], order: str = 'list') -> List[Dict]:
+    """ `list`: as listed, `largest`/`smallest`: by the size on the attach list, unknown sizes last """
+    if order == 'list':
+        return attaches
+    if order not in MEDIA_ORDERS:
+        raise ValueError('order must be one of %s' % (MEDIA_ORDERS,))
+    known = [attach for attach in attaches if attach.get('size') is not None]
+    unknown = [attach for attach in attaches if attach.get('size') is None]
+    return sorted(known, key=lambda attach: attach['size'], reverse=(order == 'largest')) + unknown
+
+
+class TransferStats:
+    """ Expected bytes (sizes from the attach list) vs. finished bytes, for the summary
+    (while downloading, the ETA is on the progress line of `utils.log`) """
+
+    def __init__(self):
+        self.total = 0
+        self.unknown = 0
+        self.done = 0
+        self.start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, attach: Dict):
+        """ `attach` is going to be downloaded """
+        with self._lock:
+            self.total += attach.get('size') or 0
+            self.unknown += attach.get('size') is None
+
+    def describe(self) -> str:
+        return '~%s expected' % format_bytes(self.total) + (' (+%d files of unknown size)' % self.unknown if self.unknown else '')
+
+    def finish(self, attach: Dict):
+        with self._lock:
+            self.done += attach.get('size') or 0
+
+    def report(self) -> str:
+        elapsed = max(time.monotonic() - self.start, 1e-6)
+        rate = self.done / elapsed
+        eta = '?'
+        if rate:
+            eta = format_duration(max(self.total - self.done, 0) / rate)
+        return '%s of %s, %s/s, ETA %s' % (format_bytes(self.done), format_bytes(self.total), format_bytes(rate), eta)
+
+
+def dump_attachs(base_url: str = '', dumpDir: str = '', session=None, threads: int = 1, ignore_errors: bool = False,
+                 engine: Optional[AsyncEngine] = None, retry_failed: bool = False, blobs: bool = False,
+                 host_limits: Optional[HostLimits] = None, order: str = 'list'):
+    """ `retry_failed`: only re-run the files the progress journal has as failed
+    `order`: download order, see `sort_attachs()`
+    `blobs`: store each distinct file once in `attachblobs/`, hardlinked into `attach/` (see `BlobStore`)
+    `host_limits`: download with as many workers as the attachment host allows (e.g. a CDN), not `threads` """
     if not dumpDir:
         raise ValueError('dumpDir must be set')
 
     smkdirs(dumpDir + '/attach')
 
-    attaches = get_attachs(base_url, dumpDir=dumpDir, session=session)
-    def try_download(*args, **kwargs):
-        try:
-            download(*args, **kwargs)
-        except Exception as e:
-            if not ignore_errors:
-                global sub_thread_error
-                sub_thread_error = e
-                raise e
-            print(threading.current_thread().name, 'Error in sub thread: (', e, ') ignored')
-    index_of_title = -1
-    for attach in attaches:
-        index_of_title += 1
-        while threading.active_count() > threads:
-            time.sleep(0.1)
-        if sub_thread_error:
-            raise sub_thread_error
-        print('Media: (%d/%d): [[%s]] ...' % (index_of_title+1, len(attaches), attach))
-
-        def download(attach: Dict[str, str], session: requests.Session):
-            filename = attach['refer'].encode('utf-8').hex() + '_' + attach['file'].encode('utf-8').hex() + (f".{attach['age']}" if attach['age'] else "")
-            filename = filename.upper()
-            if len(filename) > 255: # filename too long
-                subdir_A = filename[:255]
-                subfilename_B = filename[255:]
-                smkdirs(dumpDir, '/attach/' + subdir_A)
-                file = dumpDir + '/attach/' + subdir_A + '/' + subfilename_B
+    if os.path.exists(dumpDir + '/dumpMeta/attachs.jsonl') or order != 'list':
+        # already listed, or we need them all to sort them
+        attaches = sort_attachs(get_attachs(base_url, dumpDir=dumpDir, session=session, threads=threads), order)
+    else:
+        # download while the namespaces are still being listed
+        attaches = iter_attachs(base_url, dumpDir=dumpDir, session=session, threads=threads)
+
+    def progress(attaches):
+        total = len(attaches) if isinstance(attaches, list) else '?'
+        for index, attach in enumerate(attaches):
+            log.debug('Media: (%d/%s): [[%s]] ...' % (index + 1, total, attach))
+            yield attach
+
+    with BlobStore(dumpDir) if blobs else contextlib.nullcontext() as blob_store, \
+         AttachManifest(dumpDir) as manifest, Journal(dumpDir, 'media') as journal:
+        stats = TransferStats()
+        finished = 0
+
+        def pending(attaches: Iterable[Dict]):
+            nonlocal finished
+            for attach in attaches:
+                if retry_failed: # partial downloads resume from their .part
+                    if journal.status(attach_key(attach)) != FAILED:
+                        continue
+                elif journal.is_finished(attach_key(attach)):
+                    finished += 1
+                    log.progress('Media', done=0, skipped=1)
+                    continue
+                stats.add(attach)
+                yield attach
+
+        if isinstance(attaches, list):
+            attaches = list(pending(attaches))
+            if retry_failed:
+                print('Media: retrying %d failed files' % len(attaches))
+            elif finished:
+                print('Media: %d files already finished (progress journal), %d to go' % (finished, len(attaches)))
+            print('Media: %d files to download, %s' % (len(attaches), stats.describe()))
+            log.progress_total('Media', finished + len(attaches), stats.total)
+            free = shutil.disk_usage(dumpDir).free
+            if stats.total > free:
+                print('Media: Warning: only %s free on disk' % format_bytes(free))
+        else:
+            attaches = pending(attaches)
+
+        workers = threads
+        if host_limits is not None:
+            url = attach_url(base_url, {'refer': 'FrontPage', 'file': 'x', 'age': None, 'url_encoding': 'utf-8'})
+            if host_limits.get(url).concurrency != threads:
+                workers = host_limits.get(url).concurrency
+                print('Media: %d workers (host limit of %s)' % (workers, url_host(url)))
+
+        def record(attach: Dict[str, str], e: Optional[Exception]):
+            log.progress('Media', nbytes=(attach.get('size') or 0) if e is None else 0)
+            if e is None:
+                journal.record(attach_key(attach), DONE)
+                stats.finish(attach)
             else:
-                file = dumpDir + '/attach/' + filename
-            local_size = -1
-            if os.path.exists(file):
-                local_size = os.path.getsize(file)
-                print(threading.current_thread().name,
-                              'File [[%s]] Exists' % attach)
-                return
-            # ?plugin=attach&pcmd=open&file=article.inc.php&refer=PukiWiki%2F1.4%2F%E8%87%AA%E4%BD%9C%E3%83%97%E3%83%A9%E3%82%B0%E3%82%A4%E3%83%B3
-            params={
-                'plugin': "attach",
-                'pcmd': "open",
-                'file': attach['file'],
-                'refer': attach['refer'],
-            }
-            if attach['age']:
-                params['age'] = attach['age']
-            urlencoded = urlparse.urlencode(params, encoding=attach['url_encoding'], errors='strict')
-            url = base_url + '?' + urlencoded
-
-            # workround for wikiwiki.jp
-            # https://wikiwiki.jp/genshinwiki/?plugin=attach&pcmd=open&file=浮流の対玉_5.png&refer=バッグ%2F聖遺物 ->
-            # https://cdn.wikiwiki.jp/to/w/genshinwiki/バッグ/聖遺物/::attach/浮流の対玉_5.png
-            if 'wikiwiki.jp' in base_url:
-                url = ("https://cdn.wikiwiki.jp/to/w/" + 
-                       base_url.replace("https://wikiwiki.jp/", "").rstrip('/') + '/' +
-                       f"{attach['refer']}/::attach/{attach['file']}" +
-                       (f"?age={attach['age']}" if attach['age'] else "")
-                       )
-                print(f"wikipedia.jp detected, using {url} instead of {base_url}?{urlencoded}")
-
-            with session.get(url,
-            stream=True, headers={'Referer': base_url}
-            ) as r:
-                if local_size == -1:  # file does not exist
-                    to_download = True
+                journal.record(attach_key(attach), FAILED, e)
+                raise e
+
+        if engine is not None:
+            async def download(engine: AsyncEngine, attach: Dict[str, str]):
+                try:
+                    await download_attach_async(engine, attach, base_url, dumpDir, blob_store, manifest)
+                except Exception as e:
+                    record(attach, e)
+                else:
+                    record(attach, None)
+
+            errors = engine.run(download, progress(attaches), ignore_errors=ignore_errors, concurrency=workers)
+        else:
+            def download(attach: Dict[str, str]):
+                try:
+                    download_attach(attach, base_url, dumpDir, session, blob_store, host_limits, manifest)
+                except Exception as e:
+                    record(attach, e)
                 else:
-                    remote_size = int(r.headers.get('Content-Length', -2))
-                    if local_size == remote_size:  # file exists and is complete
-                        print(threading.current_thread().name,
-                              'File [[%s]] exists (%d bytes)' % (attach, local_size))
-                        to_download = False
-                    elif remote_size == -2:
-                        print(threading.current_thread().name,
-                          'File [[%s]] cannot get remote size ("Content-Length" missing), ' % attach +
-                          'will re-download anyway')
-                        to_download = True
-                    else:
-                        to_download = True  # file exists but is incomplete
-
-                if to_download:
-                    if 'wikiwiki.jp' in base_url:
-                        r.raise_for_status()
-                    else:
-                        assert "content-disposition" in r.headers, r.url
-                    with open(file, 'wb') as f:
-                        for chunk in r.iter_content(chunk_size=8192):
-                            f.write(chunk)
-                        print(threading.current_thread().name,
-                              'File [[%s]] Done' % attach)
-                # modify mtime based on Last-Modified header
-                last_modified = r.headers.get('Last-Modified', None)
-                if last_modified:
-                    mtime = time.mktime(time.strptime(
-                        last_modified, '%a, %d %b %Y %H:%M:%S %Z'))
-                    atime = os.stat(file).st_atime
-                    # atime is not modified
-                    os.utime(file, times=(atime, mtime))
-                    # print(atime, mtime)
-
-            # time.sleep(1.5)
-
-        t = threading.Thread(target=try_download, daemon=True,
-                             args=(attach, session))
-        t.start()
-
-    while threading.active_count() > 1:
-        time.sleep(2)
-        print('Waiting for %d threads to finish' %
-              (threading.active_count() - 1), end='\r')
+                    record(attach, None)
+
+            with Scheduler(workers=workers, ignore_errors=ignore_errors, name='media') as scheduler:
+                for attach in progress(attaches):
+                    scheduler.submit(download, attach)
+            errors = scheduler.errors
+
+        log.progress_end('Media')
+        print('Media:', stats.report())
+        print('Media: progress journal:', journal.counts())
+        if blob_store is not None:
+            print('Media: %d files stored as %d blobs' % (len(blob_store.index),
+                                                       len({entry['sha1'] for entry in blob_store.index.values()})))
+    if errors:
+        print('Media: %d files failed (ignored), use --retry-failed to try them again' % len(errors))
+
+
+def attach_key(attach: Dict[str, str]) -> str:
+    """ `refer/file[?age=N]`, identifies an attachment in the progress journal """
+    return attach['refer'] + '/' + attach['file'] + (f"?age={attach['age']}" if attach['age'] else "")
+
+
+def attach_filepath(dumpDir: str, attach: Dict[str, str]) -> str:
+    """ `dumpDir/attach/<HEX(refer)>_<HEX(file)>[.age]`, split into a subdir if the filename is too long """
+    filename = attach['refer'].encode('utf-8').hex() + '_' + attach['file'].encode('utf-8').hex() + (f".{attach['age']}" if attach['age'] else "")
+    filename = filename.upper()
+    if len(filename) > 255: # filename too long
+        subdir_A = filename[:255]
+        subfilename_B = filename[255:]
+        smkdirs(dumpDir, '/attach/' + subdir_A)
+        return dumpDir + '/attach/' + subdir_A + '/' + subfilename_B
+
+    return dumpDir + '/attach/' + filename
+
+
+def attach_url(base_url: str, attach: Dict[str, str]) -> str:
+    # ?plugin=attach&pcmd=open&file=article.inc.php&refer=PukiWiki%2F1.4%2F%E8%87%AA%E4%BD%9C%E3%83%97%E3%83%A9%E3%82%B0%E3%82%A4%E3%83%B3
+    params={
+        'plugin': "attach",
+        'pcmd': "open",
+        'file': attach['file'],
+        'refer': attach['refer'],
+    }
+    if attach['age']:
+        params['age'] = attach['age']
+    urlencoded = urlparse.urlencode(params, encoding=attach['url_encoding'], errors='strict')
+    url = base_url + '?' + urlencoded
+
+    # workround for wikiwiki.jp
+    # https://wikiwiki.jp/genshinwiki/?plugin=attach&pcmd=open&file=浮流の対玉_5.png&refer=バッグ%2F聖遺物 ->
+    # https://cdn.wikiwiki.jp/to/w/genshinwiki/バッグ/聖遺物/::attach/浮流の対玉_5.png
+    if 'wikiwiki.jp' in base_url:
+        url = ("https://cdn.wikiwiki.jp/to/w/" + 
+               base_url.replace("https://wikiwiki.jp/", "").rstrip('/') + '/' +
+               f"{attach['refer']}/::attach/{attach['file']}" +
+               (f"?age={attach['age']}" if attach['age'] else "")
+               )
+        print(f"wikipedia.jp detected, using {url} instead of {base_url}?{urlencoded}")
+
+    return url
+
+
+def check_attach_response(base_url: str, r: requests.Response):
+    if 'wikiwiki.jp' in base_url:
+        r.raise_for_status()
+    else:
+        assert "content-disposition" in r.headers, r.url
+
+
+def set_mtime(file: str, last_modified: Optional[str]):
+    """ modify mtime based on Last-Modified header """
+    if last_modified:
+        mtime = time.mktime(time.strptime(
+            last_modified, '%a, %d %b %Y %H:%M:%S %Z'))
+        atime = os.stat(file).st_atime
+        # atime is not modified
+        os.utime(file, times=(atime, mtime))
+        # print(atime, mtime)
+
+
+PART_SUFFIX = '.part'
+# Content-Range: bytes 100-199/200 (or bytes */200 on 416)
+CONTENT_RANGE_RE = re.compile(r'bytes\s+(?:(\d+)-\d+|\*)/(\d+|\*)')
+
+
+def attach_request_headers(base_url: str, offset: int, validator: Optional[str] = None) -> Dict[str, str]:
+    """ `validator`: the `If-Range` of the `.part`, so a file changed on the server is sent whole (200) """
+    headers = {'Referer': base_url}
+    if offset:
+        headers['Range'] = 'bytes=%d-' % offset
+        headers['If-Range'] = validator
+    return headers
+
+
+def if_range_validator(headers) -> Optional[str]:
+    """ A strong `ETag`, or `Last-Modified`, `None` if the response has neither """
+    etag = headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return headers.get('Last-Modified')
+
+
+def part_validator_path(part: str) -> str:
+    return part + '.json'
+
+
+def save_part_validator(part: str, headers):
+    """ Record the validator of the response a new `.part` is written from """
+    validator = if_range_validator(headers)
+    if validator is None: # cannot be resumed
+        if os.path.exists(part_validator_path(part)):
+            os.remove(part_validator_path(part))
+        return
+    with uopen(part_validator_path(part), 'w') as f:
+        json.dump({'if_range': validator}, f)
+
+
+def resume_point(part: str) -> Tuple[int, Optional[str]]:
+    """ `(offset, validator)` to resume `part` from, `(0, None)` to start over.
+    A `.part` without a validator is not resumed: we couldn't tell if the file changed on the server. """
+    if not os.path.exists(part):
+        return 0, None
+    try:
+        with uopen(part_validator_path(part), 'r') as f:
+            validator = json.load(f).get('if_range')
+    except (OSError, ValueError):
+        validator = None
+    if not validator:
+        return 0, None
+    return os.path.getsize(part), validator
+
+
+def discard_part(part: str):
+    for path in (part, part_validator_path(part)):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def resume_offset(status: int, headers, offset: int) -> int:
+    """ Where the response body starts in the file: `offset` if the server honored our `Range`, otherwise 0 """
+    if not offset or status != 206:
+        return 0
+    m = CONTENT_RANGE_RE.match(headers.get('Content-Range', ''))
+    if m is None or m.group(1) is None or int(m.group(1)) != offset:
+        raise ValueError('Unexpected Content-Range: %s' % headers.get('Content-Range'))
+    return offset
+
+
+def expected_size(status: int, headers, start: int) -> Optional[int]:
+    """ Size of the complete file, `None` if the server doesn't tell """
+    if status == 206:
+        m = CONTENT_RANGE_RE.match(headers.get('Content-Range', ''))
+        if m and m.group(2) != '*':
+            return int(m.group(2))
+    if headers.get('Content-Encoding', 'identity') != 'identity':
+        return None # Content-Length is the compressed size
+    if 'Content-Length' in headers:
+        return start + int(headers['Content-Length'])
+    return None
+
+
+def unsatisfiable_range_size(headers) -> Optional[int]:
+    """ 416: `Content-Range: bytes */<size>` """
+    m = CONTENT_RANGE_RE.match(headers.get('Content-Range', ''))
+    if m and m.group(1) is None and m.group(2) != '*':
+        return int(m.group(2))
+    return None
+
+
+def finish_part(part: str, file: str, url: str, expected: Optional[int], last_modified: Optional[str],
+                hasher: Optional[StreamHasher] = None, blobs: Optional[BlobStore] = None,
+                manifest: Optional[AttachManifest] = None, key: str = '') -> bool:
+    """ Move a complete `.part` file into place (into the blob store with `blobs`) and record it in `manifest`.
+    `hasher` has seen every byte of `part`, the file is only read again without it.
+    Returns `False` if it turned out to be a duplicate of a stored blob. """
+    size = os.path.getsize(part)
+    if expected is not None and size != expected:
+        raise IncompleteDownload(url, size, expected) # keep the .part, next run resumes it
+    if hasher is None and (blobs is not None or manifest is not None):
+        hasher = hash_file(part)
+    new = True
+    if blobs is None:
+        os.replace(part, file)
+    else:
+        new = blobs.add(part, file, hasher.sha1, last_modified)
+    if os.path.exists(part_validator_path(part)):
+        os.remove(part_validator_path(part))
+    if blobs is None:
+        # not on a blob: it is hardlinked to every file with the same content,
+        # their Last-Modified is in the blob index
+        set_mtime(file, last_modified)
+    if manifest is not None:
+        manifest.record(key, file, hasher.size, hasher.sha1, hasher.sha256, last_modified)
+    return new
+
+
+def link_blob(sha1: str, file: str, last_modified: Optional[str], blobs: BlobStore,
+              manifest: Optional[AttachManifest] = None, key: str = ''):
+    """ `file` has the same content as a stored blob, link it instead of downloading """
+    blobs.link(sha1, file, last_modified)
+    if manifest is not None:
+        known = manifest.by_sha1(sha1)
+        if known is None: # blob from before the manifest
+            hasher = hash_file(file)
+            known = {'size': hasher.size, 'sha256': hasher.sha256}
+        manifest.record(key, file, known['size'], sha1, known['sha256'], last_modified)
+
+
+def open_part(part: str, start: int):
+    """ `(file, hasher)` to write the body to, the hasher has seen the first `start` bytes already """
+    hasher = StreamHasher()
+    if start:
+        hasher.update_from_file(part)
+    return open(part, 'ab' if start else 'wb'), hasher
+
+
+READ, RETRY, DONE = 'read', 'retry', 'done'
+
+
+class AttachDownload:
+    """ The steps of `download_attach()` either engine shares, around its own request and body reads.
+
+    The body goes to `<file>.part` first and is renamed once complete. An interrupted
+    download is resumed with a `Range` request, guarded by `If-Range` with the validator
+    (`ETag` or `Last-Modified`) the `.part` was started from, in `<file>.part.json`.
+    Size and digests are computed while streaming and go to `manifest`.
+    With `blobs`, a file whose size and `Last-Modified` match a blob we already have is not downloaded.
+    """
+
+    def __init__(self, attach: Dict[str, str], base_url: str, dumpDir: str, blobs: Optional[BlobStore] = None,
+                 manifest: Optional[AttachManifest] = None, prefix: Tuple[str, ...] = ()):
+        self.attach = attach
+        self.base_url = base_url
+        self.blobs = blobs
+        self.manifest = manifest
+        self.prefix = prefix # printed before each message, the thread name for threads
+        self.file = attach_filepath(dumpDir, attach)
+        self.url = attach_url(base_url, attach)
+        self.key = attach_key(attach)
+        self.part = self.file + PART_SUFFIX
+        self.offset = 0 # what we asked for
+        self.start = 0 # where the response body starts
+        self.headers = None
+        self.last_modified: Optional[str] = None
+        self.expected: Optional[int] = None
+
+    def exists(self) -> bool:
+        if os.path.exists(self.file):
+            log.debug(*self.prefix, 'File [[%s]] Exists' % self.attach)
+            return True
+        return False
+
+    def request_headers(self) -> Dict[str, str]:
+        """ Headers of the next request, resuming the `.part` if it can be """
+        self.offset, validator = resume_point(self.part)
+        return attach_request_headers(self.base_url, self.offset, validator)
+
+    def begin(self, r: requests.Response) -> str:
+        """ Handle the status and headers of the response: `READ` its body into `body()`,
+        `RETRY` the request (the `.part` was dropped, release the slots first) or `DONE` """
+        last_modified = r.headers.get('Last-Modified', None)
+        if self.offset and r.status_code == 416:
+            if unsatisfiable_range_size(r.headers) == self.offset: # the .part was complete already
+                finish_part(self.part, self.file, self.url, self.offset, last_modified, None,
+                            self.blobs, self.manifest, self.key)
+                return DONE
+            print(*self.prefix, 'File [[%s]] changed on the server, downloading it again' % self.attach)
+            discard_part(self.part)
+            return RETRY
+
+        check_attach_response(self.base_url, r)
+        self.start = resume_offset(r.status_code, r.headers, self.offset)
+        if self.offset:
+            print(*self.prefix, 'File [[%s]] ' % self.attach + (
+                'resuming at %d bytes' % self.start if self.start else 'cannot be resumed, starting over'))
+        self.headers = r.headers
+        self.last_modified = last_modified
+        self.expected = expected_size(r.status_code, r.headers, self.start)
+        known = self.blobs.find(self.expected, last_modified) if self.blobs is not None and not self.start else None
+        if known:
+            link_blob(known, self.file, last_modified, self.blobs, self.manifest, self.key)
+            discard_part(self.part) # from before the file changed on the server
+            print(*self.prefix, 'File [[%s]] same size and Last-Modified as blob %s, not downloaded' % (self.attach, known))
+            return DONE
+        return READ
+
+    @contextlib.contextmanager
+    def body(self):
+        """ Yield a `write(chunk)` for the body, the file is finished once the block exits """
+        f, hasher = open_part(self.part, self.start)
+        with f:
+            if not self.start: # truncated, describe what it is written from
+                save_part_validator(self.part, self.headers)
+
+            def write(chunk: bytes):
+                log.received(len(chunk))
+                f.write(chunk)
+                hasher.update(chunk)
+
+            yield write
+        new = finish_part(self.part, self.file, self.url, self.expected, self.last_modified, hasher,
+                          self.blobs, self.manifest, self.key)
+        log.debug(*self.prefix, 'File [[%s]] Done' % self.attach + ('' if new else ' (duplicate, hardlinked)'))
+
+
+def download_attach(attach: Dict[str, str], base_url: str, dumpDir: str, session: requests.Session,
+                    blobs: Optional[BlobStore] = None, host_limits: Optional[HostLimits] = None,
+                    manifest: Optional[AttachManifest] = None):
+    """ Download an attachment to `dumpDir/attach/`, see `AttachDownload`.
+    With `host_limits`, the host's connection slot is held until the body is read.
+    """
+    download = AttachDownload(attach, base_url, dumpDir, blobs, manifest, prefix=(threading.current_thread().name,))
+    if download.exists():
+        return
+
+    while True:
+        headers = download.request_headers()
+        with host_limits.slot(download.url) if host_limits is not None else contextlib.nullcontext(), \
+             session.get(download.url, stream=True, headers=headers) as r:
+            step = download.begin(r)
+            if step == READ:
+                with download.body() as write:
+                    for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                        write(chunk)
+        if step != RETRY: # retried with the slot released
+            return
+
+
+async def download_attach_async(engine: AsyncEngine, attach: Dict[str, str], base_url: str, dumpDir: str,
+                                blobs: Optional[BlobStore] = None, manifest: Optional[AttachManifest] = None):
+    """ `download_attach()` for `--engine async` """
+    download = AttachDownload(attach, base_url, dumpDir, blobs, manifest)
+    if download.exists():
+        return
+
+    while True:
+        async with engine.stream(download.url, headers=download.request_headers()) as resp:
+            step = download.begin(engine.to_requests_response(resp))
+            if step == READ:
+                with download.body() as write:
+                    async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                        write(chunk)
+        if step != RETRY: # retried with the host slot released, it is not re-entrant
+            return
@@ -50,9 +50,33 @@ class ActionEditTextareaNotFound(Exception):
     def __str__(self):
         return "Action: edit: textarea not found for [[%s]]" % self.title
 
+class BackupSourceNotFound(Exception):
+    def __init__(self, title, age):
+        self.title = title
+        self.age = age
+
+    def __str__(self):
+        return "Action: backup: source of age %s not found for [[%s]]" % (self.age, self.title)
+
 class ActionExportHtmlDisabled(Exception):
     def __init__(self, title):
         self.title = title
 
     def __str__(self):
-        return "Action: export_xhtml is disabled for [[%s]]" % self.title
\ No newline at end of file
+        return "Action: export_xhtml is disabled for [[%s]]" % self.title
+
+class ResponseNotCached(Exception):
+    def __init__(self, url):
+        self.url = url
+
+    def __str__(self):
+        return "Not in the response cache (--replay), URL: %s" % self.url
+
+class IncompleteDownload(Exception):
+    def __init__(self, url, size, expected):
+        self.url = url
+        self.size = size
+        self.expected = expected
+
+    def __str__(self):
+        return "Incomplete download: got %s of %s bytes, URL: %s" % (self.size, self.expected, self.url)
@@ -0,0 +1,36 @@
+""" Benchmark: trim_PHP_warnings() (str and bytes) vs. the line-by-line implementation it replaced,
+    on saved pages with PHP warnings before them, and on a large page.
+
+    python -m pukiWikiDumper.tests.bench_php_warnings [rounds]
+"""
+import sys
+import time
+
+from pukiWikiDumper.tests.test_php_warnings import SAMPLES, WARNINGS, legacy_trim_PHP_warnings
+from pukiWikiDumper.utils.util import trim_PHP_warnings, trim_PHP_warnings_bytes
+
+
+def timeit(fn, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds
+
+
+def main(rounds: int = 50):
+    large = WARNINGS[0] + '<!DOCTYPE html>\n<html><body><pre id="source">\n' + '本文 line & <tag>\n' * 200000 + '</pre></body></html>\n'
+    samples = [(name, text) for name, text in SAMPLES if 'warnings 0' in name and 'CRLF' not in name]
+    samples.append(('large page (200k lines) + warnings', large))
+
+    print('%-55s %12s %12s %12s' % ('sample', 'legacy (ms)', 'str (ms)', 'bytes (ms)'))
+    for name, text in samples:
+        content = text.encode('utf-8')
+        assert trim_PHP_warnings(text, log=None) == legacy_trim_PHP_warnings(text)
+        legacy_ms = timeit(lambda: legacy_trim_PHP_warnings(text), rounds) * 1000
+        str_ms = timeit(lambda: trim_PHP_warnings(text, log=None), rounds) * 1000
+        bytes_ms = timeit(lambda: trim_PHP_warnings_bytes(content, log=None), rounds) * 1000
+        print('%-55s %12.3f %12.3f %12.3f' % (name, legacy_ms, str_ms, bytes_ms))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
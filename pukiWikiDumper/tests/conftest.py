@@ -0,0 +1,40 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Type
+
+import pytest
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """ Base of the stub servers of the tests: keep-alive, quiet, `send()` a whole response.
+    Subclasses implement `do_GET()`. """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, status: int, body: bytes = b'', headers: Optional[dict] = None):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture(scope='module')
+def serve():
+    """ `serve(handler, path='/')` starts a server on localhost and returns its URL + `path`.
+    The servers are shut down at the end of the module. """
+    servers = []
+
+    def start(handler: Type[BaseHTTPRequestHandler], path: str = '/') -> str:
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return 'http://127.0.0.1:%d%s' % (server.server_address[1], path)
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
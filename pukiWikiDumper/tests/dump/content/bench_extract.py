@@ -0,0 +1,71 @@
+""" Benchmark: fast source extraction vs. BeautifulSoup, on saved pages.
+
+    python -m pukiWikiDumper.tests.dump.content.bench_extract [rounds]
+"""
+import sys
+import time
+from pathlib import Path
+
+import requests
+from bs4 import BeautifulSoup, FeatureNotFound
+
+from pukiWikiDumper.dump.content import revisions
+from pukiWikiDumper.dump.content.extract import extract_source
+from pukiWikiDumper.utils.config import running_config
+
+PY_FILE_DIR = Path(__file__).parent
+PARSERS = {
+    'source': revisions.parse_source_source,
+    'edit': revisions.parse_source_edit,
+    'diff': revisions.parse_source_diff,
+}
+
+
+def bs4_only(cmd: str, content: bytes) -> str:
+    r = requests.Response()
+    r.status_code = 200
+    r._content = content
+    r.encoding = None
+    fast_path = revisions.extract_source
+    revisions.extract_source = lambda *args: None
+    try:
+        return PARSERS[cmd](r, {'title': 'FrontPage'})
+    finally:
+        revisions.extract_source = fast_path
+
+
+def timeit(fn, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds
+
+
+def main(rounds: int = 50):
+    html_parsers = ['html.parser']
+    for parser in ['lxml', 'html5lib']:
+        try:
+            BeautifulSoup('', parser)
+            html_parsers.append(parser)
+        except FeatureNotFound:
+            pass
+
+    print('%-45s %12s %s' % ('page', 'fast (ms)', '  '.join('%12s' % p for p in html_parsers)))
+    for path in sorted(PY_FILE_DIR.glob('*.html')):
+        cmd = path.name.split('.')[0]
+        content = path.read_bytes()
+        fast = extract_source(content, cmd)
+
+        results = []
+        for parser in html_parsers:
+            running_config.html_parser = parser
+            assert bs4_only(cmd, content) == fast, (path.name, parser)
+            results.append(timeit(lambda: bs4_only(cmd, content), rounds) * 1000)
+        running_config.html_parser = 'html.parser'
+
+        fast_ms = timeit(lambda: extract_source(content, cmd), rounds) * 1000
+        print('%-45s %12.3f %s' % (path.name, fast_ms, '  '.join('%12.3f' % ms for ms in results)))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
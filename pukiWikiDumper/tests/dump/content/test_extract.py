@@ -0,0 +1,57 @@
+from pathlib import Path
+
+import pytest
+import requests
+
+from pukiWikiDumper.dump.content import revisions
+from pukiWikiDumper.dump.content.extract import extract_source, resolve_encoding
+
+PY_FILE_DIR = Path(__file__).parent
+PAGES = sorted(PY_FILE_DIR.glob('*.html'))
+PARSERS = {
+    'source': revisions.parse_source_source,
+    'edit': revisions.parse_source_edit,
+    'diff': revisions.parse_source_diff,
+}
+
+
+def make_response(content: bytes, encoding=None) -> requests.Response:
+    r = requests.Response()
+    r.status_code = 200
+    r._content = content
+    r.encoding = encoding
+    return r
+
+
+def parse_with_bs4(cmd: str, content: bytes, monkeypatch) -> str:
+    with monkeypatch.context() as m:
+        m.setattr(revisions, 'extract_source', lambda *args: None)
+        return PARSERS[cmd](make_response(content), {'title': 'FrontPage'})
+
+
+@pytest.mark.parametrize('path', PAGES, ids=lambda p: p.name)
+def test_fast_path_matches_bs4(path: Path, monkeypatch):
+    cmd = path.name.split('.')[0]
+    content = path.read_bytes()
+
+    fast = extract_source(content, cmd)
+    assert fast is not None, 'known-good page should not need BeautifulSoup'
+    assert fast == parse_with_bs4(cmd, content, monkeypatch)
+
+
+@pytest.mark.parametrize('content', [
+    b'<html><body><pre id="source">a <b>bold</b></pre></body></html>', # markup inside
+    b'<html><body><!-- <pre id="source">old</pre> --><pre id="source">new</pre></body></html>', # in comment
+    b'<html><body><pre id="source">a</pre><pre id="source">b</pre></body></html>', # ambiguous
+    b'<html><body><pre id="source">\xff\xfe</pre></body></html>', # not utf-8
+])
+def test_fast_path_unsure(content: bytes):
+    assert extract_source(content, 'source') is None
+
+
+def test_resolve_encoding():
+    assert resolve_encoding(b'<meta charset="EUC-JP">') == 'euc_jisx0213'
+    assert resolve_encoding(b'<html>', 'EUC-JP') == 'euc_jisx0213'
+    assert resolve_encoding(b'<html>', 'ISO-8859-1') == 'utf-8'
+    assert resolve_encoding(b'<meta charset="utf-8">', 'Shift_JIS') is None # disagree
+    assert resolve_encoding(b'<meta charset="utf-16">') is None
@@ -0,0 +1,57 @@
+import requests
+
+from pukiWikiDumper.dump.content.history import (apply_delta, load_history, make_delta,
+                                                 parse_backup_list, parse_backup_source, save_history)
+
+BACKUP_LIST = '''<html><head><meta charset="utf-8"></head><body><div id="body">
+<ul>
+ <li><a href="./?cmd=list">バックアップ一覧</a>
+  <ul>
+   <li><a href="./?cmd=backup&amp;page=FrontPage&amp;age=1">1 2005-06-11 (土) 14:12:34</a>
+     [ <a href="./?cmd=backup&amp;page=FrontPage&amp;age=1&amp;action=diff">差分</a>
+     | <a href="./?cmd=backup&amp;page=FrontPage&amp;age=1&amp;action=source">ソース</a> ]
+   </li>
+   <li><a href="./?cmd=backup&amp;page=FrontPage&amp;age=2">2 2006-01-02 (月) 03:04:05</a>
+     [ <a href="./?cmd=backup&amp;page=FrontPage&amp;age=2&amp;action=source">ソース</a> ]
+   </li>
+  </ul>
+ </li>
+</ul>
+<pre>not a source</pre>
+</div></body></html>'''
+
+
+def make_response(body: str) -> requests.Response:
+    r = requests.Response()
+    r._content = body.encode('utf-8')
+    r.encoding = 'utf-8'
+    r.status_code = 200
+    return r
+
+
+def test_delta_round_trip():
+    revisions = ['a\nb\nc\n', 'a\nB\nc\nd', '', 'x\r\ny\n', 'a\nb\nc\n']
+    for base in revisions:
+        for text in revisions:
+            assert apply_delta(base, make_delta(base, text)) == text
+
+
+def test_save_and_load_history(tmp_path):
+    revisions = [{'age': age, 'time': None, 'text': 'common\n' * 100 + 'rev %d\n' % age} for age in range(1, 21)]
+    save_history(str(tmp_path), 'ページ', revisions)
+
+    loaded = load_history(str(tmp_path), 'ページ')
+    assert [rev['age'] for rev in loaded] == list(range(20, 0, -1))
+    assert loaded == sorted(revisions, key=lambda rev: rev['age'], reverse=True)
+    # only the newest one is a full copy
+    assert sum(f.stat().st_size for f in (tmp_path / 'history').iterdir()) < 2 * len(revisions[0]['text']) + 20 * 100
+
+
+def test_parse_backup_list_and_source():
+    page = {'title': 'FrontPage', 'url_encoding': 'utf-8'}
+    assert parse_backup_list(make_response(BACKUP_LIST), page) == [
+        {'age': 1, 'time': '2005-06-11 (土) 14:12:34'},
+        {'age': 2, 'time': '2006-01-02 (月) 03:04:05'},
+    ]
+    source = '<ul><li>nav</li></ul><pre>*見出し\n&lt;b&gt; &amp;br;\n</pre>'
+    assert parse_backup_source(make_response(source), page, 1) == '*見出し\n<b> &br;'
@@ -0,0 +1,66 @@
+import os
+import time
+
+from pukiWikiDumper.dump.content.history import history_filepath, load_history, save_history
+from pukiWikiDumper.dump.content.incremental import (carry_over_history, find_changed_pages, previous_dump_time,
+                                                     record_enumeration_start)
+from pukiWikiDumper.dump.content.titles import parse_passage
+
+
+def test_parse_passage():
+    assert parse_passage('FrontPage (29m)') == 29 * 60
+    assert parse_passage('FrontPage (5h) ') == 5 * 60 * 60
+    assert parse_passage('FrontPage (3602d)') == 3602 * 24 * 60 * 60
+    assert parse_passage('Page (1d) suffix') is None
+    assert parse_passage('FrontPage') is None
+
+
+def test_find_changed_pages_by_passage():
+    since = time.time() - 2 * 24 * 60 * 60
+    pages = [
+        {'title': 'Old', 'passage': 400 * 24 * 60 * 60},
+        {'title': 'Edited', 'passage': 5 * 60},
+        {'title': 'New', 'passage': 400 * 24 * 60 * 60},
+    ]
+    assert find_changed_pages(pages, {'Old', 'Edited'}, since) == {'Edited', 'New'}
+
+
+def test_find_changed_pages_by_recent_changes():
+    since = time.time() - 10 * 24 * 60 * 60
+    pages = [{'title': t, 'passage': None} for t in ('A', 'B', 'C')]
+    recent_changes = [('B', int(time.time())), ('A', int(since) - 30 * 24 * 60 * 60)]
+    assert find_changed_pages(pages, {'A', 'B', 'C'}, since, recent_changes) == {'B'}
+
+    # RecentChanges is too short to cover the gap
+    assert find_changed_pages(pages, {'A', 'B', 'C'}, since, recent_changes[:1]) is None
+    assert find_changed_pages(pages, {'A', 'B', 'C'}, since) is None
+
+
+def test_carry_over_history(tmp_path):
+    prev, new = str(tmp_path / 'prev'), str(tmp_path / 'new')
+    revisions = [{'age': 1, 'time': '2005-06-11 (土) 14:12:34', 'text': 'a\n'}]
+    for title in ('Old', 'Edited'):
+        save_history(prev, title, revisions)
+    pages = [{'title': t} for t in ('Old', 'Edited', 'New', 'NoBackups')]
+
+    assert carry_over_history(prev, new, pages, {'Edited', 'New'}) == 1
+    assert load_history(new, 'Old') == revisions
+    assert not os.path.exists(history_filepath(new, 'Edited'))
+    assert carry_over_history(prev, new, pages, {'Edited', 'New'}) == 0 # already there
+
+
+def test_previous_dump_time_is_when_enumeration_started(tmp_path):
+    dumpDir = str(tmp_path)
+    os.makedirs(os.path.join(dumpDir, 'dumpMeta'))
+    pagesFilePath = os.path.join(dumpDir, 'dumpMeta', 'pages.jsonl')
+    with open(pagesFilePath, 'w') as f:
+        f.write('{"title": "FrontPage"}\n')
+    long_ago = time.time() - 6 * 60 * 60
+    os.utime(pagesFilePath, (long_ago, long_ago))
+    assert previous_dump_time(dumpDir) == long_ago # dumps from before the config key
+
+    before = time.time()
+    record_enumeration_start(dumpDir)
+    # pages.jsonl is written (and renamed into place) once the crawl consumed it, hours later
+    os.utime(pagesFilePath, (before + 6 * 60 * 60, before + 6 * 60 * 60))
+    assert before <= previous_dump_time(dumpDir) <= time.time()
@@ -0,0 +1,34 @@
+import os
+
+from pukiWikiDumper.dump.content.storage import PACK_DIR, PACK_INDEX, PackedPageStore, page_filepath, unpack
+
+PAGES = {
+    'FrontPage': '*Heading\nbody\n',
+    '日本語/ページ': '日本語の本文',
+    'L' * 200: 'long title',
+}
+
+
+def test_packed_store_roundtrip_and_unpack(tmp_path):
+    dumpDir = str(tmp_path)
+    with PackedPageStore(dumpDir, segment_size=16) as store:
+        for title, source in PAGES.items():
+            store.save(title, source)
+    segments = [name for name in os.listdir(tmp_path / PACK_DIR) if name.startswith('segment-')]
+    assert len(segments) == 2 # rolled over
+
+    # a torn index line from a crash is skipped, and doesn't break the next entry
+    with open(tmp_path / PACK_DIR / PACK_INDEX, 'a', encoding='utf-8') as f:
+        f.write('{"title": "Torn", "segm')
+    with PackedPageStore(dumpDir) as store:
+        assert all(store.exists(title) for title in PAGES)
+        assert not store.exists('Torn')
+        store.save('FrontPage', 'updated')
+    with PackedPageStore(dumpDir) as store:
+        assert store.read('FrontPage') == 'updated'
+        assert store.read('日本語/ページ') == PAGES['日本語/ページ']
+
+    assert unpack(dumpDir) == len(PAGES)
+    for title, source in {**PAGES, 'FrontPage': 'updated'}.items():
+        with open(page_filepath(dumpDir, title), encoding='utf-8') as f:
+            assert f.read() == source
@@ -0,0 +1,51 @@
+import threading
+
+from pukiWikiDumper.dump.content import strategy as strategy_module
+from pukiWikiDumper.dump.content.strategy import SourceStrategy
+from pukiWikiDumper.utils.config import get_config
+
+
+def test_strategy_prefers_working_action_and_skips_dead_ones(tmp_path):
+    (tmp_path / 'dumpMeta').mkdir()
+    strategy = SourceStrategy(str(tmp_path))
+    assert strategy.actions() == ['source', 'edit', 'diff']
+
+    for _ in range(strategy_module.DEAD_ACTION_FAILURES):
+        strategy.record('source', success=False)
+        strategy.record('edit', success=True)
+
+    assert strategy.actions() == ['edit', 'diff']
+    assert get_config(str(tmp_path))['source_action'] == 'edit'
+
+    # resumed run starts with the saved action
+    assert SourceStrategy(str(tmp_path)).actions()[0] == 'edit'
+
+
+def test_strategy_reprobes_dead_actions():
+    strategy = SourceStrategy()
+    for _ in range(strategy_module.DEAD_ACTION_FAILURES):
+        strategy.record('source', success=False)
+
+    orders = [strategy.actions() for _ in range(strategy_module.REPROBE_INTERVAL)]
+    assert sum('source' in order for order in orders) == 1
+
+
+def test_strategy_saves_only_when_the_best_action_changes(tmp_path, monkeypatch):
+    (tmp_path / 'dumpMeta').mkdir()
+    strategy = SourceStrategy(str(tmp_path))
+    saves = []
+
+    def update_config(dumpDir, config, verbose=True):
+        # not called with the lock held: workers don't wait on the disk
+        assert strategy._lock.acquire(timeout=1)
+        strategy._lock.release()
+        saves.append(config)
+    monkeypatch.setattr(strategy_module, 'update_config', update_config)
+
+    threads = [threading.Thread(target=lambda: [strategy.record('edit', success=True) for _ in range(100)])
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert saves == [{'source_action': 'edit'}]
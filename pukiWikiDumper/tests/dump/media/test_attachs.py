@@ -0,0 +1,108 @@
+import json
+import os
+
+import pytest
+
+from pukiWikiDumper.dump.media import media
+from pukiWikiDumper.dump.media.media import (ATTACH_NAMESPACES_CHECKPOINT, expected_size, iter_attachs, iter_namespaces,
+                                             parse_attach_title, resume_offset, sort_attachs,
+                                             unsatisfiable_range_size)
+
+# ns: (attaches, namespaces)
+LISTS = {
+    'A': ([{'refer': 'A', 'file': 'a.png', 'age': None, 'url_encoding': 'utf-8'}], [('A/1', 'utf-8'), ('B', 'utf-8')]),
+    'A/1': ([{'refer': 'A/1', 'file': 'x.txt', 'age': 2, 'url_encoding': 'utf-8'}], [('A', 'utf-8')]),
+    'B': ([{'refer': 'A', 'file': 'a.png', 'age': None, 'url_encoding': 'utf-8'}], []),
+    'C': None, # OOM
+}
+
+
+def fake_list_attachs(listed: list, fail: str = ''):
+    def list_attachs(base_url, ns, ns_encoding, session):
+        if ns == fail:
+            raise RuntimeError('boom')
+        listed.append(ns)
+        return LISTS[ns]
+    return list_attachs
+
+
+def test_iter_namespaces(tmp_path, monkeypatch):
+    listed = []
+    monkeypatch.setattr(media, 'list_attachs', fake_list_attachs(listed))
+    found = list(iter_namespaces('http://x/', [('A', 'utf-8'), ('C', 'utf-8')], dumpDir=str(tmp_path), threads=3))
+
+    assert sorted(listed) == ['A', 'A/1', 'B', 'C']
+    assert sorted(ns for ns, _ in found) == ['A', 'A/1', 'B', 'C']
+    # completion order, duplicates are left to iter_attachs()
+    attaches = [(a['refer'], a['file']) for _, atts in found for a in atts]
+    assert sorted(attaches) == [('A', 'a.png'), ('A', 'a.png'), ('A/1', 'x.txt')]
+
+
+def test_iter_attachs_saves_as_it_goes(tmp_path, monkeypatch):
+    listed = []
+    monkeypatch.setattr(media, 'list_attachs', fake_list_attachs(listed))
+    attaches = iter_attachs('http://x/', ns='A', dumpDir=str(tmp_path), threads=2)
+    first = next(attaches)
+    assert first['file'] == 'a.png'
+    assert listed == ['A'] # the linked namespaces are not listed yet
+    assert not os.path.exists(tmp_path / 'dumpMeta' / 'attachs.jsonl')
+
+    rest = list(attaches)
+    assert sorted(a['file'] for a in rest) == ['x.txt'] # no duplicates
+    with open(tmp_path / 'dumpMeta' / 'attachs.jsonl') as f:
+        assert [json.loads(line)['file'] for line in f] == ['a.png', 'x.txt']
+    assert not os.path.exists(tmp_path / ATTACH_NAMESPACES_CHECKPOINT)
+
+
+def test_iter_namespaces_resumes_from_checkpoint(tmp_path, monkeypatch):
+    os.makedirs(tmp_path / 'dumpMeta')
+    listed = []
+    monkeypatch.setattr(media, 'list_attachs', fake_list_attachs(listed, fail='B'))
+    with pytest.raises(RuntimeError):
+        list(iter_namespaces('http://x/', [('A', 'utf-8')], dumpDir=str(tmp_path), threads=1))
+    assert listed == ['A', 'A/1']
+
+    with open(tmp_path / ATTACH_NAMESPACES_CHECKPOINT, 'a') as f:
+        f.write('{"ns": "torn') # crashed mid-write
+
+    listed.clear()
+    monkeypatch.setattr(media, 'list_attachs', fake_list_attachs(listed))
+    found = list(iter_namespaces('http://x/', [('A', 'utf-8')], dumpDir=str(tmp_path), threads=1))
+    assert listed == ['B']
+    assert [ns for ns, _ in found] == ['A', 'A/1', 'B'] # checkpointed ones first
+    assert sum(len(atts) for _, atts in found) == 3
+
+    with open(tmp_path / ATTACH_NAMESPACES_CHECKPOINT) as f:
+        checkpointed = [json.loads(line)['ns'] for line in f if line.startswith('{"ns": "') and line.endswith('}\n')]
+    assert sorted(checkpointed) == ['A', 'A/1', 'B']
+
+
+def test_resume_offset():
+    assert resume_offset(206, {'Content-Range': 'bytes 100-199/200'}, 100) == 100
+    assert resume_offset(200, {'Content-Length': '200'}, 100) == 0 # Range ignored, start over
+    assert resume_offset(200, {}, 0) == 0
+    with pytest.raises(ValueError):
+        resume_offset(206, {'Content-Range': 'bytes 0-199/200'}, 100)
+
+
+def test_expected_size():
+    assert expected_size(206, {'Content-Range': 'bytes 100-199/200', 'Content-Length': '100'}, 100) == 200
+    assert expected_size(200, {'Content-Length': '200'}, 0) == 200
+    assert expected_size(200, {'Content-Length': '80', 'Content-Encoding': 'gzip'}, 0) is None
+    assert expected_size(200, {}, 0) is None
+    assert unsatisfiable_range_size({'Content-Range': 'bytes */200'}) == 200
+    assert unsatisfiable_range_size({}) is None
+
+
+def test_parse_attach_title():
+    assert parse_attach_title('2002/07/23 17:39:29 13.0KB') == ('2002/07/23 17:39:29', 13312)
+    assert parse_attach_title('2010/01/02 03:04:05 1.5MB') == ('2010/01/02 03:04:05', 1572864)
+    assert parse_attach_title('添付ファイルの情報') == (None, None)
+    assert parse_attach_title(None) == (None, None)
+
+
+def test_sort_attachs():
+    attaches = [{'file': 'a', 'size': 10}, {'file': 'b', 'size': None}, {'file': 'c', 'size': 30}, {'file': 'd'}]
+    assert [a['file'] for a in sort_attachs(attaches)] == ['a', 'b', 'c', 'd']
+    assert [a['file'] for a in sort_attachs(attaches, 'largest')] == ['c', 'a', 'b', 'd']
+    assert [a['file'] for a in sort_attachs(attaches, 'smallest')] == ['a', 'c', 'b', 'd']
@@ -0,0 +1,50 @@
+import os
+
+from pukiWikiDumper.dump.media.blobs import BlobStore, relink
+from pukiWikiDumper.dump.media.manifest import hash_file
+from pukiWikiDumper.dump.media.media import finish_part
+
+
+def write(path, data: bytes):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def test_blob_store(tmp_path):
+    dumpDir = str(tmp_path)
+    os.makedirs(tmp_path / 'attach')
+    last_modified = 'Sun, 09 Sep 2001 01:46:40 GMT'
+
+    with BlobStore(dumpDir) as store:
+        for name in ('A', 'B'):
+            write(tmp_path / 'part', b'same')
+            new = store.add(str(tmp_path / 'part'), str(tmp_path / 'attach' / name), hash_file(str(tmp_path / 'part')).sha1, last_modified)
+            assert new == (name == 'A')
+        assert not os.path.exists(tmp_path / 'part')
+        assert os.path.samefile(tmp_path / 'attach' / 'A', tmp_path / 'attach' / 'B')
+
+        sha1 = store.find(4, last_modified)
+        assert sha1 == hash_file(str(tmp_path / 'attach' / 'A')).sha1
+        assert store.find(5, last_modified) is None
+        assert store.find(4, None) is None
+        store.link(sha1, str(tmp_path / 'attach' / 'C'), last_modified)
+
+    os.remove(tmp_path / 'attach' / 'B')
+    with BlobStore(dumpDir) as store: # reloads the index
+        assert sorted(store.index) == ['attach/A', 'attach/B', 'attach/C']
+    relink(dumpDir)
+    assert (tmp_path / 'attach' / 'B').read_bytes() == b'same'
+
+
+def test_finish_part_leaves_blob_mtime(tmp_path):
+    os.makedirs(tmp_path / 'attach')
+    with BlobStore(str(tmp_path)) as store:
+        write(tmp_path / 'part', b'same')
+        finish_part(str(tmp_path / 'part'), str(tmp_path / 'attach' / 'A'), 'http://x/A', 4,
+                    'Sun, 09 Sep 2001 01:46:40 GMT', blobs=store)
+        mtime = os.path.getmtime(tmp_path / 'attach' / 'A')
+        write(tmp_path / 'part', b'same')
+        finish_part(str(tmp_path / 'part'), str(tmp_path / 'attach' / 'B'), 'http://x/B', 4,
+                    'Mon, 01 Jan 1990 00:00:00 GMT', blobs=store) # same content, other Last-Modified
+        assert os.path.getmtime(tmp_path / 'attach' / 'A') == mtime
+        assert store.index['attach/B']['last_modified'] == 'Mon, 01 Jan 1990 00:00:00 GMT'
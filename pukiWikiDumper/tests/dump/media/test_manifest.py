@@ -0,0 +1,34 @@
+import hashlib
+
+from pukiWikiDumper.dump.media.manifest import CHUNK_SIZE, AttachManifest, StreamHasher, hash_file
+
+
+def test_stream_hasher(tmp_path):
+    data = b'0123456789' * (CHUNK_SIZE // 4) # a few chunks and a partial one
+    (tmp_path / 'f').write_bytes(data[:1000])
+
+    hasher = StreamHasher()
+    hasher.update_from_file(str(tmp_path / 'f')) # resumed .part
+    hasher.update(data[1000:])
+    assert hasher.size == len(data)
+    assert hasher.sha1 == hashlib.sha1(data).hexdigest()
+    assert hasher.sha256 == hashlib.sha256(data).hexdigest()
+
+    (tmp_path / 'f').write_bytes(data)
+    assert hash_file(str(tmp_path / 'f')).sha256 == hasher.sha256
+
+
+def test_manifest(tmp_path):
+    with AttachManifest(str(tmp_path)) as manifest:
+        manifest.record('A/a.png', str(tmp_path / 'attach' / 'X'), 3, 'sha1-a', 'sha256-a', None)
+        manifest.record('B/b.png', str(tmp_path / 'attach' / 'Y'), 4, 'sha1-b', 'sha256-b', None)
+    with open(tmp_path / 'dumpMeta' / 'attachs.manifest.jsonl', 'a') as f:
+        f.write('{"key": "C/c') # torn
+
+    with AttachManifest(str(tmp_path)) as manifest:
+        assert sorted(manifest.entries) == ['A/a.png', 'B/b.png']
+        assert manifest.entries['A/a.png']['path'] == 'attach/X'
+        assert manifest.by_sha1('sha1-b')['sha256'] == 'sha256-b'
+        manifest.record('C/c.png', str(tmp_path / 'attach' / 'Z'), 5, 'sha1-c', 'sha256-c', None)
+
+    assert sorted(AttachManifest(str(tmp_path)).entries) == ['A/a.png', 'B/b.png', 'C/c.png']
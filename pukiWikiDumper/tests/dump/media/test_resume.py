@@ -0,0 +1,100 @@
+import asyncio
+import json
+
+import pytest
+import requests
+
+from pukiWikiDumper.dump.media import media
+from pukiWikiDumper.dump.media.media import (PART_SUFFIX, attach_filepath, download_attach, download_attach_async,
+                                             part_validator_path)
+from pukiWikiDumper.tests.conftest import StubHandler
+from pukiWikiDumper.utils.host_limits import HostLimit, HostLimits
+
+CONTENT = bytes(range(256)) * 8
+ETAG = '"v2"'
+ATTACH = {'refer': 'A', 'file': 'f.bin', 'age': None, 'url_encoding': 'utf-8'}
+
+
+class RangeServer(StubHandler):
+    """ Serves CONTENT, honours `Range` only if `If-Range` is the current ETag """
+    requests = []
+
+    def send(self, status: int, body: bytes = b'', headers: dict = None):
+        self.requests.append((self.headers.get('Range'), self.headers.get('If-Range'), status))
+        super().send(status, body, {'ETag': ETAG, 'Content-Disposition': 'inline; filename="f.bin"', **(headers or {})})
+
+    def do_GET(self):
+        range_ = self.headers.get('Range')
+        if range_ and self.headers.get('If-Range') == ETAG:
+            start = int(range_[len('bytes='):-1])
+            if start >= len(CONTENT):
+                return self.send(416, b'', {'Content-Range': 'bytes */%d' % len(CONTENT)})
+            return self.send(206, CONTENT[start:],
+                             {'Content-Range': 'bytes %d-%d/%d' % (start, len(CONTENT) - 1, len(CONTENT))})
+        return self.send(200, CONTENT, {})
+
+
+@pytest.fixture(scope='module')
+def base_url(serve):
+    return serve(RangeServer)
+
+
+def download(engine: str, base_url: str, dumpDir: str):
+    host_limits = HostLimits(HostLimit(concurrency=1)) # one slot: a retry must not wait on itself
+    if engine == 'threads':
+        download_attach(ATTACH, base_url, dumpDir, requests.Session(), host_limits=host_limits)
+        return
+    pytest.importorskip('aiohttp')
+    from pukiWikiDumper.utils.async_engine import AsyncEngine
+
+    async def main():
+        async with AsyncEngine(requests.Session(), concurrency=1, host_limits=host_limits) as async_engine:
+            await download_attach_async(async_engine, ATTACH, base_url, dumpDir)
+    asyncio.run(asyncio.wait_for(main(), 10))
+
+
+# .part, its If-Range validator: (Range sent, status) of each request
+CASES = {
+    'resumed': (CONTENT[:1000], ETAG, [('bytes=1000-', 206)]),
+    'changed on the server': (b'x' * 1000, '"v1"', [('bytes=1000-', 200)]),
+    'already complete': (CONTENT, ETAG, [('bytes=%d-' % len(CONTENT), 416)]),
+    'longer than the file': (CONTENT + b'x', ETAG, [('bytes=%d-' % (len(CONTENT) + 1), 416), (None, 200)]),
+    'no validator': (b'x' * 1000, None, [(None, 200)]),
+}
+
+
+@pytest.mark.parametrize('engine', ['threads', 'async'])
+@pytest.mark.parametrize('case', list(CASES))
+def test_resume(tmp_path, base_url, engine, case):
+    part_content, validator, expected = CASES[case]
+    (tmp_path / 'attach').mkdir()
+    file = attach_filepath(str(tmp_path), ATTACH)
+    with open(file + PART_SUFFIX, 'wb') as f:
+        f.write(part_content)
+    if validator is not None:
+        with open(part_validator_path(file + PART_SUFFIX), 'w') as f:
+            json.dump({'if_range': validator}, f)
+
+    RangeServer.requests.clear()
+    download(engine, base_url, str(tmp_path))
+
+    assert [(range_, status) for range_, _, status in RangeServer.requests] == expected
+    assert all(if_range == validator for range_, if_range, _ in RangeServer.requests if range_)
+    with open(file, 'rb') as f:
+        assert f.read() == CONTENT
+    assert sorted(p.name for p in (tmp_path / 'attach').iterdir()) == [file.rsplit('/', 1)[1]] # no .part left
+
+
+def test_new_part_records_its_validator(tmp_path, base_url, monkeypatch):
+    (tmp_path / 'attach').mkdir()
+    file = attach_filepath(str(tmp_path), ATTACH)
+    seen = []
+
+    def interrupted(*args):
+        with open(part_validator_path(file + PART_SUFFIX)) as f:
+            seen.append(json.load(f))
+        raise ConnectionError('interrupted')
+    monkeypatch.setattr(media, 'finish_part', interrupted)
+    with pytest.raises(ConnectionError):
+        download('threads', base_url, str(tmp_path))
+    assert seen == [{'if_range': ETAG}]
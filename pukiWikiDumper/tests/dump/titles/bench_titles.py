@@ -0,0 +1,51 @@
+""" Benchmark: cmd=list parsing, fast path vs. BeautifulSoup, on the saved list pages.
+Asserts that both give exactly the pages in the JSON snapshots.
+
+    python -m pukiWikiDumper.tests.dump.titles.bench_titles [rounds]
+"""
+import json
+import sys
+import time
+from pathlib import Path
+
+from pukiWikiDumper.dump.content import titles
+from pukiWikiDumper.dump.content.titles import get_pages
+
+PY_FILE_DIR = Path(__file__).parent
+
+
+def get_pages_bs4(**kwargs):
+    fast_path = titles.scan_list
+    titles.scan_list = lambda *args, **kwargs: None
+    try:
+        return get_pages(**kwargs)
+    finally:
+        titles.scan_list = fast_path
+
+
+def timeit(fn, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds
+
+
+def main(rounds: int = 5):
+    print('%-30s %8s %12s %12s %8s' % ('list', 'pages', 'fast (ms)', 'bs4 (ms)', 'speedup'))
+    for path in sorted(PY_FILE_DIR.glob('cmdlist.*.html')):
+        key = path.name[len('cmdlist.'):-len('.html')]
+        content = path.read_bytes()
+        kwargs = dict(url=f'https://{key.replace("_", "/")}/', debug_content=content)
+        with open(PY_FILE_DIR / f'cmdlist.{key}.json', 'r') as f:
+            expected = json.load(f)
+
+        assert get_pages(**kwargs) == expected, key
+        assert get_pages_bs4(**kwargs) == expected, key
+
+        fast_ms = timeit(lambda: get_pages(**kwargs), rounds) * 1000
+        bs4_ms = timeit(lambda: get_pages_bs4(**kwargs), rounds) * 1000
+        print('%-30s %8d %12.1f %12.1f %7.1fx' % (key, len(expected), fast_ms, bs4_ms, bs4_ms / fast_ms))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -3,7 +3,9 @@ from pathlib import Path
 
 import pytest
 
+from pukiWikiDumper.dump.content import titles
 from pukiWikiDumper.dump.content.content import get_pages
+from pukiWikiDumper.dump.content.listscan import scan_list
 
 PY_FILE_DIR = Path(__file__).parent
 
@@ -38,4 +40,27 @@ def test_get_titles(key, expected):
         for page in pages:
             assert page in expected_pages, f"Page not found: {page}"
 
+
+@pytest.mark.parametrize("key", cmd_list_result.keys())
+def test_scan_list_matches_bs4(key):
+    with open(PY_FILE_DIR / f"cmdlist.{key}.html", "rb") as f:
+        content = f.read()
+    scanned = scan_list(content, exclude_encodings=['ibm866'], with_li_text=True)
+    assert scanned is not None, "fast path gave up"
+    assert scanned == titles.soup_list(content, None, ['ibm866'], with_li_text=True)
+
+    with open(PY_FILE_DIR / f"cmdlist.{key}.json", "r") as f:
+        expected_pages = json.load(f)
+    assert get_pages(url=f'https://{key.replace("_", "/")}/', debug_content=content) == expected_pages
+
+
+@pytest.mark.parametrize("markup", [
+    b'<div id="body"><ul><li><a href="./?A">A</a></li><!-- <li><a href="./?B">B</a></li>',
+    b'<div id="body"><ul><li><a href="./?A">A</a></li><script>document.write("<li>")',
+    b'<div id="body"><ul><li><a href=./?A/></li></ul></div>',
+    b'<div id="body"><ul><li><a title="x" y="1"z>A</a></li></ul></div>',
+])
+def test_scan_list_gives_up_when_unsure(markup):
+    assert scan_list(markup) is None
+
 # test_get_titles("nekokabu.s7.xrea.com_wiki", 328)
\ No newline at end of file
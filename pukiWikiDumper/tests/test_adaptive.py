@@ -0,0 +1,126 @@
+import asyncio
+import threading
+
+import pytest
+import requests
+
+from pukiWikiDumper.tests.conftest import StubHandler
+from pukiWikiDumper.utils.adaptive import AdaptiveConcurrency
+from pukiWikiDumper.utils.patch import SessionMonkeyPatch
+
+
+def busy(adaptive: AdaptiveConcurrency):
+    """ Pretend every slot is in use """
+    adaptive.in_flight = adaptive.limit
+
+
+def test_additive_increase():
+    adaptive = AdaptiveConcurrency(floor=1, ceiling=4, initial=2)
+    for _ in range(2):
+        busy(adaptive)
+        adaptive.record(latency=0.1, status=200)
+    assert adaptive.limit == 3 # one full window
+
+    for _ in range(100):
+        busy(adaptive)
+        adaptive.record(latency=0.1, status=200)
+    assert adaptive.limit == 4 # ceiling
+
+    adaptive = AdaptiveConcurrency(floor=1, ceiling=4, initial=2)
+    for _ in range(10):
+        adaptive.record(latency=0.1, status=200) # nothing in flight: the limit isn't the bottleneck
+    assert adaptive.limit == 2
+
+
+def test_multiplicative_decrease():
+    adaptive = AdaptiveConcurrency(floor=2, ceiling=16, initial=16, cooldown=60)
+    adaptive.record(status=429)
+    assert adaptive.limit == 8
+    adaptive.record(status=503, retry_after=True) # within the cooldown
+    assert adaptive.limit == 8
+
+    adaptive.cooldown = 0
+    adaptive.record(status=200, retry_after=True)
+    assert adaptive.limit == 4
+    adaptive.record(error=ConnectionError())
+    adaptive.record(error=ConnectionError())
+    assert adaptive.limit == 2 # floor
+
+
+def test_rising_latency():
+    adaptive = AdaptiveConcurrency(floor=1, ceiling=16, initial=8, cooldown=0)
+    for _ in range(5):
+        adaptive.record(latency=0.1, status=200)
+    assert adaptive.limit == 8
+    for _ in range(5):
+        adaptive.record(latency=1.0, status=200)
+    assert adaptive.limit < 8
+
+
+def test_limits_in_flight():
+    adaptive = AdaptiveConcurrency(floor=1, ceiling=4, initial=2)
+    peak = 0
+    lock = threading.Lock()
+
+    def worker():
+        nonlocal peak
+        with adaptive.slot():
+            with lock:
+                peak = max(peak, adaptive.in_flight)
+            threading.Event().wait(0.01)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert peak == 2
+    assert adaptive.in_flight == 0
+
+    async def main():
+        async def one():
+            nonlocal peak
+            async with adaptive.slot_async():
+                peak = max(peak, adaptive.in_flight)
+                await asyncio.sleep(0.01)
+        await asyncio.gather(*(one() for _ in range(8)))
+
+    peak = 0
+    asyncio.run(main())
+    assert peak == 2
+    assert adaptive.in_flight == 0
+
+
+def test_bounds():
+    with pytest.raises(ValueError):
+        AdaptiveConcurrency(floor=0, ceiling=4)
+    with pytest.raises(ValueError):
+        AdaptiveConcurrency(floor=5, ceiling=4)
+    assert AdaptiveConcurrency(floor=2, ceiling=4, initial=10).limit == 4
+
+
+class RedirectServer(StubHandler):
+    def do_GET(self):
+        if self.path.startswith('/old'):
+            return self.send(302, headers={'Location': '/new'})
+        self.send(200, b'ok')
+
+
+def test_redirect_reenters_the_slot(serve):
+    url = serve(RedirectServer, '/old')
+
+    adaptive = AdaptiveConcurrency(floor=1, ceiling=1)
+    session = requests.Session()
+    patch = SessionMonkeyPatch(session=session, hard_retries=0, adaptive=adaptive)
+    patch.hijack()
+    try:
+        responses = []
+        # the redirect hop is sent while the first request holds the only slot
+        thread = threading.Thread(target=lambda: responses.append(session.get(url, timeout=5)), daemon=True)
+        thread.start()
+        thread.join(10)
+        assert not thread.is_alive(), 'deadlocked on the redirect'
+        assert responses[0].status_code == 200 and responses[0].history[0].status_code == 302
+        assert adaptive.in_flight == 0
+    finally:
+        patch.release()
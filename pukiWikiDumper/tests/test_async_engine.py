@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+
+pytest.importorskip('aiohttp')
+
+from pukiWikiDumper.dump.content.content import dump_page_async
+from pukiWikiDumper.dump.content.history import dump_page_history_async, load_history
+from pukiWikiDumper.dump.content.storage import DirPageStore, page_filepath
+from pukiWikiDumper.dump.content.strategy import SourceStrategy
+from pukiWikiDumper.tests.conftest import StubHandler
+from pukiWikiDumper.utils.async_engine import AsyncEngine
+from pukiWikiDumper.utils.host_limits import HostLimit, HostLimits
+
+
+class StubPukiWiki(StubHandler):
+    hits = {}
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+
+    def do_GET(self):
+        query = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        key = (query.get('cmd'), query.get('page'))
+        self.hits[key] = self.hits.get(key, 0) + 1
+
+        if query.get('cmd') == 'backup' and 'age' not in query:
+            body = ''.join('<li><a href="./?cmd=backup&amp;page=A&amp;age=%d">%d 2005-06-11 (土) 14:12:34</a></li>' % (age, age)
+                           for age in range(1, 9))
+            return self.send(200, ('<html><body><ul>%s</ul></body></html>' % body).encode('utf-8'),
+                             {'Content-Type': 'text/html; charset=UTF-8'})
+        if query.get('cmd') in ('slow', 'backup'):
+            with self.lock:
+                StubPukiWiki.in_flight += 1
+                StubPukiWiki.max_in_flight = max(StubPukiWiki.max_in_flight, StubPukiWiki.in_flight)
+            time.sleep(0.05)
+            with self.lock:
+                StubPukiWiki.in_flight -= 1
+            return self.send(200, b'<html><body><pre>age %s</pre></body></html>' % query.get('age', '').encode())
+        if query.get('page') == 'Flaky' and self.hits[key] == 1:
+            return self.send(503, b'busy', {'Retry-After': '0'})
+        if query.get('cmd') == 'source' and query.get('page') != 'NoSource':
+            body = '<html><body><pre id="source">*%s\n&lt;tag&gt; 日本語</pre></body></html>' % query['page']
+            return self.send(200, body.encode('euc-jp'), {'Content-Type': 'text/html; charset=EUC-JP'})
+        if query.get('cmd') == 'edit':
+            body = '<html><body><textarea name="msg">edit: %s</textarea></body></html>' % query['page']
+            return self.send(200, body.encode('utf-8'), {'Content-Type': 'text/html; charset=UTF-8'})
+        return self.send(404, b'not found')
+
+
+@pytest.fixture(scope='module')
+def puki_url(serve):
+    return serve(StubPukiWiki, '/index.php')
+
+
+def test_async_engine_dumps_pages(puki_url, tmp_path):
+    engine = AsyncEngine(requests.Session(), concurrency=8, retries=2)
+    pages = [{'title': title, 'url_encoding': 'utf-8'} for title in ['FrontPage', 'Flaky', 'NoSource']]
+
+    strategy = SourceStrategy()
+
+    async def dump(engine, page):
+        await dump_page_async(engine, DirPageStore(str(tmp_path)), strategy, page, puki_url, current_only=True)
+
+    assert engine.run(dump, pages) == []
+
+    with open(page_filepath(str(tmp_path), 'FrontPage'), encoding='utf-8') as f:
+        assert f.read() == '*FrontPage\n<tag> 日本語'
+    with open(page_filepath(str(tmp_path), 'Flaky'), encoding='utf-8') as f:
+        assert f.read().startswith('*Flaky')  # 503 was retried
+    with open(page_filepath(str(tmp_path), 'NoSource'), encoding='utf-8') as f:
+        assert f.read() == 'edit: NoSource'  # fell back to cmd=edit
+
+
+def test_async_engine_collects_errors(puki_url):
+    engine = AsyncEngine(requests.Session(), concurrency=4, retries=0, hard_retries=0)
+
+    async def fetch(engine, item):
+        r = await engine.get(puki_url + '?cmd=' + item + '&page=A')
+        r.raise_for_status()
+
+    errors = engine.run(fetch, ['edit', 'nope'], ignore_errors=True)
+    assert [item for item, _ in errors] == ['nope']
+
+
+def test_async_engine_bounds_open_requests(puki_url):
+    engine = AsyncEngine(requests.Session(), concurrency=2)
+
+    async def fan_out(engine, item):
+        await asyncio.gather(*(engine.get(puki_url + '?cmd=slow&page=%s%d' % (item, i)) for i in range(6)))
+
+    StubPukiWiki.max_in_flight = 0
+    assert engine.run(fan_out, ['A', 'B']) == []
+    assert StubPukiWiki.max_in_flight == 2 # not 2 items x 6 requests
+
+
+def test_history_generations_share_the_host_slots(puki_url, tmp_path):
+    engine = AsyncEngine(requests.Session(), concurrency=4, host_limits=HostLimits(HostLimit(concurrency=3)))
+    pages = [{'title': title, 'url_encoding': 'utf-8'} for title in ['A', 'B', 'C']]
+
+    async def dump(engine, page):
+        await dump_page_history_async(engine, page, puki_url, str(tmp_path))
+
+    StubPukiWiki.max_in_flight = 0
+    assert engine.run(dump, pages) == []
+    assert StubPukiWiki.max_in_flight <= 3 # not 3 pages x 8 ages
+    assert [rev['text'] for rev in load_history(str(tmp_path), 'B')] == ['age %d' % age for age in range(8, 0, -1)]
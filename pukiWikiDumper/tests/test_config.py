@@ -0,0 +1,29 @@
+import json
+import os
+
+from pukiWikiDumper.utils.config import CONFIG_FILEPATH, get_config, update_config
+from pukiWikiDumper.utils.scheduler import PhaseThread
+
+
+def test_update_config_from_parallel_phases(tmp_path):
+    dumpDir = str(tmp_path)
+    os.makedirs(tmp_path / 'dumpMeta')
+    update_config(dumpDir, {'puki_url': 'http://x/'})
+
+    def phase(key: str, value: str):
+        def run():
+            for i in range(200):
+                assert get_config(dumpDir)['puki_url'] == 'http://x/' # never half-written
+                update_config(dumpDir, {key: '%s-%d' % (value, i)})
+        return run
+
+    # like dump_content_phases() and dump_media_phase() with --parallel-phases
+    media_phase = PhaseThread(phase('attach_storage', 'blobs'), name='media-phase')
+    media_phase.start()
+    phase('content_storage', 'packed')()
+    media_phase.result()
+
+    with open(tmp_path / CONFIG_FILEPATH) as f:
+        config = json.load(f)
+    assert config == {'puki_url': 'http://x/', 'attach_storage': 'blobs-199', 'content_storage': 'packed-199'}
+    assert os.listdir(tmp_path / 'dumpMeta') == ['config.json'] # no temp file left
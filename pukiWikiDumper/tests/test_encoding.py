@@ -0,0 +1,63 @@
+import pytest
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from pukiWikiDumper.utils.config import running_config
+from pukiWikiDumper.utils.encoding import detect_site_encoding, is_euc_jp, normalize_encoding, response_encoding
+
+TEXT = '<html><head>%s</head><body>日本語のページ、テスト</body></html>'
+
+
+def response(body: bytes, content_type='text/html') -> requests.Response:
+    r = requests.Response()
+    r.status_code = 200
+    r.url = 'http://x/'
+    r.headers = CaseInsensitiveDict({'Content-Type': content_type})
+    r.encoding = requests.utils.get_encoding_from_headers(r.headers)
+    r._content = body
+    r._content_consumed = True
+    return r
+
+
+@pytest.fixture
+def site_encoding():
+    def set_site_encoding(value):
+        running_config.site_encoding = value
+    yield set_site_encoding
+    running_config.site_encoding = None
+
+
+def test_normalize_encoding():
+    assert normalize_encoding('EUC-JP') == 'euc_jisx0213'
+    assert normalize_encoding('x-euc-jp') == 'euc_jisx0213'
+    assert normalize_encoding('ujis') == 'euc_jisx0213'
+    assert normalize_encoding('UTF8') == 'utf-8'
+    assert normalize_encoding('ascii') == 'utf-8'
+    assert normalize_encoding('ISO-8859-1') is None
+    assert normalize_encoding('no-such-codec') is None
+    assert normalize_encoding(None) is None
+
+
+def test_detect_site_encoding():
+    body = (TEXT % '<meta charset="EUC-JP">').encode('euc-jp')
+    assert detect_site_encoding(response(body, 'text/html; charset=Shift_JIS')) == 'shift_jis' # header first
+    assert detect_site_encoding(response(body)) == 'euc_jisx0213' # then <meta charset>
+    xhtml = b'<?xml version="1.0" encoding="EUC-JP"?>\n' + (TEXT % '').encode('euc-jp')
+    assert detect_site_encoding(response(xhtml)) == 'euc_jisx0213' # or <?xml encoding?>
+    assert detect_site_encoding(response((TEXT % '').encode('utf-8'))) == 'utf-8' # then chardet
+
+
+def test_response_encoding_uses_the_site_encoding(site_encoding, monkeypatch):
+    site_encoding('euc_jisx0213')
+    with monkeypatch.context() as m:
+        m.setattr(requests.Response, 'apparent_encoding', property(lambda r: pytest.fail('chardet was called')))
+        r = response((TEXT % '').encode('euc-jp'))
+        assert response_encoding(r) == 'euc_jisx0213'
+        assert is_euc_jp(r)
+
+        r = response((TEXT % '').encode('shift_jis'), 'text/html; charset=Shift_JIS')
+        assert response_encoding(r) == 'shift_jis' # the header wins
+
+    r = response((TEXT % '').encode('utf-8')) # not EUC-JP after all: chardet
+    assert response_encoding(r) == 'utf-8'
+    assert not is_euc_jp(r)
@@ -0,0 +1,50 @@
+import threading
+import time
+
+import pytest
+
+from pukiWikiDumper.utils.host_limits import HostLimit, HostLimits, parse_host_limit
+
+
+def test_parse_host_limit():
+    assert parse_host_limit('cdn.example.org=16') == ('cdn.example.org', HostLimit(16, 0.0))
+    assert parse_host_limit('CDN.example.org=4:0.5') == ('cdn.example.org', HostLimit(4, 0.5))
+    for value in ('cdn.example.org', '=4', 'cdn.example.org=0', 'cdn.example.org=x'):
+        with pytest.raises(ValueError):
+            parse_host_limit(value)
+
+
+def test_site_profile():
+    limits = HostLimits(HostLimit(2, 1.0), {'img.example.org': HostLimit(3)})
+    limits.use_profile('https://wikiwiki.jp/genshinwiki/')
+    assert limits.get('https://cdn.wikiwiki.jp/to/w/genshinwiki/a.png').concurrency > 2
+    assert limits.get('https://wikiwiki.jp/genshinwiki/?cmd=list') == HostLimit(2, 1.0)
+    assert limits.get('https://img.example.org/logo.png') == HostLimit(3)
+
+    limits = HostLimits(HostLimit(2), {'cdn.wikiwiki.jp': HostLimit(1)})
+    limits.use_profile('https://wikiwiki.jp/genshinwiki/')
+    assert limits.get('https://cdn.wikiwiki.jp/x') == HostLimit(1) # explicit limit wins
+
+
+def test_slot():
+    limits = HostLimits(HostLimit(1), {'cdn.example.org': HostLimit(3)})
+    running = {'origin': 0, 'cdn': 0}
+    peak = {'origin': 0, 'cdn': 0}
+    lock = threading.Lock()
+
+    def request(url, key):
+        with limits.slot(url), limits.slot(url): # re-entrant
+            with lock:
+                running[key] += 1
+                peak[key] = max(peak[key], running[key])
+            time.sleep(0.05)
+            with lock:
+                running[key] -= 1
+
+    workers = [threading.Thread(target=request, args=('http://origin.example.org/?cmd=list', 'origin')) for _ in range(3)]
+    workers += [threading.Thread(target=request, args=('https://cdn.example.org/a.png', 'cdn')) for _ in range(6)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert peak == {'origin': 1, 'cdn': 3}
@@ -0,0 +1,48 @@
+import threading
+
+from pukiWikiDumper.utils.journal import DONE, FAILED, SKIPPED, Journal
+
+
+def test_journal_resume(tmp_path):
+    with Journal(str(tmp_path), 'content') as journal:
+        journal.record('A', DONE)
+        journal.record('B', FAILED, ValueError('boom'))
+        journal.record('C', SKIPPED, 'action disabled')
+    with Journal(str(tmp_path), 'media') as journal:
+        journal.record('A', FAILED, TimeoutError())
+
+    # torn last line from a crash
+    with open(tmp_path / 'dumpMeta' / 'progress-content.jsonl', 'a') as f:
+        f.write('{"phase": "content", "key": "D", "sta')
+
+    journal = Journal(str(tmp_path), 'content')
+    assert journal.is_finished('A') and journal.is_finished('C')
+    assert not journal.is_finished('B') and not journal.is_finished('D')
+    assert journal.failed() == ['B']
+    assert journal.entries['B'] == (FAILED, 'boom')
+
+    journal.record('B', DONE) # retried, last line wins
+    journal.close()
+    journal = Journal(str(tmp_path), 'content')
+    assert journal.failed() == []
+    assert journal.counts() == {DONE: 2, FAILED: 0, SKIPPED: 1}
+
+    assert Journal(str(tmp_path), 'media').entries == {'A': (FAILED, 'TimeoutError')}
+
+
+def test_parallel_phases_write_their_own_files(tmp_path):
+    def run(phase: str):
+        with Journal(str(tmp_path), phase) as journal:
+            for i in range(2000):
+                journal.record('page %d with a long enough key to span buffers ' % i * 4, DONE)
+
+    threads = [threading.Thread(target=run, args=(phase,)) for phase in ('content', 'history', 'media')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for phase in ('content', 'history', 'media'):
+        assert Journal(str(tmp_path), phase).counts() == {DONE: 2000, FAILED: 0, SKIPPED: 0}
+        with open(tmp_path / 'dumpMeta' / ('progress-%s.jsonl' % phase), encoding='utf-8') as f:
+            assert all(line.startswith('{"phase": "%s"' % phase) for line in f)
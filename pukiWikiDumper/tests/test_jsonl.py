@@ -0,0 +1,15 @@
+from pukiWikiDumper.utils.jsonl import append_jsonl, iter_jsonl, open_jsonl
+
+
+def test_jsonl_survives_a_torn_line(tmp_path):
+    path = str(tmp_path / 'log.jsonl')
+    assert list(iter_jsonl(path)) == []
+
+    with open_jsonl(path) as f:
+        append_jsonl(f, {'key': 'A'})
+    with open(path, 'a') as f:
+        f.write('{"key": "B", "tor') # crashed mid-write
+
+    with open_jsonl(path) as f:
+        append_jsonl(f, {'key': 'C', 'title': '日本語'})
+    assert list(iter_jsonl(path)) == [{'key': 'A'}, {'key': 'C', 'title': '日本語'}]
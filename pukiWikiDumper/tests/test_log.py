@@ -0,0 +1,96 @@
+import json
+import sys
+import threading
+
+from pukiWikiDumper.utils.log import DEBUG, INFO, WARNING, Log, _Progress, format_duration, log as global_log
+
+
+def test_log_lines_in_order_and_by_level(capsys):
+    global_log.flush() # lines still queued by other tests
+    capsys.readouterr()
+    log = Log(level=INFO, interval=3600)
+    log.debug('hidden')
+    assert log._thread is None # filtered out before the queue
+
+    threads = [threading.Thread(target=lambda i=i: [log.info('t%d %d' % (i, n)) for n in range(50)]) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    log.warning('Content: [[FrontPage]] saved.')
+    log.flush()
+
+    lines = [line for line in capsys.readouterr().out.splitlines() if not line.startswith('Progress: ')]
+    assert len(lines) == 4 * 50 + 1
+    for i in range(4): # each thread's lines in the order it logged them
+        assert [line for line in lines if line.startswith('t%d ' % i)] == ['t%d %d' % (i, n) for n in range(50)]
+    assert lines[-1] == 'Content: "FrontPage" saved.'
+    assert 'hidden' not in lines
+
+
+def test_event_log(tmp_path, capsys):
+    global_log.flush()
+    capsys.readouterr()
+    path = tmp_path / 'events.jsonl'
+    log = Log(level=WARNING, interval=3600)
+    log.configure(event_log=str(path))
+    log.debug('Content: (1/2): [[A]] ...')
+    log.request('GET', 'http://x/?A', 200, 0.25, 1234)
+    log.request('GET', 'http://x/?B', None, 1.5)
+    log.event('phase', name='content', state='done')
+    log.flush()
+
+    assert '(1/2)' not in capsys.readouterr().out # below the console level
+    events = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [event['event'] for event in events] == ['log', 'request', 'request', 'phase']
+    assert events[0]['level'] == 'debug' and events[0]['msg'] == 'Content: (1/2): [[A]] ...'
+    assert events[1]['status'] == 200 and events[1]['bytes'] == 1234 and events[1]['elapsed'] == 0.25
+    assert events[2]['status'] is None
+    assert events[3]['name'] == 'content' and events[3]['state'] == 'done'
+
+    log.configure(level=DEBUG)
+    log.request('GET', 'http://x/?C', 404, 0.01)
+    log.flush()
+    assert 'Resp: GET 404 http://x/?C' in capsys.readouterr().out
+
+
+def test_progress_status():
+    progress = _Progress(start=0.0)
+    progress.total = 100
+    progress.skipped = 40 # a previous run, not part of the rate
+    progress.done = 10
+    assert progress.describe('Content', now=20.0) == 'Content 50/100, ETA 0:01:40'
+
+    progress.total_bytes = 1000 # by bytes once known
+    progress.nbytes = 250
+    assert progress.describe('Media', now=20.0) == 'Media 50/100, ETA 0:01:00'
+
+    assert _Progress(start=0.0).describe('Media', now=1.0) == 'Media 0/?'
+    assert format_duration(3725) == '1:02:05'
+
+    log = Log(interval=3600)
+    log._handle(('total', 0.0, 'Content', 100, None))
+    log._handle(('progress', 0.0, 'Content', 1, 0, 0))
+    log._handle(('request', 0.0, 'GET', 'http://x/', 200, 0.1, 2048))
+    log._last_status = log._last_status - 2 # two seconds ago
+    status = log._status(log._last_status + 2)
+    assert status.startswith('Progress: Content 1/100')
+    assert status.endswith(' | 0.5 req/s, 1.0 KiB/s')
+
+
+def test_excepthook_flushes_first(monkeypatch, capsys):
+    assert not hasattr(sys.excepthook, '__log__') # importing doesn't install it
+
+    global_log.flush() # lines still queued by other tests
+    capsys.readouterr()
+    printed = []
+    monkeypatch.setattr(sys, 'excepthook', lambda *args: printed.append(capsys.readouterr().out))
+    log = Log(level=INFO, interval=3600)
+    log.install_excepthook()
+    log.install_excepthook() # once
+    log.info('before the traceback')
+    try:
+        raise ValueError('boom')
+    except ValueError:
+        sys.excepthook(*sys.exc_info())
+    assert printed == ['before the traceback\n']
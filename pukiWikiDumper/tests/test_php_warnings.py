@@ -0,0 +1,109 @@
+from pathlib import Path
+
+import pytest
+
+from pukiWikiDumper.dump.content.extract import resolve_encoding
+from pukiWikiDumper.utils.log import log as output_log
+from pukiWikiDumper.utils.util import (WARNINGS_TO_REMOVE, PHPWarningLog, trim_PHP_warnings,
+                                       trim_PHP_warnings_bytes)
+
+PAGES_DIR = Path(__file__).parent / 'dump' / 'content'
+
+WARNINGS = [
+    '<br />\n<b>Warning</b>:  Cannot modify header information - headers already sent by '
+    '(output started at /home/wiki/lib/func.php:12) in <b>/home/wiki/lib/html.php</b> on line <b>432</b><br />\n',
+    '<br />\n<b>Deprecated</b>:  Function ereg() is deprecated in <b>/home/wiki/lib/file.php</b> on line <b>36</b><br />\n'
+    '<br />\n<b>Notice</b>:  Undefined index: 日本語 in <b>/home/wiki/plugin/attach.inc.php</b> on line <b>9</b><br />\n',
+    '<div class="error">Strict Standards: Non-static method</div>\n<b>Strict Standards</b>: x\n',
+]
+
+
+def legacy_trim_PHP_warnings(html_or_text: str, strict: bool = False) -> str:
+    """ The line-by-line implementation `trim_PHP_warnings()` replaced (without its prints) """
+    doc_type_is_html_TAG = '<!DOCTYPE html' in html_or_text
+    html_TAG = '<html' in html_or_text
+    if strict and not (doc_type_is_html_TAG or html_TAG):
+        return html_or_text
+    lines = html_or_text.splitlines(keepends=True)
+    if len(lines) == 1 and (doc_type_is_html_TAG or html_TAG):
+        return html_or_text
+    new_text = ''
+    in_document = False
+    for line in lines:
+        if in_document:
+            new_text += line
+            continue
+        if ((doc_type_is_html_TAG and '<!DOCTYPE html' in line) or
+            (html_TAG and '<html' in line)):
+            in_document = True
+            new_text = line
+            continue
+        elif (doc_type_is_html_TAG or html_TAG):
+            continue
+        if (line.startswith(WARNINGS_TO_REMOVE)):
+            continue
+        else:
+            in_document = True
+            new_text = line
+            continue
+    return new_text
+
+
+def read_page(path: Path) -> str:
+    content = path.read_bytes()
+    return content.decode(resolve_encoding(content))
+
+
+def samples():
+    """ `(name, text)`: saved pages and wikitext, with and without warnings before them """
+    documents = {path.name: read_page(path) for path in sorted(PAGES_DIR.glob('*.html'))}
+    documents['xhtml'] = '<?xml version="1.0"?>\n<html lang="ja">\n<body>日本語</body>\n</html>\n'
+    documents['wikitext'] = '*見出し\n本文 <br> & <b>Warning</b> inside\n'
+    documents['single line'] = '<!DOCTYPE html><html><body>x</body></html>'
+    for name, document in documents.items():
+        yield name, document
+        for i, warnings in enumerate(WARNINGS):
+            yield '%s + warnings %d' % (name, i), warnings + document
+            yield '%s + warnings %d (CRLF)' % (name, i), (warnings + document).replace('\n', '\r\n')
+        yield name + ' + warnings on the same line', WARNINGS[0].rstrip('\n') + document
+    yield 'only warnings', WARNINGS[1]
+    yield 'empty', ''
+
+
+SAMPLES = list(samples())
+
+
+@pytest.mark.parametrize('name, text', SAMPLES, ids=[name for name, _ in SAMPLES])
+def test_trim_PHP_warnings_equivalence(name, text):
+    for strict in (False, True):
+        expected = legacy_trim_PHP_warnings(text, strict=strict)
+        assert trim_PHP_warnings(text, strict=strict, log=None) == expected
+        for encoding in ('utf-8', 'euc_jisx0213', 'shift_jis'):
+            try:
+                content = text.encode(encoding)
+            except UnicodeEncodeError:
+                continue
+            assert trim_PHP_warnings_bytes(content, strict=strict, log=None).decode(encoding) == expected
+
+
+def test_trim_PHP_warnings_removes_warnings():
+    page = read_page(PAGES_DIR / 'source.pukiwiki.sourceforge.io.html')
+    assert trim_PHP_warnings(WARNINGS[0] + page, log=None) == page
+    assert trim_PHP_warnings(WARNINGS[1] + '*見出し\n', log=None) == '*見出し\n'
+    assert trim_PHP_warnings(WARNINGS[1] + '*見出し\n', strict=True, log=None) == WARNINGS[1] + '*見出し\n'
+
+
+def test_PHP_warning_log(capsys):
+    log = PHPWarningLog(max_samples=3)
+    page = '<!DOCTYPE html>\n<html></html>\n'
+    for _ in range(10):
+        trim_PHP_warnings(WARNINGS[0] + page, log=log)
+    trim_PHP_warnings(WARNINGS[1] + '*見出し\n', log=log)
+
+    output_log.flush()
+    printed = capsys.readouterr().out
+    assert printed.count('Cannot modify header information') == 1 # each warning once
+    assert 'Undefined index' not in printed # max_samples reached
+    assert log.responses == 11 and log.unsafe == 1
+    assert log.lines == 10 * 2 + 4
+    assert '24 lines' in log.summary()
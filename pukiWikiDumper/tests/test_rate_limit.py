@@ -0,0 +1,71 @@
+import threading
+import time
+
+import pytest
+import requests
+
+from pukiWikiDumper.utils.patch import SessionMonkeyPatch
+from pukiWikiDumper.utils.rate_limit import TokenBucket
+
+
+def test_token_bucket_reserve():
+    bucket = TokenBucket(rate=10, burst=3)
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0] # burst
+    waits = [bucket.reserve() for _ in range(3)]
+    assert waits == pytest.approx([0.1, 0.2, 0.3], abs=0.02) # then evenly spaced
+
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0)
+
+
+def test_token_bucket_is_shared_by_threads():
+    bucket = TokenBucket(rate=50, burst=1)
+    times = []
+    lock = threading.Lock()
+
+    def worker():
+        for _ in range(5):
+            bucket.acquire()
+            with lock:
+                times.append(time.monotonic())
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # 20 requests at 50/s, whatever the number of threads: the first one is free
+    assert len(times) == 20
+    assert max(times) - start >= 19 / 50 - 0.02
+
+
+def send_concurrently(patch: SessionMonkeyPatch, workers: int) -> float:
+    """ Seconds for `workers` threads to send one request each through `patch` """
+    def send(request, **kwargs):
+        r = requests.Response()
+        r.status_code = 200
+        r._content = b''
+        return r
+
+    patch.session.send = send
+    patch.hijack()
+    try:
+        threads = [threading.Thread(target=patch.session.send, args=(requests.Request('GET', 'http://x/').prepare(),))
+                   for _ in range(workers)]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.monotonic() - start
+    finally:
+        patch.release()
+
+
+def test_delay_is_per_thread_rate_is_shared():
+    # --delay: each thread pauses before its own request, they don't queue behind each other
+    assert send_concurrently(SessionMonkeyPatch(requests.Session(), delay=0.2), workers=4) < 0.6
+    # --rate: 4 requests at 10/s, the first one is free
+    assert send_concurrently(SessionMonkeyPatch(requests.Session(), rate_limit=TokenBucket(10)), workers=4) >= 0.28
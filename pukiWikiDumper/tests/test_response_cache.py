@@ -0,0 +1,26 @@
+from pukiWikiDumper.utils.response_cache import CACHE_INDEX, ResponseCache
+
+
+def test_response_cache(tmp_path):
+    body = '<pre id="source">日本語</pre>'.encode('euc-jp')
+    with ResponseCache(str(tmp_path)) as cache:
+        cache.store('http://x/?cmd=source&page=A', 200, 'OK', 'http://x/?cmd=source&page=A',
+                    {'Content-Type': 'text/html; charset=EUC-JP'}, body)
+        cache.store('http://x/?cmd=source&page=B', 200, 'OK', 'http://x/?cmd=source&page=B', {}, body)
+        cache.store('http://x/old', 200, 'OK', 'http://x/new', {}, b'moved')
+
+    with open(tmp_path / CACHE_INDEX, 'a') as f:
+        f.write('{"url": "torn') # crashed mid-write
+
+    cache = ResponseCache(str(tmp_path))
+    r = cache.get('http://x/?cmd=source&page=A')
+    assert r.status_code == 200 and r.content == body
+    assert r.encoding == 'EUC-JP' # as requests would have set it
+    assert r.text == '<pre id="source">日本語</pre>'
+    assert cache.get('http://x/old').url == 'http://x/new'
+    assert cache.get('http://x/missing') is None
+    assert len({entry['sha1'] for entry in cache.index.values()}) == 2 # same body stored once
+
+    cache.store('http://x/?cmd=source&page=A', 404, 'Not Found', 'http://x/?cmd=source&page=A', {}, b'gone')
+    cache.close()
+    assert ResponseCache(str(tmp_path)).get('http://x/?cmd=source&page=A').status_code == 404 # last one wins
@@ -0,0 +1,40 @@
+import threading
+
+import pytest
+
+from pukiWikiDumper.utils.scheduler import Scheduler
+
+
+def test_scheduler_runs_every_item_on_fixed_workers():
+    done = []
+    thread_names = set()
+    lock = threading.Lock()
+
+    def task(item):
+        with lock:
+            done.append(item)
+            thread_names.add(threading.current_thread().name)
+
+    with Scheduler(workers=3) as scheduler:
+        for i in range(200):
+            scheduler.submit(task, i)
+
+    assert sorted(done) == list(range(200))
+    assert len(thread_names) <= 3
+
+
+def test_scheduler_collects_errors():
+    def task(item):
+        if item % 10 == 0:
+            raise ValueError(item)
+
+    with Scheduler(workers=2, ignore_errors=True) as scheduler:
+        for i in range(50):
+            scheduler.submit(task, i)
+
+    assert sorted(item for item, _ in scheduler.errors) == [0, 10, 20, 30, 40]
+
+    with pytest.raises(ValueError):
+        with Scheduler(workers=2) as scheduler:
+            for i in range(50):
+                scheduler.submit(task, i)
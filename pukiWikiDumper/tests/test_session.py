@@ -0,0 +1,33 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from pukiWikiDumper.tests.conftest import StubHandler
+from pukiWikiDumper.utils.session import connection_stats, createSession, set_pool_size
+
+
+class BusyServer(StubHandler):
+    """ keep-alive, the first request on every connection gets a 503 """
+
+    def do_GET(self):
+        busy = not getattr(self, 'served', False) # one handler per connection
+        self.served = True
+        self.send(503, b'busy') if busy else self.send(200, b'ok')
+
+
+@pytest.fixture(scope='module')
+def url(serve):
+    return serve(BusyServer)
+
+
+def test_retries_keep_connections_alive(url):
+    session = createSession(retries=5, user_agent='test', pool_size=2)
+    set_pool_size(session, 8)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        responses = list(executor.map(lambda _: session.get(url), range(80)))
+    assert all(r.status_code == 200 for r in responses)
+
+    # the retry goes out on the same (drained) connection, and the pool holds one per thread
+    opened, sent = connection_stats(session)['127.0.0.1']
+    assert opened <= 8
+    assert sent == 80 + opened
@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+from pukiWikiDumper.utils.steps import drive, drive_async
+
+
+def steps():
+    first = yield 'a'
+    try:
+        yield 'fail'
+    except KeyError as e:
+        failed = str(e)
+    rest = yield ['b', 'c']
+    return [first, failed] + rest
+
+
+def get(url: str) -> str:
+    if url == 'fail':
+        raise KeyError(url)
+    return url.upper()
+
+
+async def get_async(url: str) -> str:
+    return get(url)
+
+
+def test_drive():
+    assert drive(steps(), get) == ['A', "'fail'", 'B', 'C']
+    assert drive(steps(), get, lambda urls: ['*'] * len(urls)) == ['A', "'fail'", '*', '*']
+
+
+def test_drive_async():
+    assert asyncio.run(drive_async(steps(), get_async)) == ['A', "'fail'", 'B', 'C']
+
+
+def test_uncaught_request_error_propagates():
+    def one():
+        yield 'fail'
+    with pytest.raises(KeyError):
+        drive(one(), get)
+    with pytest.raises(KeyError):
+        asyncio.run(drive_async(one(), get_async))
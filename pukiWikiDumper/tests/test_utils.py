@@ -1,4 +1,4 @@
-from pukiWikiDumper.utils.util import url2prefix
+from pukiWikiDumper.utils.util import count_lines, iter_saved_pages, save_pages_as_we_go, url2prefix
 
 
 def test_url2prefix():
@@ -9,4 +9,18 @@ def test_url2prefix():
         'xn--ui1a.com_123_11_22li_guo_3_jia'
     }
     for url, prefix in tests_slugify.items():
-        assert url2prefix(url, ascii_slugify=True) == prefix
\ No newline at end of file
+        assert url2prefix(url, ascii_slugify=True) == prefix
+
+def test_save_pages_as_we_go(tmp_path):
+    path = str(tmp_path / 'pages.jsonl')
+    pages = [{'title': 'ページ%d' % i, 'url_encoding': 'utf-8'} for i in range(3)]
+
+    # interrupted enumeration: nothing to resume from
+    gen = save_pages_as_we_go(path, iter(pages))
+    assert next(gen) == pages[0]
+    gen.close()
+    assert not (tmp_path / 'pages.jsonl').exists()
+
+    assert list(save_pages_as_we_go(path, iter(pages))) == pages
+    assert count_lines(path) == 3
+    assert list(iter_saved_pages(path)) == pages
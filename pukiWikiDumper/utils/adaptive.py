@@ -0,0 +1,149 @@
+import asyncio
+import contextlib
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from pukiWikiDumper.utils.util import print_with_lock as print
+
+# the server asks us to slow down
+OVERLOAD_STATUS = (429, 503)
+
+
+class AdaptiveConcurrency:
+    """ AIMD limit on the number of requests in flight, between `floor` and `ceiling`.
+
+    After a full window of successful responses (as many as the current limit)
+    with latency not rising, the limit grows by one. A 429/503, a `Retry-After`,
+    a hard error or latency above `latency_factor` times the baseline halves it,
+    at most once per `cooldown` seconds, so one burst of errors (or the responses
+    of requests sent before the decrease) doesn't bring it down to the floor.
+
+    The baseline is the lowest smoothed latency seen, drifting slowly upwards
+    so a server that got slower for good doesn't keep the limit at the floor.
+    Every change is printed (`Concurrency: 4 -> 5 (...)`) for tuning.
+    """
+
+    def __init__(self, floor: int, ceiling: int, initial: Optional[int] = None,
+                 latency_factor: float = 2.0, cooldown: float = 2.0):
+        if floor < 1 or ceiling < floor:
+            raise ValueError('expected 1 <= floor <= ceiling, got %d, %d' % (floor, ceiling))
+        self.floor = floor
+        self.ceiling = ceiling
+        self.limit = min(max(initial or floor, floor), ceiling)
+        self.latency_factor = latency_factor
+        self.cooldown = cooldown
+
+        self.in_flight = 0
+        self.latency: Optional[float] = None # EWMA, seconds
+        self.baseline: Optional[float] = None
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        self._held = threading.local()
+        self._async_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def _can_start(self) -> bool:
+        return self.in_flight < self.limit
+
+    def _wake(self):
+        """ Called with the lock held when a request may start """
+        self._cond.notify_all()
+        for loop, future in self._async_waiters:
+            loop.call_soon_threadsafe(lambda future=future: future.done() or future.set_result(None))
+        self._async_waiters.clear()
+
+    def acquire(self):
+        with self._cond:
+            while not self._can_start():
+                self._cond.wait()
+            self.in_flight += 1
+
+    async def acquire_async(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                if self._can_start():
+                    self.in_flight += 1
+                    return
+                future = loop.create_future()
+                self._async_waiters.append((loop, future))
+            await future
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._wake()
+
+    @contextlib.contextmanager
+    def slot(self):
+        """ Hold one slot. Re-entrant per thread: `requests` sends each redirect hop
+        from inside the send of the first request, which already holds one. """
+        if getattr(self._held, 'slot', False):
+            yield
+            return
+        self.acquire()
+        self._held.slot = True
+        try:
+            yield
+        finally:
+            self._held.slot = False
+            self.release()
+
+    @contextlib.asynccontextmanager
+    async def slot_async(self):
+        await self.acquire_async()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def _set_limit(self, limit: int, reason: str):
+        limit = min(max(limit, self.floor), self.ceiling)
+        if limit == self.limit:
+            return
+        print('Concurrency: %d -> %d (%s, latency %s, baseline %s)' % (
+            self.limit, limit, reason, _ms(self.latency), _ms(self.baseline)))
+        self.limit = limit
+        self._successes = 0
+        self._wake()
+
+    def _decrease(self, reason: str):
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self._set_limit(self.limit // 2, reason)
+
+    def record(self, latency: Optional[float] = None, status: Optional[int] = None,
+               retry_after: bool = False, error: Optional[BaseException] = None):
+        """ Feed the outcome of one request. `latency` (seconds) is only a clean sample
+        if the request wasn't retried, pass `None` otherwise. """
+        with self._cond:
+            if error is not None:
+                self._decrease('error: %s' % type(error).__name__)
+                return
+            if status in OVERLOAD_STATUS or retry_after:
+                self._decrease('HTTP %s%s' % (status, ', Retry-After' if retry_after else ''))
+                return
+
+            if latency is not None:
+                self.latency = latency if self.latency is None else self.latency * 0.8 + latency * 0.2
+                if self.baseline is None or self.latency < self.baseline:
+                    self.baseline = self.latency
+                else:
+                    self.baseline += (self.latency - self.baseline) * 0.01
+                if self.latency > self.baseline * self.latency_factor:
+                    self._decrease('latency rising')
+                    return
+
+            self._successes += 1
+            if self._successes >= self.limit and self.in_flight >= self.limit - 1:
+                # only grow if the current limit is actually used
+                self._set_limit(self.limit + 1, 'window ok')
+            elif self._successes >= self.limit:
+                self._successes = 0
+
+
+def _ms(seconds: Optional[float]) -> str:
+    return '-' if seconds is None else '%dms' % (seconds * 1000)
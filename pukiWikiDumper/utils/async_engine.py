@@ -0,0 +1,269 @@
+import asyncio
+import contextlib
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import requests
+import requests.utils
+from requests.structures import CaseInsensitiveDict
+
+from pukiWikiDumper.exceptions import ResponseNotCached
+from pukiWikiDumper.utils.adaptive import AdaptiveConcurrency
+from pukiWikiDumper.utils.host_limits import HostLimits, url_host
+from pukiWikiDumper.utils.log import log
+from pukiWikiDumper.utils.rate_limit import TokenBucket
+from pukiWikiDumper.utils.response_cache import ResponseCache
+from pukiWikiDumper.utils.util import print_with_lock as print
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+# same as createSession()'s CustomRetry
+STATUS_FORCELIST = (500, 502, 503, 504, 429)
+BACKOFF_FACTOR = 1.5
+BACKOFF_MAX = 120
+_END = object() # end of the items in `_run_all()`
+
+
+@contextlib.asynccontextmanager
+async def async_nullcontext():
+    """ `contextlib.nullcontext()` only works with `async with` since Python 3.10 """
+    yield
+
+
+def aiohttp_available() -> bool:
+    return aiohttp is not None
+
+
+class AsyncEngine:
+    """ Keeps many requests in flight on one asyncio event loop (aiohttp).
+
+    Mirrors the semantics of `createSession()` + `SessionMonkeyPatch`:
+    status retries with exponential backoff (honoring `Retry-After`),
+    hard retries on any other error, `delay` before each request, `rate_limit` across all hosts.
+    At most `concurrency` requests are open at a time, with `host_limits` the delay
+    and the number of open requests are per destination host instead.
+    With `adaptive`, the requests waiting for headers are limited by it and their outcome is fed back to it.
+    With `cache`, `get()` responses are written to it, or, with `replay`, read from it.
+    Headers and cookies are taken from the given `requests.Session`.
+
+    Responses are returned as `requests.Response` objects, so the patched
+    `Response.text` and the existing parsers work unchanged.
+
+    Usage: `errors = AsyncEngine(session, ...).run(fn, items)`, where `fn(engine, item)`
+    is a coroutine function.
+    """
+
+    def __init__(self, session: requests.Session, concurrency: int = 100,
+                 retries: int = 5, hard_retries: int = 3, delay: float = 0.0,
+                 host_limits: Optional[HostLimits] = None, rate_limit: Optional[TokenBucket] = None,
+                 adaptive: Optional[AdaptiveConcurrency] = None,
+                 cache: Optional[ResponseCache] = None, replay: bool = False):
+        if aiohttp is None:
+            raise ModuleNotFoundError("No module named 'aiohttp'", name='aiohttp')
+        if concurrency < 1:
+            raise ValueError('concurrency must be >= 1')
+        if replay and cache is None:
+            raise ValueError('replay needs a cache')
+
+        self.session = session
+        self.concurrency = concurrency
+        self.retries = retries
+        self.hard_retries = hard_retries
+        self.delay = delay
+        self.host_limits = host_limits
+        self.rate_limit = rate_limit
+        self.adaptive = adaptive
+        self.cache = cache
+        self.replay = replay
+        self._client = None  # type: Optional[aiohttp.ClientSession]
+        self._host_slots: Dict[Optional[str], asyncio.Semaphore] = {}
+
+    async def __aenter__(self):
+        headers = dict(self.session.headers)
+        # aiohttp may lack brotli/zstd decoders
+        headers['Accept-Encoding'] = 'gzip, deflate'
+        limit = self.concurrency if self.host_limits is None else max(self.concurrency, self.host_limits.max_concurrency())
+        self._host_slots = {} # bound to this event loop
+        connector = aiohttp.TCPConnector(limit=limit,
+                                         ssl=None if self.session.verify else False)
+        self._client = aiohttp.ClientSession(
+            headers=headers, cookies=self.session.cookies.get_dict(), connector=connector,
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=60, sock_read=120))
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._client.close()
+        self._client = None
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        ''' urllib3: no backoff before the first retry, then `factor * 2 ** (n - 1)` '''
+        if attempt <= 1:
+            return 0.0
+        return min(BACKOFF_MAX, BACKOFF_FACTOR * (2 ** (attempt - 1)))
+
+    @staticmethod
+    def _retry_after(resp) -> Optional[float]:
+        value = resp.headers.get('Retry-After')
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return None
+
+    @contextlib.asynccontextmanager
+    async def stream(self, url: str, headers: Optional[dict] = None):
+        """ Yield the `aiohttp.ClientResponse` once headers are received. (retries included)
+
+        Like `session.get(stream=True)`, errors while reading the body are not retried.
+        Streamed responses are not cached.
+        """
+        if self.replay:
+            raise ResponseNotCached(url)
+        async with self._host_slot(url):
+            delay = self.delay if self.host_limits is None else self.host_limits.get(url).delay
+            hard_retries = self.hard_retries + 1
+            while True:
+                try:
+                    if delay > 0: # per coroutine, --rate is the limit they share
+                        await asyncio.sleep(delay)
+                    if self.rate_limit is not None:
+                        await self.rate_limit.acquire_async()
+                    async with self.adaptive.slot_async() if self.adaptive is not None else async_nullcontext():
+                        resp = await self._send_with_retries(url, headers)
+                    break
+                except (KeyboardInterrupt, asyncio.CancelledError):
+                    raise
+                except Exception as e:
+                    hard_retries -= 1
+                    if hard_retries <= 0:
+                        raise e
+                    print('Hard retry... (%d), due to: %s' % (hard_retries, e))
+            try:
+                yield resp
+            finally:
+                resp.release()
+
+    def _host_slot(self, url: str) -> asyncio.Semaphore:
+        """ The host's connections, one slot for all hosts (`concurrency`) without `host_limits` """
+        host = url_host(url) if self.host_limits is not None else None
+        if host not in self._host_slots:
+            limit = self.concurrency if host is None else self.host_limits.get(url).concurrency
+            self._host_slots[host] = asyncio.Semaphore(limit)
+        return self._host_slots[host]
+
+    async def _send_with_retries(self, url: str, headers: Optional[dict]):
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            try:
+                resp = await self._client.get(url, headers=headers)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                log.request('GET', url, None, time.monotonic() - start)
+                if self.adaptive is not None:
+                    self.adaptive.record(error=e)
+                attempt += 1
+                if attempt > self.retries:
+                    raise requests.exceptions.RetryError('Max retries exceeded with url: %s (Caused by %r)' % (url, e))
+                delay_sec = self._backoff(attempt)
+                print('req retry in %.2fs' % delay_sec)
+                await asyncio.sleep(delay_sec)
+                continue
+
+            # the body is counted once read, by `get()` or the caller of `stream()` (`log.received()`)
+            log.request('GET', url, resp.status, time.monotonic() - start)
+            if self.adaptive is not None:
+                self.adaptive.record(latency=time.monotonic() - start if attempt == 0 else None, status=resp.status,
+                                     retry_after='Retry-After' in resp.headers)
+            if resp.status not in STATUS_FORCELIST:
+                return resp
+
+            attempt += 1
+            resp.release()
+            if attempt > self.retries:
+                raise requests.exceptions.RetryError(
+                    'Max retries exceeded with url: %s (too many %s error responses)' % (url, resp.status))
+            retry_after = self._retry_after(resp)
+            delay_sec = retry_after if retry_after is not None else self._backoff(attempt)
+            print('req retry (%s, %s) in %.2fs' % (resp.status, resp.reason, delay_sec))
+            await asyncio.sleep(delay_sec)
+
+    @staticmethod
+    def to_requests_response(resp, content: Optional[bytes] = None) -> requests.Response:
+        """ Convert an `aiohttp.ClientResponse` to a `requests.Response` (same encoding rules as `requests`) """
+        r = requests.Response()
+        r.status_code = resp.status
+        r.reason = resp.reason
+        r.url = str(resp.url)
+        r.headers = CaseInsensitiveDict(resp.headers)
+        r.encoding = requests.utils.get_encoding_from_headers(r.headers)
+        r._content = content if content is not None else b''
+        r._content_consumed = True
+        return r
+
+    async def get(self, url: str, headers: Optional[dict] = None) -> requests.Response:
+        if self.replay:
+            r = self.cache.get(url) if not headers else None
+            if r is None:
+                raise ResponseNotCached(url)
+            return r
+        async with self.stream(url, headers=headers) as resp:
+            content = await resp.read()
+            log.received(len(content))
+            r = self.to_requests_response(resp, content)
+        if self.cache is not None and not headers:
+            self.cache.store_response(url, r)
+        return r
+
+    async def _run_all(self, fn: Callable[['AsyncEngine', Any], Awaitable], items: Iterable,
+                       ignore_errors: bool, concurrency: int) -> List[Tuple[Any, BaseException]]:
+        errors: List[Tuple[Any, BaseException]] = []
+        slots = asyncio.Semaphore(concurrency)
+        tasks = set()
+
+        async def one(item):
+            try:
+                await fn(self, item)
+            except Exception as e:
+                errors.append((item, e))
+                if ignore_errors:
+                    print('Error in coroutine: (', e, ') ignored')
+            finally:
+                slots.release()
+
+        async with self:
+            # the items may come from a lazy producer doing blocking I/O (e.g. attachments
+            # listed while they download), so pull them on a thread to keep the loop running
+            loop = asyncio.get_running_loop()
+            iterator = iter(items)
+            while True:
+                item = await loop.run_in_executor(None, next, iterator, _END)
+                if item is _END:
+                    break
+                await slots.acquire()
+                if errors and not ignore_errors:
+                    slots.release()
+                    break
+                task = asyncio.ensure_future(one(item))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+
+        if errors and not ignore_errors:
+            raise errors[0][1]
+        return errors
+
+    def run(self, fn: Callable[['AsyncEngine', Any], Awaitable], items: Iterable,
+            ignore_errors: bool = False, concurrency: Optional[int] = None) -> List[Tuple[Any, BaseException]]:
+        """ Run `fn(engine, item)` for every item, at most `concurrency` (default: the engine's) at a time.
+
+        Same error semantics as `Scheduler`: returns `(item, exception)` pairs,
+        or raises the first error unless `ignore_errors`.
+        """
+        return asyncio.run(self._run_all(fn, items, ignore_errors, concurrency or self.concurrency))
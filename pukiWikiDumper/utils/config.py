@@ -1,21 +1,32 @@
 import json
 import os
+import threading
 from dataclasses import dataclass
+from typing import Optional
 
 from pukiWikiDumper.utils.util import Singleton, print_with_lock as print
 from pukiWikiDumper.utils.util import uopen
 
 CONFIG_FILEPATH = 'dumpMeta/config.json'
 
+_config_lock = threading.Lock()
 
-def update_config(dumpDir: str, config: dict):
-    '''Only updates given keys in config.'''
-    _config = get_config(dumpDir)
-    config = {**_config, **config}
-    print("Config: ", config)
 
-    with uopen(os.path.join(dumpDir, CONFIG_FILEPATH), 'w') as f:
-        json.dump(config, f, indent=4, ensure_ascii=False)
+def update_config(dumpDir: str, config: dict, verbose: bool = True):
+    '''Only updates given keys in config.
+    Thread-safe (the phases of --parallel-phases both update it), and readers never see a half-written file.
+    `verbose`: print the whole config'''
+    with _config_lock:
+        _config = get_config(dumpDir)
+        config = {**_config, **config}
+        if verbose:
+            print("Config: ", config)
+
+        path = os.path.join(dumpDir, CONFIG_FILEPATH)
+        tmp = '%s.%d.tmp' % (path, threading.get_ident())
+        with uopen(tmp, 'w') as f:
+            json.dump(config, f, indent=4, ensure_ascii=False)
+        os.replace(tmp, path)
 
 
 def get_config(dumpDir: str) -> dict:
@@ -31,4 +42,5 @@ def get_config(dumpDir: str) -> dict:
 class _Dumper_running_config(metaclass = Singleton):
     html_parser: str = 'html.parser'
     dump_media: bool = False
+    site_encoding: Optional[str] = None # see utils.encoding
 running_config = _Dumper_running_config()
\ No newline at end of file
@@ -2,6 +2,8 @@ import os
 import sys
 import importlib.util
 
+from pukiWikiDumper.utils.util import print_with_lock as print
+
 class AlreadyRunningError(Exception):
     def __init__(self, message: str=""):
         self.message = message
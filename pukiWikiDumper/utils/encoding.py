@@ -0,0 +1,88 @@
+import codecs
+import re
+from typing import Optional
+
+import requests
+
+from pukiWikiDumper.utils.config import running_config
+from pukiWikiDumper.utils.util import print_with_lock as print
+
+CONFIG_SITE_ENCODING = 'site_encoding'
+
+_RE_XML_ENCODING = re.compile(rb'^\s*<\?xml[^>]*\sencoding\s*=\s*["\']([A-Za-z0-9_\-]+)', re.I)
+_RE_META_CHARSET = re.compile(rb'<meta\s[^>]*charset\s*=\s*["\']?([A-Za-z0-9_\-]+)', re.I)
+
+# the <meta charset> is expected to be near the top of <head>
+SNIFF_BYTES = 4096
+
+EUC_JP_ALIASES = ('euc-jp', 'euc_jp', 'eucjp', 'x-euc-jp')
+
+
+def sniff_encoding(content: bytes) -> Optional[str]:
+    """ Encoding declared in `<?xml encoding=...?>` or `<meta charset>` """
+    head = content[:SNIFF_BYTES]
+    m = _RE_XML_ENCODING.search(head) or _RE_META_CHARSET.search(head)
+    return m.group(1).decode('ascii').lower() if m else None
+
+
+def widen_euc_jp(encoding: str) -> str:
+    """ EUC-JP as `euc_jisx0213`, PukiWiki pages often use its extra characters """
+    return 'euc_jisx0213' if encoding.lower() in EUC_JP_ALIASES else encoding
+
+
+def normalize_encoding(encoding: Optional[str]) -> Optional[str]:
+    """ Python codec name, EUC-JP widened (see `widen_euc_jp()`).
+    `None` for unknown encodings and for ISO-8859-1, `requests`' default for text/* without a charset. """
+    if not encoding:
+        return None
+    try:
+        name = codecs.lookup(widen_euc_jp(encoding)).name
+    except LookupError:
+        return None
+    if name == 'iso8859-1':
+        return None
+    if name == 'ascii': # e.g. chardet on a page without any non-ASCII character
+        return 'utf-8'
+    return widen_euc_jp(name)
+
+
+def header_encoding(r: requests.Response) -> Optional[str]:
+    """ The charset of the `Content-Type` header, not what `Response.text` may have set `r.encoding` to """
+    return normalize_encoding(requests.utils.get_encoding_from_headers(r.headers))
+
+
+def detect_site_encoding(r: requests.Response) -> str:
+    """ Resolve the encoding of a wiki once, from one of its pages:
+    the header charset, then `<meta charset>` (see `sniff_encoding()`), then a (slow) chardet sniff, then UTF-8. """
+    for encoding in (header_encoding(r), normalize_encoding(sniff_encoding(r.content)),
+                     normalize_encoding(r.apparent_encoding)):
+        if encoding is not None:
+            return encoding
+    return 'utf-8'
+
+
+def decodes_as(content: bytes, encoding: str) -> bool:
+    try:
+        content.decode(encoding)
+    except (UnicodeDecodeError, LookupError):
+        return False
+    return True
+
+
+def response_encoding(r: requests.Response) -> str:
+    """ The encoding to decode `r` with: its header charset, or the site encoding
+    (`running_config.site_encoding`) if the body decodes with it, or chardet as a last resort. """
+    encoding = header_encoding(r)
+    if encoding is not None:
+        return encoding
+    site_encoding = running_config.site_encoding
+    if site_encoding is not None:
+        if decodes_as(r.content, site_encoding):
+            return site_encoding
+        print('Info: %s is not %s, detecting its encoding' % (r.url, site_encoding))
+    return normalize_encoding(r.apparent_encoding) or 'utf-8'
+
+
+def is_euc_jp(r: requests.Response) -> bool:
+    """ Whether `r` is EUC-JP, to be parsed as `euc_jisx0213` """
+    return response_encoding(r) == 'euc_jisx0213'
@@ -0,0 +1,92 @@
+import contextlib
+import threading
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+import urllib.parse as urlparse
+
+from pukiWikiDumper.utils.util import print_with_lock as print
+
+
+@dataclass(frozen=True)
+class HostLimit:
+    concurrency: int
+    delay: float = 0.0
+
+
+# Known sites whose attachments (or other resources) come from another host.
+# origin host (or parent domain): {host: limit}
+SITE_PROFILES: Dict[str, Dict[str, HostLimit]] = {
+    # attach_url() rewrites attachments to the CDN, which takes far more than the PHP origin
+    'wikiwiki.jp': {'cdn.wikiwiki.jp': HostLimit(concurrency=8, delay=0.0)},
+}
+
+
+def parse_host_limit(value: str) -> Tuple[str, HostLimit]:
+    """ `HOST=CONCURRENCY[:DELAY]`, e.g. `cdn.wikiwiki.jp=16:0.1` """
+    host, sep, limit = value.partition('=')
+    concurrency, _, delay = limit.partition(':')
+    if not sep or not host.strip():
+        raise ValueError('expected HOST=CONCURRENCY[:DELAY], got %r' % value)
+    host_limit = HostLimit(concurrency=int(concurrency), delay=float(delay) if delay else 0.0)
+    if host_limit.concurrency < 1 or host_limit.delay < 0:
+        raise ValueError('concurrency must be >= 1 and delay >= 0, got %r' % value)
+    return host.strip().lower(), host_limit
+
+
+def url_host(url: str) -> str:
+    return (urlparse.urlparse(url).hostname or url).lower()
+
+
+class HostLimits:
+    """ Concurrency and delay per destination host.
+
+    Hosts without a limit of their own (the origin, an icon host, ...) get `default`
+    (`--threads`, `--delay`). Each host has its own semaphore, so a CDN can run
+    more requests in parallel than the origin without making the origin busier.
+    The delay is a pause before each request of each worker, like `--delay`.
+    """
+
+    def __init__(self, default: HostLimit, limits: Optional[Dict[str, HostLimit]] = None):
+        self.default = default
+        self.limits: Dict[str, HostLimit] = dict(limits or {})
+        self._explicit = set(self.limits)
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+        self._held = threading.local()
+
+    def use_profile(self, puki_url: str):
+        """ Add the `SITE_PROFILES` limits of the wiki at `puki_url`, explicit limits take precedence """
+        origin = url_host(puki_url)
+        for site, limits in SITE_PROFILES.items():
+            if origin == site or origin.endswith('.' + site):
+                for host, limit in limits.items():
+                    if host not in self._explicit:
+                        self.limits[host] = limit
+        for host, limit in self.limits.items():
+            print('Host limit: %s: %d connections, %.1fs delay' % (host, limit.concurrency, limit.delay))
+
+    def get(self, url: str) -> HostLimit:
+        return self.limits.get(url_host(url), self.default)
+
+    def max_concurrency(self) -> int:
+        return max([self.default.concurrency] + [limit.concurrency for limit in self.limits.values()])
+
+    @contextlib.contextmanager
+    def slot(self, url: str):
+        """ Hold one of the host's connections. Re-entrant per thread, so a caller can hold
+        the slot for a whole streamed download and the request inside doesn't take a second one. """
+        host = url_host(url)
+        held = self._held.__dict__.setdefault('hosts', set())
+        if host in held:
+            yield
+            return
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = self._semaphores[host] = threading.BoundedSemaphore(self.get(url).concurrency)
+        with semaphore:
+            held.add(host)
+            try:
+                yield
+            finally:
+                held.discard(host)
@@ -4,6 +4,8 @@ from typing import List, Optional
 
 from internetarchive import ArchiveSession, Search
 
+from pukiWikiDumper.utils.util import print_with_lock as print
+
 IA_MAX_RETRY = 5
 logger = logging.getLogger(__name__)
 
@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from pukiWikiDumper.utils.jsonl import append_jsonl, iter_jsonl, open_jsonl
+from pukiWikiDumper.utils.util import smkdirs
+
+JOURNAL_FILEPATH = 'dumpMeta/progress-%s.jsonl' # % phase
+
+DONE = 'done'
+FAILED = 'failed'
+SKIPPED = 'skipped' # e.g. --ignore-action-disabled-edit
+
+
+class Journal:
+    """ Append-only progress journal of one phase (`content`, `media`, ...).
+
+    `dumpMeta/progress-<phase>.jsonl` gets one line per finished item:
+    `{"phase": "content", "key": "FrontPage", "status": "done", "reason": null, "time": 1680000000.0}`.
+    The last line of a key wins. Each phase has its own file, so phases running in
+    parallel never write to the same one. It is read once, sequentially, so resuming
+    doesn't have to stat every item.
+    """
+
+    def __init__(self, dumpDir: str, phase: str):
+        self.dumpDir = dumpDir
+        self.phase = phase
+        self.path = os.path.join(dumpDir, JOURNAL_FILEPATH % phase)
+        self.entries: Dict[str, Tuple[str, Optional[str]]] = {} # key: (status, reason)
+        self._lock = threading.Lock()
+        self._f = None
+
+        self._load()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _load(self):
+        for entry in iter_jsonl(self.path):
+            self.entries[entry['key']] = (entry['status'], entry.get('reason'))
+
+    def _open(self):
+        if self._f is None:
+            smkdirs(self.dumpDir, '/dumpMeta')
+            self._f = open_jsonl(self.path)
+        return self._f
+
+    def status(self, key: str) -> Optional[str]:
+        """ `DONE`, `FAILED`, `SKIPPED` or `None` (not finished yet) """
+        entry = self.entries.get(key)
+        return entry[0] if entry else None
+
+    def is_finished(self, key: str) -> bool:
+        """ done or skipped, failed items are tried again """
+        return self.status(key) in (DONE, SKIPPED)
+
+    def failed(self) -> List[str]:
+        return [key for key, (status, _) in self.entries.items() if status == FAILED]
+
+    def counts(self) -> Dict[str, int]:
+        counts = {DONE: 0, FAILED: 0, SKIPPED: 0}
+        for status, _ in self.entries.values():
+            counts[status] = counts.get(status, 0) + 1
+        return counts
+
+    def record(self, key: str, status: str, reason=None):
+        reason = None if reason is None else (str(reason) or type(reason).__name__)
+        entry = {
+            'phase': self.phase,
+            'key': key,
+            'status': status,
+            'reason': reason,
+            'time': round(time.time(), 3),
+        }
+        with self._lock:
+            append_jsonl(self._open(), entry)
+            self.entries[key] = (status, reason)
+
+    def close(self):
+        with self._lock:
+            if self._f is not None:
+                self._f.close()
+            self._f = None
@@ -0,0 +1,39 @@
+import json
+import os
+from typing import IO, Iterator
+
+from pukiWikiDumper.utils.util import uopen
+
+
+def iter_jsonl(path: str) -> Iterator[dict]:
+    """ Entries of an append-only JSONL file (nothing if it doesn't exist).
+    Blank lines and lines torn by a crash mid-write are skipped. """
+    if not os.path.exists(path):
+        return
+    with uopen(path, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError: # torn write
+                continue
+
+
+def open_jsonl(path: str) -> IO[str]:
+    """ Open an append-only JSONL file for appending, its directory must exist """
+    torn = False
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        with open(path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            torn = f.read(1) != b'\n'
+    f = uopen(path, 'a')
+    if torn: # make sure a torn line doesn't swallow the next entry
+        f.write('\n')
+    return f
+
+
+def append_jsonl(f: IO[str], entry: dict):
+    """ One line per entry, flushed so that a crash loses at most the line being written """
+    f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    f.flush()
@@ -0,0 +1,274 @@
+import atexit
+import builtins
+import json
+import queue
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+from rich import print as rprint
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVELS = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR}
+LEVEL_NAMES = {level: name for name, level in LEVELS.items()}
+
+USE_RICH = True
+
+PROGRESS_INTERVAL = 10 # seconds between two progress lines
+
+
+def format_bytes(n: float) -> str:
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if n < 1024:
+            return '%.1f %s' % (n, unit)
+        n /= 1024
+    return '%.1f TiB' % n
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    return '%d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def render(*args, **kwargs):
+    """ `print()` through rich, `[[title]]` shown as `"title"` (rich would take it for markup) """
+    if USE_RICH:
+        try:
+            rprint(*(str(arg).replace('[[', '"').replace(']]', '"') for arg in args), **kwargs)
+            return
+        except Exception: # fallback to builtins.print
+            pass
+    builtins.print(*args, **kwargs)
+
+
+class _Progress:
+    """ Counters of one phase (`Content`, `History`, `Media`), only touched by the writer thread """
+
+    def __init__(self, start: float):
+        self.start = start
+        self.done = 0
+        self.skipped = 0 # already finished by a previous run, not part of the rate
+        self.nbytes = 0
+        self.total: Optional[int] = None
+        self.total_bytes: Optional[int] = None
+
+    def describe(self, name: str, now: float) -> str:
+        s = '%s %d/%s' % (name, self.done + self.skipped, '?' if self.total is None else self.total)
+        elapsed = max(now - self.start, 1e-6)
+        eta = None
+        if self.total_bytes and self.nbytes: # file sizes vary too much to go by count
+            eta = max(self.total_bytes - self.nbytes, 0) / (self.nbytes / elapsed)
+        elif self.total is not None and self.done:
+            eta = max(self.total - self.done - self.skipped, 0) / (self.done / elapsed)
+        return s + (', ETA %s' % format_duration(eta) if eta is not None else '')
+
+
+class Log:
+    """ Console output, progress and the JSONL event log, written by one background thread.
+
+    The calling thread only filters by level and puts a tuple on a queue: formatting,
+    rich rendering and file writes happen on the writer thread, in order.
+    Every `interval` seconds (if anything moved) the writer prints one progress line:
+    `Progress: Content 120/3000, ETA 0:05:55 | 8.1 req/s, 1.2 MiB/s`.
+
+    With an event log (`configure(event_log=...)`), each line is also written there,
+    whatever its level, with requests and other events:
+    `{"time": ..., "event": "log", "level": "info", "msg": "..."}`,
+    `{"time": ..., "event": "request", "method": "GET", "url": ..., "status": 200, "elapsed": 0.12, "bytes": 1234}`.
+    """
+
+    def __init__(self, level: int = INFO, interval: float = PROGRESS_INTERVAL):
+        self.level = level
+        self.interval = interval
+        self._queue = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._events = None
+        self._events_path: Optional[str] = None
+
+        # writer thread only
+        self._progress: Dict[str, _Progress] = {}
+        self._requests = 0
+        self._received = 0
+        self._last_status = time.monotonic()
+        self._last_counts = (0, 0)
+        self._moved = False
+
+    def configure(self, level: Optional[int] = None, event_log: Optional[str] = None,
+                  interval: Optional[float] = None):
+        """ `event_log`: path of the JSONL event log, appended to """
+        self.flush()
+        if level is not None:
+            self.level = level
+        if interval is not None:
+            self.interval = interval
+        if event_log and event_log != self._events_path:
+            if self._events is not None:
+                self._events.close()
+            self._events = open(event_log, 'a', encoding='utf-8')
+            self._events_path = event_log
+
+    def _put(self, item: tuple):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+                    thread.start()
+                    self._thread = thread
+        self._queue.put(item)
+
+    def log(self, level: int, *args, **kwargs):
+        if level >= self.level or self._events is not None:
+            self._put(('line', time.time(), level, args, kwargs))
+
+    def debug(self, *args, **kwargs):
+        self.log(DEBUG, *args, **kwargs)
+
+    def info(self, *args, **kwargs):
+        self.log(INFO, *args, **kwargs)
+
+    def warning(self, *args, **kwargs):
+        self.log(WARNING, *args, **kwargs)
+
+    def error(self, *args, **kwargs):
+        self.log(ERROR, *args, **kwargs)
+
+    def event(self, kind: str, **fields):
+        """ A record for the event log only """
+        if self._events is not None:
+            self._put(('event', time.time(), kind, fields))
+
+    def request(self, method: str, url: str, status: Optional[int], elapsed: float, nbytes: int = 0):
+        """ A response (`status` is `None` if the request failed), for req/s, bytes/s and the event log """
+        self._put(('request', time.time(), method, url, status, elapsed, nbytes))
+
+    def received(self, nbytes: int):
+        """ Bytes of a streamed body (attachment downloads), for bytes/s """
+        self._put(('received', nbytes))
+
+    def progress(self, name: str, done: int = 1, skipped: int = 0, nbytes: int = 0):
+        """ `done` items of phase `name` finished, `skipped` were already finished by a previous run """
+        self._put(('progress', time.monotonic(), name, done, skipped, nbytes))
+
+    def progress_total(self, name: str, items: Optional[int] = None, nbytes: Optional[int] = None):
+        """ How many items (and bytes) phase `name` has, once known """
+        self._put(('total', time.monotonic(), name, items, nbytes))
+
+    def progress_end(self, name: str):
+        self._put(('end', name))
+
+    def flush(self, timeout: Optional[float] = 10):
+        """ Wait until everything logged so far is written """
+        if self._thread is None:
+            return
+        written = threading.Event()
+        self._queue.put(('flush', written))
+        written.wait(timeout)
+
+    def install_excepthook(self):
+        """ Flush before the traceback of an uncaught exception is printed, so what was logged
+        before it comes first. Called by `dump()`, importing the module leaves `sys.excepthook` alone. """
+        if getattr(sys.excepthook, '__log__', None) is self:
+            return
+        previous = sys.excepthook
+
+        def excepthook(*args):
+            self.flush()
+            previous(*args)
+
+        excepthook.__log__ = self
+        sys.excepthook = excepthook
+
+    # writer thread
+
+    def _get_progress(self, name: str, now: float) -> _Progress:
+        if name not in self._progress:
+            self._progress[name] = _Progress(now)
+        return self._progress[name]
+
+    def _write_event(self, record: dict):
+        if self._events is not None:
+            self._events.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+
+    def _handle(self, item: tuple):
+        kind = item[0]
+        if kind == 'line':
+            _, t, level, args, kwargs = item
+            if level >= self.level:
+                render(*args, **kwargs)
+            if self._events is not None:
+                msg = kwargs.get('sep', ' ').join(str(arg) for arg in args)
+                self._write_event({'time': t, 'event': 'log', 'level': LEVEL_NAMES.get(level, level), 'msg': msg})
+        elif kind == 'request':
+            _, t, method, url, status, elapsed, nbytes = item
+            self._requests += 1
+            self._received += nbytes
+            self._moved = True
+            if self.level <= DEBUG:
+                render('Resp: %s %s %s (%dms)' % (method, status if status is not None else 'failed', url, elapsed * 1000))
+            self._write_event({'time': t, 'event': 'request', 'method': method, 'url': url, 'status': status,
+                               'elapsed': round(elapsed, 4), 'bytes': nbytes})
+        elif kind == 'received':
+            self._received += item[1]
+            self._moved = True
+        elif kind == 'progress':
+            _, now, name, done, skipped, nbytes = item
+            progress = self._get_progress(name, now)
+            progress.done += done
+            progress.skipped += skipped
+            progress.nbytes += nbytes
+            self._moved = True
+        elif kind == 'total':
+            _, now, name, items, nbytes = item
+            progress = self._get_progress(name, now)
+            progress.total = items
+            progress.total_bytes = nbytes
+        elif kind == 'end':
+            self._progress.pop(item[1], None)
+        elif kind == 'event':
+            _, t, event, fields = item
+            self._write_event({'time': t, 'event': event, **fields})
+        elif kind == 'flush':
+            if self._events is not None:
+                self._events.flush()
+            item[1].set()
+
+    def _status(self, now: float) -> str:
+        elapsed = max(now - self._last_status, 1e-6)
+        requests, received = self._last_counts
+        parts = [progress.describe(name, now) for name, progress in self._progress.items()]
+        rates = '%.1f req/s, %s/s' % ((self._requests - requests) / elapsed, format_bytes((self._received - received) / elapsed))
+        return 'Progress: ' + (', '.join(parts) + ' | ' if parts else '') + rates
+
+    def _run(self):
+        while True:
+            now = time.monotonic()
+            timeout = max(self._last_status + self.interval - now, 0.0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            try:
+                if item is not None:
+                    self._handle(item)
+                now = time.monotonic()
+                if now - self._last_status >= self.interval:
+                    if self._moved:
+                        render(self._status(now))
+                    self._last_status = now
+                    self._last_counts = (self._requests, self._received)
+                    self._moved = False
+                    if self._events is not None:
+                        self._events.flush()
+            except Exception as e: # never let a bad line stop the writer
+                builtins.print('log-writer: %r' % e)
+                if item is not None and item[0] == 'flush':
+                    item[1].set()
+
+
+log = Log()
+atexit.register(log.flush)
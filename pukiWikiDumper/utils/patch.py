@@ -1,15 +1,35 @@
+import contextlib
+import time
+from typing import Optional
+
 import requests
-from pukiWikiDumper.utils.delay import Delay
-from pukiWikiDumper.utils.util import trim_PHP_warnings
+from pukiWikiDumper.exceptions import ResponseNotCached
+from pukiWikiDumper.utils.adaptive import OVERLOAD_STATUS, AdaptiveConcurrency
+from pukiWikiDumper.utils.encoding import response_encoding
+from pukiWikiDumper.utils.host_limits import HostLimits
+from pukiWikiDumper.utils.log import log
+from pukiWikiDumper.utils.rate_limit import TokenBucket
+from pukiWikiDumper.utils.response_cache import ResponseCache
+from pukiWikiDumper.utils.util import trim_PHP_warnings, trim_PHP_warnings_bytes
+from pukiWikiDumper.utils.util import print_with_lock as print
 
 
 class SessionMonkeyPatch:
     """ Monkey patch `requests.Session.send` to add delay and hard retries
+        (per destination host if `host_limits` is given), and `rate_limit` across all hosts.
+        With `adaptive`, the requests in flight are limited by it and their outcome is fed back to it.
+        With `cache`, complete GET responses are written to it, or, with `replay`, read from it
+        instead of sending anything.
         Monkey patch `requests.Response.text` to trim PHP warnings and handle incorrect encoding
     """
     def __init__(self, session: requests.Session, 
                  msg=None, delay: float=0.0, hard_retries=3,
-                 trim_PHP_warnings: bool = False, remove_PHP_warnings_strict_mode: bool = False):
+                 trim_PHP_warnings: bool = False, remove_PHP_warnings_strict_mode: bool = False,
+                 host_limits: Optional[HostLimits] = None, rate_limit: Optional[TokenBucket] = None,
+                 adaptive: Optional[AdaptiveConcurrency] = None,
+                 cache: Optional[ResponseCache] = None, replay: bool = False):
+        if replay and cache is None:
+            raise ValueError('replay needs a cache')
 
         self.session = session
         self.msg = msg
@@ -19,6 +39,11 @@ class SessionMonkeyPatch:
         self.hard_retries = hard_retries
         self.trim_PHP_warnings = trim_PHP_warnings
         self.trim_PHP_warnings_strict_mode = remove_PHP_warnings_strict_mode
+        self.host_limits = host_limits
+        self.rate_limit = rate_limit
+        self.adaptive = adaptive
+        self.cache = cache
+        self.replay = replay
 
     def hijack(self):
         ''' Don't forget to call `release()` '''
@@ -31,10 +56,42 @@ class SessionMonkeyPatch:
             if hard_retries <= 0:
                 raise ValueError('hard_retries must be positive')
 
+            cacheable = self.cache is not None and request.method == 'GET' and not kwargs.get('stream')
+            if self.replay:
+                r = self.cache.get(request.url, request) if cacheable else None
+                if r is None:
+                    raise ResponseNotCached(request.url)
+                return r
+
+            delay = self.delay if self.host_limits is None else self.host_limits.get(request.url).delay
+
             while hard_retries > 0:
                 try:
-                    Delay(msg=self.msg, delay=self.delay)
-                    return self.old_send_method(request, **kwargs)
+                    # wait while holding the host's slot, so a slot isn't spent on a request
+                    # that can't be sent yet. (the host slot first: a streamed download already holds it)
+                    with self.host_limits.slot(request.url) if self.host_limits is not None else contextlib.nullcontext(), \
+                         self.adaptive.slot() if self.adaptive is not None else contextlib.nullcontext():
+                        if delay > 0: # per thread, --rate is the limit they share
+                            time.sleep(delay)
+                        if self.rate_limit is not None:
+                            self.rate_limit.acquire()
+                        start = time.monotonic()
+                        try:
+                            r = self.old_send_method(request, **kwargs)
+                        except Exception as e:
+                            log.request(request.method, request.url, None, time.monotonic() - start)
+                            if self.adaptive is not None:
+                                self.adaptive.record(error=e)
+                            raise
+                        # a streamed body is counted as it is read (`log.received()`)
+                        log.request(request.method, request.url, r.status_code, time.monotonic() - start,
+                                    0 if kwargs.get('stream') else len(r.content))
+                        if self.adaptive is not None:
+                            record_response(self.adaptive, r, time.monotonic() - start)
+                    if cacheable:
+                        # redirects: the hops are stored by the nested sends first, then the final response
+                        self.cache.store_response(request.url, r)
+                    return r
                 except KeyboardInterrupt:
                     raise
                 except Exception as e:
@@ -50,13 +107,16 @@ class SessionMonkeyPatch:
         def new_text(_self):
             # Handle incorrect encoding
             if _self.encoding is None or _self.encoding == 'ISO-8859-1':
-                _self.encoding = _self.apparent_encoding
-                if _self.encoding is None:
-                    _self.encoding = 'utf-8'
+                _self.encoding = response_encoding(_self) # the site encoding, chardet only if that fails
             if _self.encoding.lower() == 'euc-jp':
                 print('Info: encoding is euc-jp, changing to euc_jisx0213')
                 _self.encoding = 'euc_jisx0213'
 
+            if self.trim_PHP_warnings and _self.content and _ascii_compatible(_self.encoding):
+                # trim the bytes and decode only what is left
+                content = trim_PHP_warnings_bytes(_self.content, strict=self.trim_PHP_warnings_strict_mode)
+                return str(content, _self.encoding, errors='replace')
+
             text = self.old_text_method.fget(_self)
             if self.trim_PHP_warnings:
                 text = trim_PHP_warnings(text, strict=self.trim_PHP_warnings_strict_mode)
@@ -68,3 +128,21 @@ class SessionMonkeyPatch:
         ''' Undo monkey patch '''
         self.session.send = self.old_send_method
         requests.Response.text = self.old_text_method
+
+
+def _ascii_compatible(encoding: str) -> bool:
+    try:
+        return 'a<\n'.encode(encoding) == b'a<\n'
+    except LookupError:
+        return False
+
+
+def record_response(adaptive: AdaptiveConcurrency, r: requests.Response, latency: float):
+    """ Feed `r` to `adaptive`, including the 429/503s `CustomRetry` retried inside urllib3 """
+    retries = getattr(r.raw, 'retries', None)
+    history = retries.history if retries is not None else ()
+    statuses = [h.status for h in history if h.status] + [r.status_code]
+    overloaded = [status for status in statuses if status in OVERLOAD_STATUS]
+    adaptive.record(latency=None if history else latency, # retry sleeps are not latency
+                    status=overloaded[0] if overloaded else r.status_code,
+                    retry_after='Retry-After' in r.headers)
@@ -0,0 +1,44 @@
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    """ At most `rate` requests per second on average and `burst` at once,
+    shared by every thread and event loop of the process.
+
+    Each request takes a token. When there are none left it reserves the next one
+    and sleeps until then, so waiting requests go out evenly spaced, in order.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        if rate <= 0:
+            raise ValueError('rate must be > 0')
+        if burst < 1:
+            raise ValueError('burst must be >= 1')
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """ Take a token, return how long to wait before using it """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
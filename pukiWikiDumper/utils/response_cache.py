@@ -0,0 +1,105 @@
+import hashlib
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+import requests
+import requests.utils
+from requests.structures import CaseInsensitiveDict
+
+from pukiWikiDumper.utils.jsonl import append_jsonl, iter_jsonl, open_jsonl
+from pukiWikiDumper.utils.util import smkdirs
+
+CACHE_INDEX = 'index.jsonl'
+CACHE_BODIES = 'bodies'
+
+
+class ResponseCache:
+    """ Raw HTTP responses (status, headers and body as `Response.content`, before any
+    charset decoding or PHP warning trimming), so a dump can be reprocessed offline with `--replay`.
+
+    Bodies are stored once per content, as `bodies/<sha1[:2]>/<sha1>`.
+    `index.jsonl` maps each URL to its latest response:
+    `{"url": ..., "status": 200, "reason": "OK", "final_url": ..., "headers": {...}, "sha1": ..., "time": ...}`.
+    The body is in place before its index line. The last line of a URL wins.
+
+    Only complete `GET` responses are cached, not streamed ones (attachment downloads).
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self.index: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._index_f = None
+
+        smkdirs(cache_dir, CACHE_BODIES)
+        self._load_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def body_path(self, sha1: str) -> str:
+        return os.path.join(self.cache_dir, CACHE_BODIES, sha1[:2], sha1)
+
+    def _load_index(self):
+        for entry in iter_jsonl(os.path.join(self.cache_dir, CACHE_INDEX)):
+            self.index[entry['url']] = entry
+
+    def _open(self):
+        if self._index_f is None:
+            self._index_f = open_jsonl(os.path.join(self.cache_dir, CACHE_INDEX))
+        return self._index_f
+
+    def store(self, url: str, status: int, reason: Optional[str], final_url: str, headers, body: bytes):
+        sha1 = hashlib.sha1(body).hexdigest()
+        path = self.body_path(sha1)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = '%s.%d.tmp' % (path, threading.get_ident())
+            with open(tmp, 'wb') as f:
+                f.write(body)
+            os.replace(tmp, path)
+        entry = {
+            'url': url,
+            'status': status,
+            'reason': reason,
+            'final_url': final_url,
+            'headers': dict(headers),
+            'sha1': sha1,
+            'time': time.time(),
+        }
+        with self._lock:
+            append_jsonl(self._open(), entry)
+            self.index[url] = entry
+
+    def store_response(self, url: str, r: requests.Response):
+        self.store(url, r.status_code, r.reason, r.url, r.headers, r.content)
+
+    def get(self, url: str, request: Optional[requests.PreparedRequest] = None) -> Optional[requests.Response]:
+        """ The cached response to `url` (as `requests` would have built it), `None` if there is none """
+        with self._lock:
+            entry = self.index.get(url)
+        if entry is None:
+            return None
+        with open(self.body_path(entry['sha1']), 'rb') as f:
+            body = f.read()
+        r = requests.Response()
+        r.status_code = entry['status']
+        r.reason = entry['reason']
+        r.url = entry['final_url']
+        r.headers = CaseInsensitiveDict(entry['headers'])
+        r.encoding = requests.utils.get_encoding_from_headers(r.headers)
+        r.request = request
+        r._content = body
+        r._content_consumed = True
+        return r
+
+    def close(self):
+        with self._lock:
+            if self._index_f is not None:
+                self._index_f.close()
+            self._index_f = None
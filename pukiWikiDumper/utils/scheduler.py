@@ -0,0 +1,111 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Tuple
+
+from pukiWikiDumper.utils.util import print_with_lock as print
+
+
+class Scheduler:
+    """ A fixed pool of long-lived worker threads fed from a bounded work queue.
+
+    `submit()` blocks while `workers + backlog` tasks are pending, so producers
+    never run far ahead of the workers.
+
+    Exceptions escaping a task are collected in `errors` as `(item, exception)`.
+    Unless `ignore_errors` is set, the first one stops the scheduler: queued tasks
+    are skipped and the error is re-raised by `submit()` / `join()`.
+    """
+
+    def __init__(self, workers: int = 1, backlog: Optional[int] = None,
+                 ignore_errors: bool = False, name: str = 'worker'):
+        if workers < 1:
+            raise ValueError('workers must be >= 1')
+        backlog = workers if backlog is None else backlog
+
+        self.workers = workers
+        self.ignore_errors = ignore_errors
+        self.errors: List[Tuple[Any, BaseException]] = []
+        self.submitted = 0
+        self.finished = 0
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(workers + backlog)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            # e.g. KeyboardInterrupt: don't start queued tasks, only wait for running ones.
+            self._stopped.set()
+            self._executor.shutdown(wait=True)
+            return False
+        self.join()
+        return False
+
+    def _run(self, fn: Callable, item, args, kwargs):
+        try:
+            if not self._stopped.is_set():
+                fn(item, *args, **kwargs)
+        except Exception as e:
+            with self._lock:
+                self.errors.append((item, e))
+            if self.ignore_errors:
+                print(threading.current_thread().name, 'Error in sub thread: (', e, ') ignored')
+            else:
+                self._stopped.set()
+        finally:
+            with self._lock:
+                self.finished += 1
+            self._slots.release()
+
+    def raise_for_error(self):
+        """ Re-raise the first fatal error, if any. """
+        if self.errors and not self.ignore_errors:
+            raise self.errors[0][1]
+
+    def submit(self, fn: Callable, item, *args, **kwargs):
+        """ Schedule `fn(item, *args, **kwargs)`, blocking while the queue is full. """
+        self.raise_for_error()
+        self._slots.acquire()
+        with self._lock:
+            self.submitted += 1
+        self._executor.submit(self._run, fn, item, args, kwargs)
+
+    @property
+    def pending(self) -> int:
+        with self._lock:
+            return self.submitted - self.finished
+
+    def join(self):
+        """ Wait for all submitted tasks, then re-raise the first fatal error, if any. """
+        self._executor.shutdown(wait=True)
+        self.raise_for_error()
+
+
+class PhaseThread(threading.Thread):
+    """ Runs a whole dump phase next to the main thread.
+
+    `result()` waits for it, then returns its return value or re-raises its exception.
+    A daemon thread, so it doesn't keep the process alive once the main thread fails.
+    """
+
+    def __init__(self, fn: Callable[[], Any], name: str = 'phase'):
+        super().__init__(name=name, daemon=True)
+        self._fn = fn
+        self._result = None
+        self._error: Optional[BaseException] = None
+
+    def run(self):
+        try:
+            self._result = self._fn()
+        except BaseException as e:
+            self._error = e
+
+    def result(self):
+        self.join()
+        if self._error is not None:
+            raise self._error
+        return self._result
@@ -2,16 +2,20 @@
 import http.cookiejar
 import requests.utils
 import json
-import queue
 import time
+from typing import Dict, Tuple
 
 import requests
 import urllib3
 
 from pukiWikiDumper.utils.util import uopen
+from pukiWikiDumper.utils.util import print_with_lock as print
 
+DEFAULT_POOL_SIZE = 10 # requests' default
 
-def createSession(retries=5, user_agent=None):
+
+def createSession(retries=5, user_agent=None, pool_size=DEFAULT_POOL_SIZE):
+    """ `pool_size`: connections kept alive per host, should be >= the concurrency (see `set_pool_size()`) """
     session = requests.Session()
     try:
         from requests.adapters import HTTPAdapter
@@ -19,31 +23,10 @@ def createSession(retries=5, user_agent=None):
 
         # Courtesy datashaman https://stackoverflow.com/a/35504626
         class CustomRetry(Retry):
-            def increment(self, method=None, url=None, *args, **kwargs):
-                if '_pool' in kwargs:
-                    # type: urllib3.connectionpool.HTTPSConnectionPool
-                    conn = kwargs['_pool']
-                    if 'response' in kwargs:
-                        try:
-                            # drain conn in advance so that it won't be put back into conn.pool
-                            kwargs['response'].drain_conn()
-                        except:
-                            pass
-                    # Useless, retry happens inside urllib3
-                    # for adapters in session.adapters.values():
-                    #     adapters: HTTPAdapter
-                    #     adapters.poolmanager.clear()
-
-                    # Close existing connection so that a new connection will be used
-                    if hasattr(conn, 'pool'):
-                        pool = conn.pool  # type: queue.Queue
-                        try:
-                            # Don't directly use this, This closes connection pool by making conn.pool = None
-                            conn.close()
-                        except:
-                            pass
-                        conn.pool = pool
-                return super(CustomRetry, self).increment(method=method, url=url, *args, **kwargs)
+            # No need to close the connection pool on a retry: urllib3 already closes the
+            # connection a request failed on, and drains the response of a status retry so
+            # its connection goes back to the pool. Only the bad connection is dropped,
+            # the ones of the other threads stay alive.
 
             def sleep(self, response=None):
                 retry_after = self.get_retry_after(response)
@@ -62,8 +45,8 @@ def createSession(retries=5, user_agent=None):
             allowed_methods=['DELETE', 'PUT', 'GET',
                              'OPTIONS', 'TRACE', 'HEAD', 'POST']
         )
-        session.mount("https://", HTTPAdapter(max_retries=__retries__))
-        session.mount("http://", HTTPAdapter(max_retries=__retries__))
+        session.mount("https://", HTTPAdapter(max_retries=__retries__, pool_maxsize=pool_size))
+        session.mount("http://", HTTPAdapter(max_retries=__retries__, pool_maxsize=pool_size))
     except:
         pass
 
@@ -73,6 +56,39 @@ def createSession(retries=5, user_agent=None):
     return session
 
 
+def set_pool_size(session: requests.Session, pool_size: int):
+    """ Keep up to `pool_size` connections alive per host, so no thread has to open
+    a new connection (and TLS handshake) because the pool was full.
+
+    Pools created before the call are dropped. """
+    from requests.adapters import HTTPAdapter
+    for adapter in session.adapters.values():
+        if isinstance(adapter, HTTPAdapter) and adapter._pool_maxsize != pool_size:
+            adapter.poolmanager.clear()
+            adapter._pool_maxsize = pool_size
+            adapter.init_poolmanager(adapter._pool_connections, pool_size, block=adapter._pool_block)
+
+
+def connection_stats(session: requests.Session) -> Dict[str, Tuple[int, int]]:
+    """ `{host: (connections opened, requests sent)}` of the pools still alive.
+    `requests - opened` were sent on a reused (kept-alive) connection. """
+    stats: Dict[str, Tuple[int, int]] = {}
+    for adapter in set(session.adapters.values()):
+        poolmanager = getattr(adapter, 'poolmanager', None)
+        if poolmanager is None:
+            continue
+        for key in poolmanager.pools.keys():
+            pool = poolmanager.pools[key]
+            opened, sent = stats.get(pool.host, (0, 0))
+            stats[pool.host] = (opened + pool.num_connections, sent + pool.num_requests)
+    return stats
+
+
+def print_connection_stats(session: requests.Session):
+    for host, (opened, sent) in connection_stats(session).items():
+        print('Connections: %s: %d opened, %d requests (%d reused)' % (host, opened, sent, max(0, sent - opened)))
+
+
 def load_cookies(session: requests.Session, cookies_file: str) -> bool:
     with uopen(cookies_file, 'r') as f: # cookies.txt or cookies.json
         if cookies_file.endswith('.json'):
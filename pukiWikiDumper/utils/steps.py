@@ -0,0 +1,47 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Generator, List, Optional, TypeVar, Union
+
+import requests
+
+T = TypeVar('T')
+
+# A fetch written once for both engines: the generator yields a URL (or a list of URLs,
+# fetched concurrently) and is sent the response (the list of responses). A failed
+# request is raised into it at the `yield`. What it returns is the result.
+Steps = Generator[Union[str, List[str]], Any, T]
+
+
+def drive(steps: Steps[T], get: Callable[[str], requests.Response],
+          get_all: Optional[Callable[[List[str]], List[requests.Response]]] = None) -> T:
+    """ Run `steps` with blocking requests, `get_all` defaults to one `get` after the other """
+    if get_all is None:
+        get_all = lambda urls: [get(url) for url in urls]
+    try:
+        request = next(steps)
+        while True:
+            try:
+                response = get_all(request) if isinstance(request, list) else get(request)
+            except Exception as e:
+                request = steps.throw(e)
+            else:
+                request = steps.send(response)
+    except StopIteration as stop:
+        return stop.value
+
+
+async def drive_async(steps: Steps[T], get: Callable[[str], Awaitable[requests.Response]],
+                      get_all: Optional[Callable[[List[str]], Awaitable[List[requests.Response]]]] = None) -> T:
+    """ `drive()` for `--engine async`, `get_all` defaults to `asyncio.gather()` """
+    if get_all is None:
+        get_all = lambda urls: asyncio.gather(*(get(url) for url in urls))
+    try:
+        request = next(steps)
+        while True:
+            try:
+                response = await (get_all(request) if isinstance(request, list) else get(request))
+            except Exception as e:
+                request = steps.throw(e)
+            else:
+                request = steps.send(response)
+    except StopIteration as stop:
+        return stop.value
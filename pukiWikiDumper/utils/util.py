@@ -1,20 +1,17 @@
-import builtins
 import json
 import os
 import re
 import sys
 import threading
 import time
-from typing import Dict, Optional, List
+from typing import Dict, Iterable, Iterator, Optional, List
 from urllib.parse import unquote, urlparse, urljoin
-from rich import print as rprint
 import requests
 from slugify import slugify
 
-USE_RICH = True
+from pukiWikiDumper.utils.log import log
 
 fileLock = threading.Lock()
-printLock = threading.Lock()
 
 
 def check_int(s: str = ''):
@@ -28,19 +25,8 @@ def check_int(s: str = ''):
         return None
 
 def print_with_lock(*args, **kwargs):
-    printLock.acquire()
-    if USE_RICH:
-        # replace [[ and ]] with "
-        try:
-            rich_args = args
-            rich_args = [re.sub(r'\[\[', '\"', str(arg)) for arg in rich_args]
-            rich_args = [re.sub(r'\]\]', '\"', str(arg)) for arg in rich_args]
-            rprint(*rich_args, **kwargs)
-        except Exception: # fallback to builtins.print
-            builtins.print(*args, **kwargs)
-    else:
-        builtins.print(*args, **kwargs)
-    printLock.release()
+    """ `print()` at `INFO` level, written by the log thread (see `utils.log`) """
+    log.info(*args, **kwargs)
 
 
 def avoidSites(url: str, session: requests.Session):
@@ -60,11 +46,13 @@ def avoidSites(url: str, session: requests.Session):
         print('Error: cannot get robots.txt', e)        
     
     if exit_:
+        log.flush()
         sys.exit(0)
 
     site = urlparse(url).netloc
     avoidList = ['pukiwiki.sourceforge.io']  # TODO: Add more sites
     if site in avoidList:
+        log.flush() # the prompt must come after what was printed before
         if input('\nWarning:\nYou are trying to dump '+site+', which is in the avoid list. \n' +
                  'If you just want to test ' +
                  'if this program can dump pukiwiki successfully, please DO NOT do this, ' +
@@ -210,6 +198,32 @@ def load_pages(pagesFilePath) -> Optional[List[Dict]]:
     return None
 
 
+def iter_saved_pages(pagesFilePath) -> Iterator[Dict]:
+    """ `load_pages()`, one line at a time """
+    with uopen(pagesFilePath, 'r') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def count_lines(filePath) -> int:
+    with open(filePath, 'rb') as f:
+        return sum(chunk.count(b'\n') for chunk in iter(lambda: f.read(1024 * 1024), b''))
+
+
+def save_pages_as_we_go(pagesFilePath, pages: Iterable[Dict]) -> Iterator[Dict]:
+    """ Yield `pages`, appending each one to `<pagesFilePath>.tmp` first.
+
+    The file is renamed to `pagesFilePath` once `pages` is exhausted, so an
+    interrupted enumeration is redone on resume.
+    """
+    with uopen(pagesFilePath + '.tmp', 'w') as f:
+        for page in pages:
+            f.write(json.dumps(page, ensure_ascii=False) + '\n')
+            yield page
+    os.replace(pagesFilePath + '.tmp', pagesFilePath)
+
+
 def uopen(*args, **kwargs):
     """ I dont wanna type `encoding=utf8` anymore.
     Made for Windows compatibility :-( """
@@ -234,61 +248,114 @@ WARNINGS_TO_REMOVE = tuple([
     '<error>'
     # add more if needed
 ])
-
-def trim_PHP_warnings(html_or_text: str, strict: bool = False) -> str:
+WARNINGS_TO_REMOVE_BYTES = tuple(warning.encode('ascii') for warning in WARNINGS_TO_REMOVE)
+
+# line boundaries of str.splitlines() (the ASCII ones for bytes)
+_RE_LINE_END = re.compile('\r\n|[\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]')
+_RE_LINE_END_BYTES = re.compile(rb'\r\n|[\n\r\x0b\x0c\x1c\x1d\x1e]')
+
+
+class PHPWarningLog:
+    """ What `trim_PHP_warnings()` removed, printed in batches instead of line by line:
+    each distinct warning once (up to `max_samples`), and `summary()` at the end. """
+
+    def __init__(self, max_samples: int = 20):
+        self.max_samples = max_samples
+        self.responses = 0
+        self.lines = 0
+        self.chars = 0
+        self.unsafe = 0
+        self.single_line = 0
+        self._samples = set()
+        self._lock = threading.Lock()
+
+    def record(self, removed, unsafe: bool = False):
+        if isinstance(removed, bytes):
+            removed = removed.decode('utf-8', 'replace')
+        lines = [line.strip() for line in removed.splitlines() if line.strip()]
+        new = []
+        with self._lock:
+            self.responses += 1
+            self.lines += len(lines)
+            self.chars += len(removed)
+            self.unsafe += unsafe
+            for line in lines:
+                if len(self._samples) < self.max_samples and line not in self._samples:
+                    self._samples.add(line)
+                    new.append(line)
+        if new:
+            print_with_lock('Removing PHP warnings%s (each shown once):\n  %s' % (
+                ' (HTML header not found, unsafely)' if unsafe else '', '\n  '.join(new)))
+
+    def record_single_line(self):
+        with self._lock:
+            self.single_line += 1
+            first = self.single_line == 1
+        if first:
+            print_with_lock('Warning: cannot remove PHP warnings in single line text')
+
+    def summary(self) -> str:
+        return ('PHP warnings: removed %d lines (%d chars) from %d responses, %d without an HTML header, '
+                '%d single line responses left as is' % (self.lines, self.chars, self.responses, self.unsafe, self.single_line))
+
+
+php_warning_log = PHPWarningLog()
+
+
+def _trim_PHP_warnings(text, strict: bool, markers, warnings, line_end: re.Pattern, log: Optional[PHPWarningLog]):
+    """ `trim_PHP_warnings()` for `str` or `bytes`: slices at the start of the line of the first
+    `<!DOCTYPE html`/`<html`, or after the leading lines that look like warnings. """
+    index = -1
+    for marker in markers:
+        # only look before the other marker
+        i = text.find(marker, 0, len(text) if index == -1 else index + len(marker) - 1)
+        if i != -1:
+            index = i
+    if index != -1:
+        line_start = 0
+        for m in line_end.finditer(text, 0, index): # the warnings before the document, usually a few lines
+            line_start = m.end()
+        if line_start == 0:
+            m = line_end.search(text, index)
+            if index > 0 and (m is None or m.end() == len(text)) and log is not None:
+                log.record_single_line()
+            return text
+        if log is not None:
+            log.record(text[:line_start])
+        return text[line_start:]
+
+    if strict:
+        return text
+
+    pos = 0
+    while pos < len(text):
+        if not text.startswith(warnings, pos):
+            break
+        m = line_end.search(text, pos)
+        pos = m.end() if m else len(text)
+    if pos and log is not None:
+        log.record(text[:pos], unsafe=True)
+    return text[pos:]
+
+
+def trim_PHP_warnings(html_or_text: str, strict: bool = False, log: Optional[PHPWarningLog] = php_warning_log) -> str:
     """ Trim PHP warnings in HTML or wikitext (Cannot handle single line HTML)
-    
-    param: `strict`: if `True`, only remove warnings when found `<html` 
+
+    param: `strict`: if `True`, only remove warnings when found `<html`
     or `<!DOCTYPE html`(return original text if not found).
+    param: `log`: where to report what was removed (`None`: nowhere)
     """
+    return _trim_PHP_warnings(html_or_text, strict, ('<!DOCTYPE html', '<html'), WARNINGS_TO_REMOVE, _RE_LINE_END, log)
 
-    doc_type_is_html_TAG = '<!DOCTYPE html' in html_or_text
-    html_TAG = '<html' in html_or_text
-
-    if strict and not (doc_type_is_html_TAG or html_TAG):
-        return html_or_text
-
-    lines = html_or_text.splitlines(keepends=True) # keepends=True to keep \n
-
-    if len(lines) == 1 and (doc_type_is_html_TAG or html_TAG):
-        print('Warning: cannot remove dokuwiki warnings in single line text')
-        return html_or_text # original text
-
-    new_text = ''
-    in_document = False
-    for line in lines:
-        if in_document:
-            new_text += line
-            continue
-
-        if ((doc_type_is_html_TAG and '<!DOCTYPE html' in line) or
-            (html_TAG             and '<html'          in line)
-        ):
-            in_document = True
-            new_text = line # first line
-            continue
-        elif (doc_type_is_html_TAG or html_TAG):
-            # remove anything before '<!DOCTYPE html' or '<html'
-            print('Removing PHP warning: ' + line.strip())
-            continue
-
-        # here: in_document == False, doc_type_is_html_TAG == False, html_TAG == False
-        if (line.startswith(WARNINGS_TO_REMOVE)):
-            print('(HTML header not found) removing PHP warning (unsafely): ' + line.strip())
-            continue
-        else:
-            in_document = True
-            # print('The line is not PHP warning (if it is, please report an issue): ' + line.strip())
-            new_text = line # first line
-            continue
-
-    def help_wanted(msg: str = ''):
-        print_with_lock(msg) # with color
-    if html_or_text != new_text:
-        help_wanted("[yellow]Notice: trim_PHP_warnings() needs more sample sites to test. "
-                "Please feedback if you found some warnings are not removed.[/yellow]")
-
-    return new_text
+
+def trim_PHP_warnings_bytes(content: bytes, strict: bool = False, log: Optional[PHPWarningLog] = php_warning_log) -> bytes:
+    """ `trim_PHP_warnings()` on the raw response, before decoding it.
+
+    Same result as trimming the decoded text for ASCII-compatible encodings (UTF-8, EUC-JP, Shift_JIS, ...),
+    except that only the ASCII line breaks count (not U+0085, U+2028 or U+2029).
+    """
+    return _trim_PHP_warnings(content, strict, (b'<!DOCTYPE html', b'<html'), WARNINGS_TO_REMOVE_BYTES,
+                              _RE_LINE_END_BYTES, log)
 
 
 class Singleton(type):
@@ -13,6 +13,7 @@ from pukiWikiDumper.utils.util import url2prefix
 from pukiWikiDumper.dump.info import get_info
 from pukiWikiDumper.dump.info import INFO_WIKI_NAME, INFO_RAW_TITLE, INFO_PUKI_URL, INFO_LANG, INFO_ICON_URL
 from pukiWikiDumper.utils.config import get_config
+from pukiWikiDumper.dump.media.blobs import BLOB_DIR, CONFIG_ATTACH_STORAGE
 
 from .__version__ import UPLOADER_VERSION
 
@@ -137,9 +138,15 @@ Dumped with PukiWiki-Dumper v{config.get('pukiWikiDumper_version')}, and uploade
         })
 
 
-    dirs_to_7z = ["wiki","attach"]
+    dirs_to_7z = ["wiki","wikipack","history","attach"]
+    if config.get(CONFIG_ATTACH_STORAGE) == 'blobs':
+        # attach/ only holds hardlinks to attachblobs/, which can recreate it
+        dirs_to_7z[dirs_to_7z.index("attach")] = BLOB_DIR
     mark_files = {"wiki":  "content_dumped.mark", 
+                "wikipack":  "content_dumped.mark", 
+                "history":  "history_dumped.mark",
                 "attach":  "attach_dumped.mark",
+                BLOB_DIR:  "attach_dumped.mark",
                 "dumpMeta": "dumpMeta/", # no .mark file for dumpMeta, check itself instead.
                 }
     filedict = {} # "remote filename": "local filename"
@@ -159,7 +166,7 @@ Dumped with PukiWiki-Dumper v{config.get('pukiWikiDumper_version')}, and uploade
                 raise Exception(f"Directory {dir} is not finished. Please run pukiWikiDumper again. ({mark_files[dir]} not found)")
 
             print(f"Compressing {_dir}...")
-            level = 1 if (dir in ["attach"]) else 5
+            level = 1 if (dir in ["attach", BLOB_DIR]) else 5
             if dir in level0_no_compress:
                 print(f"Packing {dir} with level 0 compression...")
                 level = 0